@@ -4,25 +4,411 @@ AI Assistant Routes
 This module provides API routes for AI assistant functionality.
 """
 
-from flask import Blueprint, jsonify, request, current_app
-from src.services.ai.text_generation import TextGenerationService
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context, g, make_response
+from src.services.ai.text_generation import TextGenerationService, build_template_slots
 from src.services.ai.image_generation import ImageGenerationService
+from src.services.ai.image_variants import CROP_MODES
 from src.services.ai.content_analyzer import ContentAnalyzerService
 from src.services.ai.response_generator import ResponseGeneratorService
+from src.services.ai.conversation_memory import ConversationMemoryService
+from src.services.ai.request_scheduler import get_scheduler, set_request_scope, reset_request_scope
+from src.services.ai.usage_ledger import get_usage_ledger
+from src.services.ai.job_queue import TERMINAL_STATUSES, get_job_queue
+from src.services.ai.image_gc import referenced_image_names
+from src.services.ai.media_pipeline import MediaPipeline
+from src.services.ai.outreach_campaign import CAMPAIGN_ID_PATTERN
+from src.models import db, Conversation, BrandVoiceProfile, ContentTemplate, Post, PostSchedule, SocialAccount
+from src.models import Organization, OrganizationMember, User, AIUsageEntry, IdempotencyRecord, ContentLibrary, MediaAsset
 from src.routes.auth import token_required
+from src.routes.organization import is_org_member
 import os
+import json
+import time
+import uuid
+import hashlib
+import inspect
+import multiprocessing
+from datetime import datetime, timedelta
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
 # Create blueprint
 ai_assistant_bp = Blueprint('ai_assistant', __name__, url_prefix='/api/ai')
 
 # Initialize services
 text_generation_service = TextGenerationService()
-image_generation_service = ImageGenerationService(upload_dir=os.path.join(os.getcwd(), 'uploads', 'images'))
+image_generation_service = ImageGenerationService(
+    upload_dir=os.path.join(os.getcwd(), 'uploads', 'images'),
+    index_path=os.path.join(os.getcwd(), 'data', 'image_index.sqlite3')
+)
 content_analyzer_service = ContentAnalyzerService()
 response_generator_service = ResponseGeneratorService()
+conversation_memory_service = ConversationMemoryService()
+media_pipeline = MediaPipeline(uploads_dir=os.path.join(os.getcwd(), 'uploads'))
+
+# Idempotency settings
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 3600))  # seconds a response is replayed
+IDEMPOTENCY_LOCK_TIMEOUT = 300  # longer than the slowest AI request
+IDEMPOTENCY_WAIT_SECONDS = 60  # how long a duplicate waits for the original request
+IDEMPOTENCY_POLL_SECONDS = 0.25
+
+# Image routes return the URL of the image, and its base64 bytes only when asked for
+IMAGE_RESPONSE_FORMATS = ('url', 'b64_json')
+
+# Operations that can run as asynchronous jobs, with the lane they are scheduled in
+JOB_OPERATIONS = {
+    'generate_text': (text_generation_service.generate_text, 'generation'),
+    'generate_post': (text_generation_service.generate_post, 'generation'),
+    'generate_content_ideas': (text_generation_service.generate_content_ideas, 'generation'),
+    'generate_hashtags': (text_generation_service.generate_hashtags, 'generation'),
+    'generate_image': (image_generation_service.generate_image, 'generation'),
+    'generate_image_preview': (image_generation_service.generate_image_preview, 'generation'),
+    'finalize_image': (image_generation_service.finalize_image, 'generation'),
+    'generate_social_media_image': (image_generation_service.generate_social_media_image, 'generation'),
+    'analyze_sentiment': (content_analyzer_service.analyze_sentiment, 'batch'),
+    'extract_keywords': (content_analyzer_service.extract_keywords, 'batch'),
+    'check_content_moderation': (content_analyzer_service.check_content_moderation, 'batch'),
+    'optimize_content': (content_analyzer_service.optimize_content, 'batch'),
+    'generate_comment_response': (response_generator_service.generate_comment_response, 'batch'),
+    'generate_dm_response': (response_generator_service.generate_dm_response, 'batch')
+}
+AI_JOB_LIBRARY_NAME = 'AI generations'  # content library completed job results are saved to
+JOB_EVENTS_POLL_SECONDS = 0.5
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+def _get_quota_owner(current_user, view_args):
+    """Find the organization the AI requests of a call count against, and its plan"""
+    org_id = view_args.get('org_id')
+    if org_id is None:
+        data = request.get_json(silent=True) or {}
+        org_id = data.get('organization_id')
+        if org_id is not None and not is_org_member(current_user, org_id):
+            org_id = None
+    if org_id is None:
+        member = OrganizationMember.query.filter_by(user_id=current_user).order_by(OrganizationMember.id).first()
+        org_id = member.organization_id if member else None
+    
+    organization = Organization.query.get(org_id) if org_id is not None else None
+    if not organization:
+        # Users outside any organization get their own share
+        user = User.query.get(current_user)
+        return f"user_{current_user}", user.subscription_plan if user else None
+    
+    owner = User.query.get(organization.owner_id)
+    return organization.id, owner.subscription_plan if owner else None
+
+def ai_lane(lane):
+    """Decorator scheduling the AI requests of a route in a priority lane, for the organization of the caller"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            organization_id, subscription_plan = _get_quota_owner(current_user, kwargs)
+            # Reset in teardown, so that streamed responses keep the scope while they generate
+            g.ai_request_scope_token = set_request_scope(lane, organization_id, subscription_plan, current_user)
+            return f(current_user, *args, **kwargs)
+        return decorated
+    return decorator
+
+def idempotent(f):
+    """
+    Decorator honouring the Idempotency-Key header of a route
+    
+    A retry with the same key waits for the original request if it is still
+    running, then gets its stored response replayed. Failed requests release
+    the key, so that they can be retried. Not for streaming routes, whose key
+    would be released while the stream is still generating.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(current_user, *args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'success': False, 'error': 'Idempotency-Key must be at most 255 characters'}), 400
+        
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        deadline = time.time() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            record, claimed = IdempotencyRecord.claim(
+                current_user, request.path, key, fingerprint, IDEMPOTENCY_LOCK_TIMEOUT
+            )
+            if claimed:
+                break
+            if record is None:
+                # Released by the original request in the meantime
+                continue
+            if record.fingerprint != fingerprint:
+                return jsonify({'success': False, 'error': 'Idempotency-Key already used for a different request'}), 422
+            if record.status == 'completed':
+                response = Response(record.response_body, status=record.response_status, mimetype='application/json')
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            if time.time() >= deadline:
+                return jsonify({'success': False, 'error': 'A request with this Idempotency-Key is still in progress'}), 409
+            time.sleep(IDEMPOTENCY_POLL_SECONDS)
+        
+        try:
+            response = make_response(f(current_user, *args, **kwargs))
+        except Exception:
+            record.release()
+            raise
+        
+        try:
+            if response.is_streamed or response.status_code >= 500:
+                record.release()
+            else:
+                record.complete(response.status_code, response.get_data(as_text=True), IDEMPOTENCY_KEY_TTL)
+        except Exception as e:
+            # The response is still valid, a retry will take over the key after the lock timeout
+            db.session.rollback()
+            current_app.logger.error(f"Error storing the response of Idempotency-Key {key}: {str(e)}")
+        return response
+    return decorated
+
+def _main_process_only(start):
+    """Don't start a background component in the worker processes of the image process pools"""
+    # Spawned workers import the app again when it is run as a script, before
+    # their parent process is set, but after their name is
+    @wraps(start)
+    def decorated(state):
+        if multiprocessing.current_process().name == 'MainProcess':
+            start(state)
+    return decorated
+
+@ai_assistant_bp.record_once
+@_main_process_only
+def _start_usage_ledger(state):
+    """Flush the AI usage buffered by the services to the ledger table of the app"""
+    app = state.app
+    
+    def write_entries(entries):
+        with app.app_context():
+            AIUsageEntry.insert_many(entries)
+    
+    get_usage_ledger().start(write_entries)
+
+@ai_assistant_bp.record_once
+@_main_process_only
+def _start_job_queue(state):
+    """Run the asynchronous jobs, saving their results to the content library of the app"""
+    app = state.app
+    
+    def save_result(job, result):
+        with app.app_context():
+            return _save_job_result(job, result)
+    
+    get_job_queue().start({operation: handler for operation, (handler, _) in JOB_OPERATIONS.items()}, save_result)
+
+@ai_assistant_bp.record_once
+@_main_process_only
+def _start_image_gc(state):
+    """Collect the generated images that aren't referenced by media assets or posts of the app"""
+    app = state.app
+    
+    def referenced_names():
+        with app.app_context():
+            pattern = '%/uploads/images/%'
+            # The metadata of an asset holds the URLs of its platform variants
+            urls = db.session.query(MediaAsset.url, MediaAsset.thumbnail_url, MediaAsset._metadata).filter(
+                db.or_(MediaAsset.url.like(pattern), MediaAsset.thumbnail_url.like(pattern), MediaAsset._metadata.like(pattern))
+            ).yield_per(1000)
+            contents = db.session.query(Post._content).filter(Post._content.like(pattern)).yield_per(1000)
+            return referenced_image_names(text for row in urls for text in row) | \
+                referenced_image_names(row[0] for row in contents)
+    
+    image_generation_service.start_image_gc(referenced_names)
+
+def _queue_media_asset(mapper, connection, asset):
+    if asset.type == 'image':
+        Session.object_session(asset).info.setdefault('new_media_assets', []).append((asset.id, asset.url))
+
+def _process_media_assets(session):
+    # Only once committed, so that the pipeline can load the assets
+    for asset_id, url in session.info.pop('new_media_assets', []):
+        media_pipeline.submit(asset_id, url)
+
+def _forget_media_assets(session):
+    session.info.pop('new_media_assets', None)
+
+@ai_assistant_bp.record_once
+@_main_process_only
+def _start_media_pipeline(state):
+    """Generate the thumbnails and metadata of the image assets created in the app"""
+    app = state.app
+    
+    def save(asset_id, processed):
+        with app.app_context():
+            asset = MediaAsset.query.get(asset_id)
+            if not asset:
+                # Deleted in the meantime
+                return
+            asset.thumbnail_url = processed['thumbnail_url'] or asset.thumbnail_url
+            asset.asset_metadata = dict(asset.asset_metadata, **processed['metadata'])
+            db.session.commit()
+    
+    media_pipeline.start(save)
+    # The listeners are global, so they are only added for the first app
+    if not event.contains(MediaAsset, 'after_insert', _queue_media_asset):
+        event.listen(MediaAsset, 'after_insert', _queue_media_asset)
+        event.listen(Session, 'after_commit', _process_media_assets)
+        event.listen(Session, 'after_rollback', _forget_media_assets)
+
+@ai_assistant_bp.teardown_request
+def _reset_ai_request_scope(exc):
+    token = g.pop('ai_request_scope_token', None)
+    if token is not None:
+        try:
+            reset_request_scope(token)
+        except ValueError:
+            # The scope was set in another context
+            pass
+
+def _get_or_create_conversation(current_user, data, channel):
+    """Load the conversation referenced by the request, or start a new one"""
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        return Conversation.query.filter_by(id=conversation_id, user_id=current_user, channel=channel).first()
+    
+    organization_id = data.get('organization_id')
+    if organization_id is not None and not is_org_member(current_user, organization_id):
+        # Only attached to the organizations of the user
+        organization_id = None
+    
+    conversation = Conversation(user_id=current_user, organization_id=organization_id, channel=channel)
+    # Seed the conversation with the history sent by clients that don't store it server-side yet
+    for msg in data.get('conversation_history') or []:
+        conversation.add_message(msg.get('role', 'user'), msg.get('content', ''))
+    db.session.add(conversation)
+    return conversation
+
+def _get_brand_voice_prompt(current_user, data):
+    """Load the compiled prompt of the brand voice profile referenced by the request"""
+    profile_id = data.get('brand_voice_id')
+    if profile_id is None:
+        return None, None
+    
+    profile = BrandVoiceProfile.query.get(profile_id)
+    if not profile or not is_org_member(current_user, profile.organization_id):
+        return None, (jsonify({'success': False, 'error': 'Brand voice not found'}), 404)
+    
+    return profile.compiled_prompt or profile.compile(), None
+
+def _with_image_urls(stored, include_data=False):
+    """Copy an image result of the service, with the URL of the image and of its variants"""
+    def with_url(stored):
+        # Copy the result, as it may be cached by the service
+        image = dict(stored)
+        if image.get('image_path'):
+            # Get the relative path from the full path
+            base_path = os.path.join(os.getcwd(), 'uploads')
+            rel_path = os.path.relpath(image['image_path'], base_path)
+            image['image_url'] = f"/uploads/{rel_path.replace(os.sep, '/')}"
+            # The URL answers 404 until the background write of the image is over
+            image_generation_service.wait_for_image(image)
+            if include_data:
+                image['image_data'] = image_generation_service.load_image_b64(image)
+        return image
+    
+    image = with_url(stored)
+    if 'variants' in image:
+        image['variants'] = {platform: with_url(variant) for platform, variant in image['variants'].items()}
+    return image
+
+def _image_response(result, data):
+    """Build the response of an image route, with the URL of the image instead of its bytes"""
+    if not result.get('success'):
+        return jsonify(result), 500
+    
+    image = _with_image_urls(result['data'], include_data=data.get('response_format') == 'b64_json')
+    return jsonify(dict(result, data=image)), 200
+
+def _social_media_image_error(platform, crop_mode):
+    """Check the platforms and crop mode of a social media image, returning the error response or None"""
+    if not isinstance(platform, str) \
+            and not (isinstance(platform, list) and platform and all(isinstance(item, str) for item in platform)):
+        return jsonify({'success': False, 'error': 'platform must be a string, or platforms a list of strings'}), 400
+    if crop_mode not in CROP_MODES:
+        return jsonify({'success': False, 'error': f"crop_mode must be one of {', '.join(CROP_MODES)}"}), 400
+    return None
+
+def _job_params_error(current_user, operation, params):
+    """Run the checks of the route of an operation on the params of its job, returning the error response or None"""
+    organization_id = params.get('organization_id')
+    if organization_id is not None and not is_org_member(current_user, organization_id):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    if operation == 'generate_post':
+        variants = params.get('variants', 1)
+        if not isinstance(variants, int) or variants < 1:
+            return jsonify({'success': False, 'error': 'variants must be a positive integer'}), 400
+    elif operation == 'generate_social_media_image':
+        return _social_media_image_error(params.get('platform'), params.get('crop_mode', 'saliency'))
+    return None
+
+def _job_to_dict(job):
+    """Get the public fields of a job, with the URLs of the images it generated"""
+    result = job['result']
+    if result and result.get('success') and isinstance(result.get('data'), dict) and 'image_path' in result['data']:
+        result = dict(result, data=_with_image_urls(result['data']))
+    return {
+        'id': job['id'],
+        'operation': job['operation'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'result': result,
+        'media_asset_id': job['media_asset_id'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+
+def _save_job_result(job, result):
+    """Save the result of a completed job as a media asset of its organization, returning the asset ID"""
+    organization_id = job['organization_id']
+    if not isinstance(organization_id, int):
+        # Users outside any organization have no content library
+        return None
+    
+    library = ContentLibrary.query.filter_by(organization_id=organization_id, name=AI_JOB_LIBRARY_NAME).first()
+    if not library:
+        library = ContentLibrary(
+            organization_id=organization_id,
+            name=AI_JOB_LIBRARY_NAME,
+            description='Results of asynchronous AI jobs'
+        )
+        db.session.add(library)
+        db.session.flush()
+    
+    metadata = {'job_id': job['id'], 'operation': job['operation'], 'params': job['params']}
+    data = result['data']
+    if isinstance(data, dict) and data.get('image_path'):
+        # Written by then, as the media pipeline processes the image once the asset is committed
+        image = _with_image_urls(data)
+        asset = MediaAsset(library_id=library.id, type='image', url=image['image_url'], tags=job['operation'])
+        if 'variants' in image:
+            metadata['variants'] = {platform: variant['image_url'] for platform, variant in image['variants'].items()}
+    else:
+        asset = MediaAsset(library_id=library.id, type='text', url=f"/api/ai/jobs/{job['id']}", tags=job['operation'])
+        metadata['content'] = data
+    asset.asset_metadata = metadata
+    db.session.add(asset)
+    db.session.commit()
+    return asset.id
+
+def _compact_conversation(conversation):
+    """Fold older messages into the rolling summary when the history exceeds the token budget"""
+    messages = [{'role': msg.role, 'content': msg.content} for msg in conversation.unsummarized_messages]
+    compacted = conversation_memory_service.compact_history(messages, summary=conversation.summary)
+    if compacted['summarized_count']:
+        conversation.summary = compacted['summary']
+        conversation.summarized_message_count += compacted['summarized_count']
+    return compacted
 
 @ai_assistant_bp.route('/generate-text', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def generate_text(current_user):
     """Generate text using AI"""
     data = request.get_json()
@@ -49,25 +435,33 @@ def generate_text(current_user):
 
 @ai_assistant_bp.route('/generate-post', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def generate_post(current_user):
     """Generate a social media post using AI"""
     data = request.get_json()
     
-    if not data or 'platform' not in data or 'topic' not in data:
+    if not data or not ('platform' in data or 'platforms' in data) or 'topic' not in data:
         return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
     
-    platform = data.get('platform')
+    # A list of platforms generates a post for each one in a single request
+    platform = data.get('platforms') or data.get('platform')
     topic = data.get('topic')
     tone = data.get('tone', 'professionnel')
     length = data.get('length', 280)
     hashtag_count = data.get('hashtag_count', 3)
+    variants = data.get('variants', 1)
+    
+    if not isinstance(variants, int) or variants < 1:
+        return jsonify({'success': False, 'error': 'variants must be a positive integer'}), 400
     
     result = text_generation_service.generate_post(
         platform=platform,
         topic=topic,
         tone=tone,
         length=length,
-        hashtag_count=hashtag_count
+        hashtag_count=hashtag_count,
+        variants=variants
     )
     
     if result.get('success'):
@@ -75,8 +469,111 @@ def generate_post(current_user):
     else:
         return jsonify(result), 500
 
+@ai_assistant_bp.route('/templates/<int:template_id>/generate-posts', methods=['POST'])
+@token_required
+@ai_lane('batch')
+def generate_template_posts(current_user, template_id):
+    """Generate a series of posts from a content template, streaming progress as NDJSON"""
+    data = request.get_json()
+    
+    if not data or 'start_date' not in data or 'end_date' not in data:
+        return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
+    
+    template = ContentTemplate.query.get(template_id)
+    if not template or not is_org_member(current_user, template.organization_id):
+        return jsonify({'success': False, 'error': 'Template not found'}), 404
+    
+    brand_voice_prompt, error_response = _get_brand_voice_prompt(current_user, data)
+    if error_response:
+        return error_response
+    
+    # Posts are scheduled when social accounts are given, and kept as drafts otherwise
+    social_account_ids = data.get('social_account_ids') or []
+    if social_account_ids:
+        accounts = SocialAccount.query.filter(
+            SocialAccount.id.in_(social_account_ids),
+            SocialAccount.organization_id == template.organization_id
+        ).all()
+        if len(accounts) != len(set(social_account_ids)):
+            return jsonify({'success': False, 'error': 'Social account not found'}), 404
+        targets = [{'platform': account.platform, 'social_account_id': account.id} for account in accounts]
+    else:
+        platforms = data.get('platforms') or list(template.platform_specific_settings.keys())
+        if not platforms:
+            return jsonify({'success': False, 'error': 'Missing platforms or social_account_ids parameter'}), 400
+        targets = [{'platform': platform} for platform in platforms]
+    
+    try:
+        slots = build_template_slots(
+            start_date=data['start_date'],
+            end_date=data['end_date'],
+            targets=targets,
+            posting_times=data.get('posting_times')
+        )
+    except (TypeError, ValueError) as e:
+        # TypeError for dates or posting times that aren't strings
+        return jsonify({'success': False, 'error': 'Invalid parameters', 'message': str(e)}), 400
+    
+    organization_id = template.organization_id
+    events = text_generation_service.generate_template_posts(
+        template=template.to_dict(),
+        slots=slots,
+        topic=data.get('topic'),
+        tone=data.get('tone', 'professionnel'),
+        length=data.get('length', 280),
+        hashtag_count=data.get('hashtag_count', 3),
+        brand_voice_prompt=brand_voice_prompt
+    )
+    
+    def stream():
+        generated = []
+        for event in events:
+            if event['type'] == 'post':
+                generated.append(event)
+            if event['type'] != 'completed':
+                yield json.dumps(event, ensure_ascii=False) + '\n'
+                continue
+            
+            # Insert every generated post, and its schedule, in a single transaction
+            try:
+                posts = []
+                for item in sorted(generated, key=lambda item: item['slot']):
+                    post = Post(
+                        organization_id=organization_id,
+                        creator_id=current_user,
+                        content_type='text',
+                        content={
+                            'text': item['content'],
+                            'hashtags': item['hashtags'],
+                            'platform': item['platform'],
+                            'template_id': template_id
+                        },
+                        status='scheduled' if item.get('social_account_id') else 'draft'
+                    )
+                    if item.get('social_account_id'):
+                        post.schedules.append(PostSchedule(
+                            social_account_id=item['social_account_id'],
+                            scheduled_time=datetime.fromisoformat(item['scheduled_time']),
+                            status='pending'
+                        ))
+                    posts.append(post)
+                db.session.add_all(posts)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                yield json.dumps({'type': 'error', 'error': 'Database Error', 'message': str(e)}) + '\n'
+                event = dict(event, completed=0, failed=event['total'])
+                posts = []
+            
+            event['post_ids'] = [post.id for post in posts]
+            yield json.dumps(event, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
 @ai_assistant_bp.route('/generate-content-ideas', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def generate_content_ideas(current_user):
     """Generate content ideas using AI"""
     data = request.get_json()
@@ -101,6 +598,8 @@ def generate_content_ideas(current_user):
 
 @ai_assistant_bp.route('/generate-hashtags', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def generate_hashtags(current_user):
     """Generate hashtags using AI"""
     data = request.get_json()
@@ -125,6 +624,8 @@ def generate_hashtags(current_user):
 
 @ai_assistant_bp.route('/generate-image', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def generate_image(current_user):
     """Generate an image using AI"""
     data = request.get_json()
@@ -132,6 +633,9 @@ def generate_image(current_user):
     if not data or 'prompt' not in data:
         return jsonify({'success': False, 'error': 'Missing prompt parameter'}), 400
     
+    if data.get('response_format', 'url') not in IMAGE_RESPONSE_FORMATS:
+        return jsonify({'success': False, 'error': 'response_format must be url or b64_json'}), 400
+    
     prompt = data.get('prompt')
     model = data.get('model')
     size = data.get('size', '1024x1024')
@@ -144,57 +648,91 @@ def generate_image(current_user):
         quality=quality
     )
     
-    if result.get('success'):
-        # Extract the image path and convert to URL
-        image_data = result['data']
-        if 'image_path' in image_data and image_data['image_path']:
-            # Get the relative path from the full path
-            base_path = os.path.join(os.getcwd(), 'uploads')
-            rel_path = os.path.relpath(image_data['image_path'], base_path)
-            image_data['image_url'] = f"/uploads/{rel_path}"
-        
-        return jsonify(result), 200
-    else:
-        return jsonify(result), 500
+    return _image_response(result, data)
+
+@ai_assistant_bp.route('/generate-image/preview', methods=['POST'])
+@token_required
+@idempotent
+@ai_lane('interactive')
+def generate_image_preview(current_user):
+    """Generate a low-cost draft of an image, to iterate on its prompt"""
+    data = request.get_json()
+    
+    if not data or 'prompt' not in data:
+        return jsonify({'success': False, 'error': 'Missing prompt parameter'}), 400
+    
+    if data.get('response_format', 'url') not in IMAGE_RESPONSE_FORMATS:
+        return jsonify({'success': False, 'error': 'response_format must be url or b64_json'}), 400
+    
+    result = image_generation_service.generate_image_preview(prompt=data.get('prompt'))
+    
+    return _image_response(result, data)
+
+@ai_assistant_bp.route('/generate-image/finalize', methods=['POST'])
+@token_required
+@idempotent
+@ai_lane('generation')
+def finalize_image(current_user):
+    """Generate the final image of a prompt chosen from its previews"""
+    data = request.get_json()
+    
+    if not data or 'prompt' not in data:
+        return jsonify({'success': False, 'error': 'Missing prompt parameter'}), 400
+    
+    if data.get('response_format', 'url') not in IMAGE_RESPONSE_FORMATS:
+        return jsonify({'success': False, 'error': 'response_format must be url or b64_json'}), 400
+    
+    result = image_generation_service.finalize_image(
+        prompt=data.get('prompt'),
+        size=data.get('size', '1024x1024'),
+        quality=data.get('quality', 'standard')
+    )
+    
+    return _image_response(result, data)
 
 @ai_assistant_bp.route('/generate-social-media-image', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def generate_social_media_image(current_user):
     """Generate a social media image using AI"""
     data = request.get_json()
     
-    if not data or 'platform' not in data or 'description' not in data:
+    if not data or not ('platform' in data or 'platforms' in data) or 'description' not in data:
         return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
     
-    platform = data.get('platform')
+    if data.get('response_format', 'url') not in IMAGE_RESPONSE_FORMATS:
+        return jsonify({'success': False, 'error': 'response_format must be url or b64_json'}), 400
+    
+    # A list of platforms generates one master image, cropped to each platform
+    platform = data.get('platforms') or data.get('platform')
     description = data.get('description')
     style = data.get('style', 'moderne')
     mood = data.get('mood', 'positif')
     colors = data.get('colors', 'bleu, blanc')
+    crop_mode = data.get('crop_mode', 'saliency')
+    
+    if 'platforms' in data and not isinstance(data['platforms'], list):
+        return jsonify({'success': False, 'error': 'platforms must be a list of strings'}), 400
+    error_response = _social_media_image_error(platform, crop_mode)
+    if error_response:
+        return error_response
     
     result = image_generation_service.generate_social_media_image(
         platform=platform,
         description=description,
         style=style,
         mood=mood,
-        colors=colors
+        colors=colors,
+        crop_mode=crop_mode
     )
     
-    if result.get('success'):
-        # Extract the image path and convert to URL
-        image_data = result['data']
-        if 'image_path' in image_data and image_data['image_path']:
-            # Get the relative path from the full path
-            base_path = os.path.join(os.getcwd(), 'uploads')
-            rel_path = os.path.relpath(image_data['image_path'], base_path)
-            image_data['image_url'] = f"/uploads/{rel_path}"
-        
-        return jsonify(result), 200
-    else:
-        return jsonify(result), 500
+    return _image_response(result, data)
 
 @ai_assistant_bp.route('/analyze-sentiment', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def analyze_sentiment(current_user):
     """Analyze sentiment of text using AI"""
     data = request.get_json()
@@ -211,8 +749,153 @@ def analyze_sentiment(current_user):
     else:
         return jsonify(result), 500
 
+@ai_assistant_bp.route('/batch-jobs', methods=['POST'])
+@token_required
+@idempotent
+def submit_batch_job(current_user):
+    """Submit a non-urgent analysis of many texts as an offline batch job"""
+    data = request.get_json()
+    
+    if not data or 'operation' not in data or 'texts' not in data:
+        return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
+    
+    if data.get('operation') not in content_analyzer_service.batch_operations:
+        return jsonify({
+            'success': False,
+            'error': f"operation must be one of: {', '.join(content_analyzer_service.batch_operations)}"
+        }), 400
+    
+    texts = data.get('texts')
+    if isinstance(texts, list):
+        texts = {str(index): text for index, text in enumerate(texts)}
+    if not isinstance(texts, dict) or not texts:
+        return jsonify({'success': False, 'error': 'texts must be a non-empty list or object'}), 400
+    
+    # Job IDs are scoped to the user so jobs can only be read by their owner
+    result = content_analyzer_service.submit_analysis_batch(
+        operation=data.get('operation'),
+        texts=texts,
+        count=data.get('count', 10),
+        job_id=f"{current_user}_{uuid.uuid4().hex}"
+    )
+    
+    if result.get('success'):
+        return jsonify(result), 202
+    else:
+        return jsonify(result), 500
+
+@ai_assistant_bp.route('/batch-jobs/<job_id>', methods=['GET'])
+@token_required
+@ai_lane('batch')
+def get_batch_job(current_user, job_id):
+    """Poll a batch job, returning its results by request ID once it is over"""
+    if not job_id.startswith(f"{current_user}_"):
+        return jsonify({'success': False, 'error': 'Batch job not found'}), 404
+    
+    try:
+        job = content_analyzer_service.get_batch_job(job_id)
+    except ValueError:
+        job = None
+    
+    if job is None:
+        return jsonify({'success': False, 'error': 'Batch job not found'}), 404
+    
+    return jsonify({'success': True, 'data': job}), 200
+
+@ai_assistant_bp.route('/jobs', methods=['POST'])
+@token_required
+@idempotent
+def submit_job(current_user):
+    """Queue an AI operation as an asynchronous job, to poll or follow over SSE"""
+    data = request.get_json()
+    
+    if not data or 'operation' not in data:
+        return jsonify({'success': False, 'error': 'Missing operation parameter'}), 400
+    
+    operation = data.get('operation')
+    params = data.get('params', {})
+    if operation not in JOB_OPERATIONS:
+        return jsonify({
+            'success': False,
+            'error': f"operation must be one of: {', '.join(JOB_OPERATIONS)}"
+        }), 400
+    
+    handler, lane = JOB_OPERATIONS[operation]
+    try:
+        if not isinstance(params, dict):
+            raise TypeError('params must be an object')
+        # Unknown params are rejected, like the response_format of the image routes, as jobs return image URLs
+        inspect.signature(handler).bind(**params)
+    except TypeError as e:
+        return jsonify({'success': False, 'error': f"Invalid params for {operation}: {str(e)}"}), 400
+    
+    # The params go to the service as they are, so they get the checks of the synchronous routes
+    error_response = _job_params_error(current_user, operation, params)
+    if error_response:
+        return error_response
+    
+    view_args = {'org_id': params['organization_id']} if params.get('organization_id') is not None else {}
+    organization_id, subscription_plan = _get_quota_owner(current_user, view_args)
+    job = get_job_queue().submit(
+        operation=operation,
+        params=params,
+        lane=lane,
+        user_id=current_user,
+        organization_id=organization_id,
+        subscription_plan=subscription_plan
+    )
+    
+    response = jsonify({'success': True, 'data': _job_to_dict(job)})
+    response.headers['Location'] = f"/api/ai/jobs/{job['id']}"
+    return response, 202
+
+@ai_assistant_bp.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(current_user, job_id):
+    """Poll an asynchronous job, returning its result once it is over"""
+    job = get_job_queue().get(job_id)
+    if job is None or job['user_id'] != current_user:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, 'data': _job_to_dict(job)}), 200
+
+@ai_assistant_bp.route('/jobs/<job_id>/events', methods=['GET'])
+@token_required
+def stream_job_events(current_user, job_id):
+    """Follow an asynchronous job over Server-Sent Events, with an event on each status change"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None or job['user_id'] != current_user:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def stream():
+        status = None
+        last_event = time.time()
+        while True:
+            job = queue.get(job_id)
+            if job is None:
+                return
+            if job['status'] != status:
+                status = job['status']
+                last_event = time.time()
+                yield f"event: {status}\ndata: {json.dumps(_job_to_dict(job), ensure_ascii=False)}\n\n"
+                if status in TERMINAL_STATUSES:
+                    return
+            elif time.time() - last_event >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                # Keeps proxies from closing an idle connection
+                last_event = time.time()
+                yield ": keepalive\n\n"
+            time.sleep(JOB_EVENTS_POLL_SECONDS)
+    
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @ai_assistant_bp.route('/check-content-moderation', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def check_content_moderation(current_user):
     """Check content moderation using AI"""
     data = request.get_json()
@@ -229,8 +912,38 @@ def check_content_moderation(current_user):
     else:
         return jsonify(result), 500
 
+@ai_assistant_bp.route('/triage-interaction', methods=['POST'])
+@token_required
+@idempotent
+@ai_lane('interactive')
+def triage_interaction(current_user):
+    """Analyze sentiment, risk and intent of a comment and draft a reply in one request"""
+    data = request.get_json()
+    
+    if not data or 'comment' not in data:
+        return jsonify({'success': False, 'error': 'Missing comment parameter'}), 400
+    
+    brand_voice_prompt, error_response = _get_brand_voice_prompt(current_user, data)
+    if error_response:
+        return error_response
+    
+    result = content_analyzer_service.triage_interaction(
+        comment=data.get('comment'),
+        post_content=data.get('post_content', ''),
+        brand_voice=data.get('brand_voice'),
+        max_length=data.get('max_length', 200),
+        brand_voice_prompt=brand_voice_prompt
+    )
+    
+    if result.get('success'):
+        return jsonify(result), 200
+    else:
+        return jsonify(result), 500
+
 @ai_assistant_bp.route('/optimize-content', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('generation')
 def optimize_content(current_user):
     """Optimize content using AI"""
     data = request.get_json()
@@ -243,11 +956,17 @@ def optimize_content(current_user):
     target_audience = data.get('target_audience')
     optimization_goals = data.get('optimization_goals')
     
+    brand_voice_prompt, error_response = _get_brand_voice_prompt(current_user, data)
+    if error_response:
+        return error_response
+    
     result = content_analyzer_service.optimize_content(
         text=text,
         platform=platform,
         target_audience=target_audience,
-        optimization_goals=optimization_goals
+        optimization_goals=optimization_goals,
+        brand_voice=data.get('brand_voice'),
+        brand_voice_prompt=brand_voice_prompt
     )
     
     if result.get('success'):
@@ -257,25 +976,40 @@ def optimize_content(current_user):
 
 @ai_assistant_bp.route('/generate-comment-response', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('interactive')
 def generate_comment_response(current_user):
     """Generate a response to a comment using AI"""
     data = request.get_json()
     
-    if not data or 'comment' not in data or 'post_content' not in data or 'brand_voice' not in data:
+    if not data or 'comment' not in data or 'post_content' not in data \
+            or ('brand_voice' not in data and 'brand_voice_id' not in data):
         return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
     
+    brand_voice_prompt, error_response = _get_brand_voice_prompt(current_user, data)
+    if error_response:
+        return error_response
+    
     comment = data.get('comment')
     post_content = data.get('post_content')
     brand_voice = data.get('brand_voice')
     response_type = data.get('response_type', 'standard')
     max_length = data.get('max_length', 200)
+    organization_id = data.get('organization_id')
+    
+    if organization_id is not None and not is_org_member(current_user, organization_id):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     
     result = response_generator_service.generate_comment_response(
         comment=comment,
         post_content=post_content,
         brand_voice=brand_voice,
         response_type=response_type,
-        max_length=max_length
+        max_length=max_length,
+        organization_id=organization_id,
+        author_name=data.get('author_name'),
+        force_generate=data.get('force_generate', False),
+        brand_voice_prompt=brand_voice_prompt
     )
     
     if result.get('success'):
@@ -283,36 +1017,207 @@ def generate_comment_response(current_user):
     else:
         return jsonify(result), 500
 
+@ai_assistant_bp.route('/comment-replies/<int:org_id>/approved', methods=['POST'])
+@token_required
+def approve_comment_reply(current_user, org_id):
+    """Store an approved comment reply so it can be reused for similar comments"""
+    if not is_org_member(current_user, org_id):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    data = request.get_json()
+    
+    if not data or 'comment' not in data or 'reply' not in data:
+        return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
+    
+    entry_id = response_generator_service.reply_store.add_pair(
+        org_id,
+        data.get('comment'),
+        data.get('reply'),
+        response_type=data.get('response_type', 'standard'),
+        author_name=data.get('author_name')
+    )
+    
+    return jsonify({'success': True, 'data': {'reply_id': entry_id}}), 201
+
+@ai_assistant_bp.route('/comment-replies/<int:org_id>/approved/<reply_id>', methods=['DELETE'])
+@token_required
+def delete_approved_comment_reply(current_user, org_id, reply_id):
+    """Remove an approved comment reply from the reuse index"""
+    if not is_org_member(current_user, org_id):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    if not response_generator_service.reply_store.remove_pair(org_id, reply_id):
+        return jsonify({'success': False, 'error': 'Approved reply not found'}), 404
+    
+    return jsonify({'success': True}), 200
+
 @ai_assistant_bp.route('/generate-dm-response', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('interactive')
 def generate_dm_response(current_user):
     """Generate a response to a direct message using AI"""
     data = request.get_json()
     
-    if not data or 'message' not in data or 'conversation_history' not in data or 'brand_voice' not in data:
+    if not data or 'message' not in data or ('brand_voice' not in data and 'brand_voice_id' not in data):
         return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
     
+    brand_voice_prompt, error_response = _get_brand_voice_prompt(current_user, data)
+    if error_response:
+        return error_response
+    
+    conversation = _get_or_create_conversation(current_user, data, 'dm')
+    if not conversation:
+        return jsonify({'success': False, 'error': 'Conversation not found'}), 404
+    
     message = data.get('message')
-    conversation_history = data.get('conversation_history')
     brand_voice = data.get('brand_voice')
     customer_info = data.get('customer_info')
     max_length = data.get('max_length', 500)
     
+    compacted = _compact_conversation(conversation)
+    
     result = response_generator_service.generate_dm_response(
         message=message,
-        conversation_history=conversation_history,
+        conversation_history=compacted['recent_messages'],
         brand_voice=brand_voice,
         customer_info=customer_info,
-        max_length=max_length
+        max_length=max_length,
+        conversation_summary=compacted['summary'],
+        brand_voice_prompt=brand_voice_prompt
     )
     
     if result.get('success'):
+        conversation.add_message('user', message)
+        conversation.add_message('assistant', result['data'])
+        db.session.commit()
+        result['conversation_id'] = conversation.id
         return jsonify(result), 200
     else:
+        db.session.rollback()
         return jsonify(result), 500
 
+@ai_assistant_bp.route('/outreach-campaigns', methods=['POST'])
+@token_required
+@ai_lane('batch')
+def generate_outreach_campaign(current_user):
+    """Generate outreach messages for a list of targets, streaming results as NDJSON"""
+    data = request.get_json()
+    
+    if not data or 'campaign_info' not in data or 'target_profiles' not in data \
+            or 'brand_voice' not in data or 'platform' not in data:
+        return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
+    
+    if not isinstance(data.get('target_profiles'), list):
+        return jsonify({'success': False, 'error': 'target_profiles must be a list'}), 400
+    
+    # Campaign IDs are scoped to the user so campaigns can only be resumed by their owner
+    campaign_id = data.get('campaign_id') or f"{current_user}_{uuid.uuid4().hex}"
+    # Validated before streaming, as errors can't change the status of a started stream
+    if not isinstance(campaign_id, str) or not CAMPAIGN_ID_PATTERN.fullmatch(campaign_id) \
+            or not campaign_id.startswith(f"{current_user}_"):
+        return jsonify({'success': False, 'error': 'Invalid campaign_id'}), 400
+    
+    events = response_generator_service.generate_outreach_campaign(
+        campaign_info=data.get('campaign_info'),
+        target_profiles=data.get('target_profiles'),
+        brand_voice=data.get('brand_voice'),
+        platform=data.get('platform'),
+        max_length=data.get('max_length', 500),
+        campaign_id=campaign_id
+    )
+    
+    def stream():
+        for event in events:
+            yield json.dumps(event, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+@ai_assistant_bp.route('/outreach-campaigns/<campaign_id>', methods=['GET'])
+@token_required
+def get_outreach_campaign(current_user, campaign_id):
+    """Get the messages generated so far for an outreach campaign"""
+    if not campaign_id.startswith(f"{current_user}_"):
+        return jsonify({'success': False, 'error': 'Campaign not found'}), 404
+    
+    try:
+        campaign = response_generator_service.get_outreach_campaign_results(campaign_id)
+    except ValueError:
+        campaign = None
+    
+    if campaign is None:
+        return jsonify({'success': False, 'error': 'Campaign not found'}), 404
+    
+    return jsonify({'success': True, 'data': campaign}), 200
+
+@ai_assistant_bp.route('/generate-faq-response', methods=['POST'])
+@token_required
+@idempotent
+@ai_lane('interactive')
+def generate_faq_response(current_user):
+    """Answer a frequently asked question using the organization FAQ"""
+    data = request.get_json()
+    
+    if not data or 'question' not in data or ('brand_voice' not in data and 'brand_voice_id' not in data):
+        return jsonify({'success': False, 'error': 'Missing required parameters'}), 400
+    
+    brand_voice_prompt, error_response = _get_brand_voice_prompt(current_user, data)
+    if error_response:
+        return error_response
+    
+    if 'organization_id' not in data and 'faq_data' not in data:
+        return jsonify({'success': False, 'error': 'Missing organization_id or faq_data parameter'}), 400
+    
+    organization_id = data.get('organization_id')
+    if organization_id is not None and not is_org_member(current_user, organization_id):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    result = response_generator_service.generate_faq_response(
+        question=data.get('question'),
+        faq_data=data.get('faq_data'),
+        brand_voice=data.get('brand_voice'),
+        max_length=data.get('max_length', 500),
+        organization_id=organization_id,
+        brand_voice_prompt=brand_voice_prompt
+    )
+    
+    if result.get('success'):
+        return jsonify(result), 200
+    else:
+        return jsonify(result), 500
+
+@ai_assistant_bp.route('/faq/<int:org_id>/entries', methods=['POST'])
+@token_required
+def add_faq_entries(current_user, org_id):
+    """Add or update entries in the FAQ index of an organization"""
+    if not is_org_member(current_user, org_id):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('entries'), list):
+        return jsonify({'success': False, 'error': 'Missing entries parameter'}), 400
+    
+    entry_ids = response_generator_service.faq_store.add_entries(org_id, data.get('entries'))
+    
+    return jsonify({'success': True, 'data': {'entry_ids': entry_ids}}), 201
+
+@ai_assistant_bp.route('/faq/<int:org_id>/entries/<entry_id>', methods=['DELETE'])
+@token_required
+def delete_faq_entry(current_user, org_id, entry_id):
+    """Remove an entry from the FAQ index of an organization"""
+    if not is_org_member(current_user, org_id):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    if not response_generator_service.faq_store.remove_entry(org_id, entry_id):
+        return jsonify({'success': False, 'error': 'FAQ entry not found'}), 404
+    
+    return jsonify({'success': True}), 200
+
 @ai_assistant_bp.route('/chat', methods=['POST'])
 @token_required
+@idempotent
+@ai_lane('interactive')
 def chat_with_assistant(current_user):
     """Chat with the AI assistant"""
     data = request.get_json()
@@ -320,8 +1225,11 @@ def chat_with_assistant(current_user):
     if not data or 'message' not in data:
         return jsonify({'success': False, 'error': 'Missing message parameter'}), 400
     
+    conversation = _get_or_create_conversation(current_user, data, 'chat')
+    if not conversation:
+        return jsonify({'success': False, 'error': 'Conversation not found'}), 404
+    
     message = data.get('message')
-    conversation_history = data.get('conversation_history', [])
     
     # Create a system message for the assistant
     system_message = """
@@ -340,22 +1248,31 @@ def chat_with_assistant(current_user):
     Sois professionnel, utile et concis dans tes réponses.
     """
     
-    # Format the conversation history for the API
-    formatted_history = [{"role": "system", "content": system_message}]
-    
-    # Add conversation history if available
-    if conversation_history:
-        for msg in conversation_history:
-            role = msg.get('role', 'user')
-            content = msg.get('content', '')
-            formatted_history.append({"role": role, "content": content})
-    
-    # Add the current message
-    formatted_history.append({"role": "user", "content": message})
-    
     try:
+        # Keep the prompt within the token budget
+        compacted = _compact_conversation(conversation)
+        
+        # Format the conversation history for the API
+        formatted_history = [{"role": "system", "content": system_message}]
+        
+        # Add the summary of older messages if available
+        if compacted['summary']:
+            formatted_history.append({
+                "role": "system",
+                "content": f"Résumé des échanges précédents: {compacted['summary']}"
+            })
+        
+        # Add the recent messages
+        for msg in compacted['recent_messages']:
+            formatted_history.append({"role": msg['role'], "content": msg['content']})
+        
+        # Add the current message
+        formatted_history.append({"role": "user", "content": message})
+        
         # Make the API request
-        response = text_generation_service.client.chat.completions.create(
+        text_generation_service._rate_limit_check()
+        response = text_generation_service._create_chat_completion(
+            'chat',
             model="gpt-4o",
             messages=formatted_history,
             temperature=0.7,
@@ -366,18 +1283,116 @@ def chat_with_assistant(current_user):
         # Extract the assistant's response
         assistant_response = response.choices[0].message.content
         
+        # Store the new turn
+        conversation.add_message('user', message)
+        conversation.add_message('assistant', assistant_response)
+        db.session.commit()
+        
         return jsonify({
             'success': True,
             'data': {
                 'response': assistant_response,
-                'role': 'assistant'
+                'role': 'assistant',
+                'conversation_id': conversation.id
             }
         }), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({
             'success': False,
             'error': 'AI Assistant Error',
             'message': str(e)
         }), 500
 
+@ai_assistant_bp.route('/conversations/<int:conversation_id>', methods=['GET'])
+@token_required
+def get_conversation(current_user, conversation_id):
+    """Get a stored conversation and its messages"""
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user).first()
+    
+    if not conversation:
+        return jsonify({'success': False, 'error': 'Conversation not found'}), 404
+    
+    conversation_data = conversation.to_dict()
+    conversation_data['messages'] = [msg.to_dict() for msg in conversation.messages]
+    
+    return jsonify({'success': True, 'data': conversation_data}), 200
+
+@ai_assistant_bp.route('/usage-stats', methods=['GET'])
+@token_required
+def get_usage_stats(current_user):
+    """Get the token usage of each AI operation since the server started"""
+    services = {
+        'text_generation': text_generation_service,
+        'content_analyzer': content_analyzer_service,
+        'response_generator': response_generator_service,
+        'conversation_memory': conversation_memory_service
+    }
+    
+    return jsonify({
+        'success': True,
+        'data': {name: service.get_usage_stats() for name, service in services.items()}
+    }), 200
+
+@ai_assistant_bp.route('/cache-stats', methods=['GET'])
+@token_required
+def get_cache_stats(current_user):
+    """Get the response cache sizes and near-duplicate cache hit rates of each AI service"""
+    services = {
+        'text_generation': text_generation_service,
+        'image_generation': image_generation_service,
+        'content_analyzer': content_analyzer_service,
+        'response_generator': response_generator_service,
+        'conversation_memory': conversation_memory_service
+    }
+    
+    return jsonify({
+        'success': True,
+        'data': {name: service.get_cache_stats() for name, service in services.items()}
+    }), 200
+
+@ai_assistant_bp.route('/image-gc-stats', methods=['GET'])
+@token_required
+def get_image_gc_stats(current_user):
+    """Get the disk space reclaimed by the garbage collection of the generated images"""
+    return jsonify({'success': True, 'data': image_generation_service.get_image_gc_stats()}), 200
+
+@ai_assistant_bp.route('/usage-ledger', methods=['GET'])
+@token_required
+def get_usage_ledger_rollup(current_user):
+    """Get the token usage and cost of an organization, or of the user, by day"""
+    organization_id = request.args.get('organization_id', type=int)
+    if organization_id is not None and not is_org_member(current_user, organization_id):
+        return jsonify({'success': False, 'error': 'Organization not found'}), 404
+    
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        # The end day is included
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
+    
+    # Include the usage still buffered in memory
+    get_usage_ledger().flush()
+    days = AIUsageEntry.daily_usage(
+        organization_id=organization_id,
+        user_id=None if organization_id is not None else current_user,
+        start=start,
+        end=end
+    )
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'days': days,
+            'total_cost': round(sum(day['cost'] for day in days), 6),
+            'total_tokens': sum(day['prompt_tokens'] + day['completion_tokens'] for day in days)
+        }
+    }), 200
+
+@ai_assistant_bp.route('/scheduler-stats', methods=['GET'])
+@token_required
+def get_scheduler_stats(current_user):
+    """Get the queue depth and wait times of each AI request lane"""
+    return jsonify({'success': True, 'data': get_scheduler().get_stats()}), 200
@@ -0,0 +1,100 @@
+from src.models.base import db, BaseModel
+from datetime import datetime
+
+class AIUsageEntry(db.Model, BaseModel):
+    """AI usage ledger model storing the tokens and cost of each AI request for billing and quotas"""
+    __tablename__ = 'ai_usage_ledger'
+    __table_args__ = (
+        db.Index('ix_ai_usage_org_time', 'organization_id', 'occurred_at'),
+        db.Index('ix_ai_usage_user_time', 'user_id', 'occurred_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.String(32), nullable=False, unique=True)  # makes replayed journal entries idempotent
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    operation = db.Column(db.String(100), nullable=False)
+    model = db.Column(db.String(100), nullable=True)
+    provider = db.Column(db.String(50), nullable=True)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cached_prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0.0)  # USD
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AIUsageEntry {self.operation} - {self.model}>'
+    
+    @classmethod
+    def insert_many(cls, entries):
+        """Bulk insert ledger entries, skipping the ones already stored"""
+        entry_ids = [entry['entry_id'] for entry in entries]
+        existing = {row.entry_id for row in db.session.query(cls.entry_id).filter(cls.entry_id.in_(entry_ids))}
+        
+        rows = []
+        for entry in entries:
+            if entry['entry_id'] in existing:
+                continue
+            existing.add(entry['entry_id'])
+            row = {column: entry.get(column) for column in (
+                'entry_id', 'organization_id', 'user_id', 'operation', 'model', 'provider',
+                'prompt_tokens', 'cached_prompt_tokens', 'completion_tokens', 'cost'
+            )}
+            row['occurred_at'] = datetime.fromisoformat(entry['occurred_at'])
+            rows.append(row)
+        
+        if rows:
+            db.session.bulk_insert_mappings(cls, rows)
+        db.session.commit()
+        return len(rows)
+    
+    @classmethod
+    def daily_usage(cls, organization_id=None, user_id=None, start=None, end=None):
+        """Roll up the usage of an organization or a user by day, operation and model"""
+        day = db.func.date(cls.occurred_at)
+        query = db.session.query(
+            day.label('day'),
+            cls.operation,
+            cls.model,
+            db.func.count(cls.id).label('requests'),
+            db.func.sum(cls.prompt_tokens).label('prompt_tokens'),
+            db.func.sum(cls.cached_prompt_tokens).label('cached_prompt_tokens'),
+            db.func.sum(cls.completion_tokens).label('completion_tokens'),
+            db.func.sum(cls.cost).label('cost')
+        )
+        if organization_id is not None:
+            query = query.filter(cls.organization_id == organization_id)
+        if user_id is not None:
+            query = query.filter(cls.user_id == user_id)
+        if start is not None:
+            query = query.filter(cls.occurred_at >= start)
+        if end is not None:
+            query = query.filter(cls.occurred_at < end)
+        
+        rows = query.group_by(day, cls.operation, cls.model).order_by(day, cls.operation, cls.model).all()
+        return [{
+            'day': str(row.day),
+            'operation': row.operation,
+            'model': row.model,
+            'requests': row.requests,
+            'prompt_tokens': row.prompt_tokens or 0,
+            'cached_prompt_tokens': row.cached_prompt_tokens or 0,
+            'completion_tokens': row.completion_tokens or 0,
+            'cost': round(row.cost or 0.0, 6)
+        } for row in rows]
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'entry_id': self.entry_id,
+            'organization_id': self.organization_id,
+            'user_id': self.user_id,
+            'operation': self.operation,
+            'model': self.model,
+            'provider': self.provider,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_prompt_tokens': self.cached_prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cost': self.cost,
+            'occurred_at': self.occurred_at.isoformat() if self.occurred_at else None
+        }
@@ -5,20 +5,45 @@ This module provides a base class for all AI services.
 """
 
 import time
+import uuid
+import random
+import hashlib
 import logging
 import json
-from typing import Dict, Any, Optional, List, Union
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, Any, Optional, List, Union, Callable, Tuple
 import openai
 from openai import OpenAI
+from .structured_output import StructuredSchema, StructuredOutputError
+from .providers import AIProvider, OpenAIProvider, get_provider, route_operation
+from .batch_jobs import BatchJobStore, OpenAIBatchBackend, LocalBatchBackend, TERMINAL_STATUSES
+from .request_scheduler import get_scheduler, get_request_scope, request_scope, SchedulerTimeoutError
+from .usage_ledger import get_usage_ledger
+from .semantic_cache import SemanticCache, response_similarity
 from .config import (
     OPENAI_API_KEY,
     OPENAI_ORG_ID,
+    DEFAULT_AI_PROVIDER,
     REQUEST_TIMEOUT,
-    MAX_REQUESTS_PER_MINUTE,
     LOG_AI_REQUESTS,
     LOG_AI_RESPONSES,
     ENABLE_RESPONSE_CACHING,
-    CACHE_EXPIRATION
+    CACHE_EXPIRATION,
+    CACHE_STALE_EXPIRATION,
+    CACHE_STALE_IF_ERROR,
+    CACHE_REFRESH_WORKERS,
+    SCHEDULER_LANES,
+    SEMANTIC_CACHE_AUDIT_RATE,
+    SEMANTIC_CACHE_AUDIT_AGREEMENT,
+    ENABLE_STRUCTURED_OUTPUT_REPAIR,
+    STRUCTURED_OUTPUT_REPAIR_MODEL,
+    STRUCTURED_OUTPUT_REPAIR_MAX_TOKENS,
+    BATCH_JOB_DIR,
+    BATCH_BACKEND,
+    BATCH_MAX_REQUESTS
 )
 
 # Configure logging
@@ -28,6 +53,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger('ai_service')
 
+# Background refreshes of stale cached responses, shared by every service
+_cache_refresh_executor = ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+
 class BaseAIService:
     """Base class for AI services"""
     
@@ -37,40 +65,44 @@ class BaseAIService:
             api_key=OPENAI_API_KEY,
             organization=OPENAI_ORG_ID if OPENAI_ORG_ID else None
         )
-        self.request_timestamps = []
         self.cache = {}
+        self.cache_lock = threading.Lock()
+        self.refreshing = set()  # cache keys being refreshed in the background
+        self.semantic_cache = SemanticCache()
+        self.usage_stats = {}
+        self.usage_lock = threading.Lock()
+        self.batch_store = None
         
-    def _rate_limit_check(self) -> None:
-        """Check and enforce rate limits"""
-        current_time = time.time()
-        # Remove timestamps older than 1 minute
-        self.request_timestamps = [ts for ts in self.request_timestamps 
-                                  if current_time - ts < 60]
+    def _rate_limit_check(self, operation: Optional[str] = None) -> None:
+        """Wait for the scheduler shared by every service to grant capacity for a request"""
+        # Operations routed to a local provider make no upstream request
+        if operation and self._get_provider(operation).local:
+            return
+        # The lane and organization come from the request scope set by the caller
+        waited = get_scheduler().acquire()
+        if waited > 1:
+            logger.warning(f"Waited {waited:.2f} seconds for AI capacity")
+    
+    def _get_cache_entry(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached response with its timestamp, fresh or stale"""
+        if not ENABLE_RESPONSE_CACHING:
+            return None
         
-        # Check if we've exceeded the rate limit
-        if len(self.request_timestamps) >= MAX_REQUESTS_PER_MINUTE:
-            sleep_time = 60 - (current_time - self.request_timestamps[0])
-            if sleep_time > 0:
-                logger.warning(f"Rate limit reached. Sleeping for {sleep_time:.2f} seconds")
-                time.sleep(sleep_time)
+        cached_item = self.cache.get(cache_key)
+        if cached_item and time.time() - cached_item['timestamp'] >= CACHE_STALE_IF_ERROR:
+            # Remove items too old to be served even on errors
+            self.cache.pop(cache_key, None)
+            return None
         
-        # Add current timestamp
-        self.request_timestamps.append(time.time())
+        return cached_item
     
     def _get_from_cache(self, cache_key: str) -> Optional[Any]:
         """Get a response from cache if available and not expired"""
-        if not ENABLE_RESPONSE_CACHING:
-            return None
-            
-        if cache_key in self.cache:
-            cached_item = self.cache[cache_key]
-            if time.time() - cached_item['timestamp'] < CACHE_EXPIRATION:
-                logger.info(f"Cache hit for key: {cache_key}")
-                return cached_item['data']
-            else:
-                # Remove expired item
-                del self.cache[cache_key]
-                
+        cached_item = self._get_cache_entry(cache_key)
+        if cached_item and time.time() - cached_item['timestamp'] < CACHE_EXPIRATION:
+            logger.info(f"Cache hit for key: {cache_key}")
+            return cached_item['data']
+        
         return None
     
     def _save_to_cache(self, cache_key: str, data: Any) -> None:
@@ -81,12 +113,498 @@ class BaseAIService:
                 'timestamp': time.time()
             }
     
+    def _get_cached(self, cache_key: str, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Get a response from cache, or compute and cache it
+        
+        A fresh response is returned as is. A stale one is returned immediately
+        until CACHE_STALE_EXPIRATION while compute refreshes it in the background.
+        Past that, compute runs first, and the stale response is only returned if
+        it fails, until CACHE_STALE_IF_ERROR.
+        
+        Args:
+            cache_key: The cache key of the response
+            compute: Function making the upstream requests and returning the response
+            
+        Returns:
+            The response, and whether it is a stale response served because compute failed
+        """
+        cached_item = self._get_cache_entry(cache_key)
+        if cached_item:
+            age = time.time() - cached_item['timestamp']
+            if age < CACHE_EXPIRATION:
+                logger.info(f"Cache hit for key: {cache_key}")
+                return cached_item['data'], False
+            if age < CACHE_STALE_EXPIRATION:
+                logger.info(f"Stale cache hit for key: {cache_key}, refreshing")
+                self._refresh_in_background(cache_key, compute)
+                return cached_item['data'], False
+        
+        try:
+            data = compute()
+        except Exception as e:
+            if not cached_item:
+                raise
+            logger.warning(f"Serving stale cached response after error: {str(e)}")
+            return cached_item['data'], True
+        
+        self._save_to_cache(cache_key, data)
+        return data, False
+    
+    def _refresh_in_background(self, cache_key: str, compute: Callable[[], Any]) -> None:
+        """Recompute a stale cached response, unless it is already being refreshed"""
+        with self.cache_lock:
+            if cache_key in self.refreshing:
+                return
+            self.refreshing.add(cache_key)
+        
+        def refresh():
+            try:
+                self._save_to_cache(cache_key, compute())
+            except Exception as e:
+                logger.warning(f"Error refreshing cached response: {str(e)}")
+            finally:
+                with self.cache_lock:
+                    self.refreshing.discard(cache_key)
+        
+        self._run_in_background(refresh)
+    
+    def _run_in_background(self, fn: Callable[[], Any]) -> None:
+        """Run a cache maintenance function on the shared background pool"""
+        # It counts against the organization of the request, in the lowest priority lane
+        scope = get_request_scope()
+        
+        def run():
+            with request_scope(SCHEDULER_LANES[-1], scope['organization_id'], scope['subscription_plan'], scope['user_id']):
+                fn()
+        
+        _cache_refresh_executor.submit(contextvars.copy_context().run, run)
+    
+    def _get_similar_cached(self,
+                            operation: str,
+                            text: str,
+                            compute: Callable[[], Dict[str, Any]],
+                            **params) -> Dict[str, Any]:
+        """
+        Serve the response of a near-duplicate request, or compute and cache it
+        
+        A sample of near-duplicate hits is recomputed in the background, and the
+        hit counted as false when the two responses disagree.
+        
+        Args:
+            operation: Name of the operation
+            text: Free text of the request, compared to the texts of cached requests
+            compute: Function making the request and returning a formatted response
+            **params: Other parameters of the request, which must match exactly
+            
+        Returns:
+            The formatted response
+        """
+        if not ENABLE_RESPONSE_CACHING:
+            return compute()
+        
+        hit = self.semantic_cache.lookup(operation, text, params)
+        if hit:
+            logger.info(f"Near-duplicate cache hit for {operation}: {hit['digest']} ({hit['similarity']:.2f})")
+            if hit['similarity'] < 1.0 and random.random() < SEMANTIC_CACHE_AUDIT_RATE:
+                self._run_in_background(lambda: self._audit_similar_hit(operation, text, hit, compute, params))
+            return self._format_success_response(hit['data'])
+        
+        result = compute()
+        if result.get('success') and not result.get('stale'):
+            self.semantic_cache.store(operation, text, params, result['data'])
+        return result
+    
+    def _audit_similar_hit(self,
+                           operation: str,
+                           text: str,
+                           hit: Dict[str, Any],
+                           compute: Callable[[], Dict[str, Any]],
+                           params: Dict[str, Any]) -> None:
+        """Compare a near-duplicate hit with the response recomputed for its own request"""
+        try:
+            result = compute()
+        except Exception as e:
+            logger.warning(f"Error auditing near-duplicate cache hit: {str(e)}")
+            return
+        if not result.get('success'):
+            return
+        
+        agreement = response_similarity(hit['data'], result['data'])
+        false_hit = agreement < SEMANTIC_CACHE_AUDIT_AGREEMENT
+        if false_hit:
+            logger.warning(f"False near-duplicate cache hit for {operation}: {hit['digest']} (agreement {agreement:.2f})")
+        self.semantic_cache.record_audit(operation, text, hit, agreement, false_hit)
+        self.semantic_cache.store(operation, text, params, result['data'])
+    
     def _generate_cache_key(self, **kwargs) -> str:
         """Generate a cache key from the request parameters"""
         # Sort the kwargs to ensure consistent key generation
         sorted_items = sorted(kwargs.items())
-        # Convert to a string and hash
-        return json.dumps(sorted_items)
+        # Convert to a string and hash, so that keys don't hold whole prompts
+        return hashlib.sha256(json.dumps(sorted_items).encode('utf-8')).hexdigest()
+    
+    def _get_provider(self, operation: str) -> AIProvider:
+        """Get the provider an operation is routed to"""
+        name = route_operation(operation)
+        if name != DEFAULT_AI_PROVIDER:
+            provider = get_provider(name)
+            if provider.supports(operation):
+                return provider
+            logger.warning(f"Provider {name} doesn't support {operation}, using {DEFAULT_AI_PROVIDER}")
+        return OpenAIProvider(client=self.client)
+    
+    def _create_chat_completion(self, operation: str, context: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        """
+        Make a chat completion request and record its token usage
+        
+        The request is served by the provider the operation is routed to.
+        
+        Args:
+            operation: Name of the service operation making the request
+            context: The structured inputs of the operation, for providers that don't use the prompt
+            **kwargs: Parameters of the chat completion request
+            
+        Returns:
+            The chat completion response
+        """
+        provider = self._get_provider(operation)
+        start_time = time.time()
+        response = provider.create_chat_completion(operation, context or {}, **kwargs)
+        self._record_usage(
+            operation,
+            response,
+            provider.name,
+            time.time() - start_time,
+            model=kwargs.get('model') or getattr(response, 'model', None)
+        )
+        return response
+    
+    def _create_structured_completion(self,
+                                      operation: str,
+                                      structured_schema: StructuredSchema,
+                                      **kwargs) -> Any:
+        """
+        Make a chat completion request constrained to a JSON schema
+        
+        A response that doesn't match the schema is fixed with a single repair
+        request to a cheaper model, instead of repeating the original request.
+        
+        Args:
+            operation: Name of the service operation making the request
+            structured_schema: The compiled schema the response must follow
+            **kwargs: Parameters of the chat completion request
+            
+        Returns:
+            The parsed and validated response
+            
+        Raises:
+            StructuredOutputError: If the response doesn't match the schema, even after repair
+        """
+        response = self._create_chat_completion(
+            operation,
+            response_format=structured_schema.response_format,
+            **kwargs
+        )
+        content = response.choices[0].message.content
+        try:
+            return structured_schema.parse(content)
+        except StructuredOutputError as e:
+            if not ENABLE_STRUCTURED_OUTPUT_REPAIR:
+                raise
+            logger.warning(f"Invalid structured response for {operation}, repairing: {str(e)}")
+            return self._repair_structured_output(operation, structured_schema, content, e)
+    
+    def _repair_structured_output(self,
+                                  operation: str,
+                                  structured_schema: StructuredSchema,
+                                  content: str,
+                                  error: StructuredOutputError) -> Any:
+        """
+        Ask a cheaper model to fix a response that doesn't match its schema
+        
+        Args:
+            operation: Name of the service operation that made the request
+            structured_schema: The compiled schema the response must follow
+            content: The invalid response content
+            error: The validation error of the response
+            
+        Returns:
+            The parsed and validated repaired response
+        """
+        prompt = f"""
+        Corrige le JSON suivant pour qu'il respecte exactement le schéma JSON donné.
+        Conserve les valeurs existantes autant que possible et réponds uniquement avec le JSON corrigé.
+        
+        Schéma: {json.dumps(structured_schema.schema, ensure_ascii=False)}
+        Erreur: {str(error)}
+        JSON à corriger: {content}
+        """
+        
+        response = self._create_chat_completion(
+            f"{operation}_repair",
+            model=STRUCTURED_OUTPUT_REPAIR_MODEL,
+            messages=[
+                {"role": "system", "content": "Tu corriges des réponses JSON invalides et réponds uniquement en format JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=STRUCTURED_OUTPUT_REPAIR_MAX_TOKENS,
+            temperature=0,
+            response_format={"type": "json_object"},
+            timeout=REQUEST_TIMEOUT
+        )
+        return structured_schema.parse(response.choices[0].message.content)
+    
+    def _record_usage(self,
+                      operation: str,
+                      response: Any,
+                      provider: str = DEFAULT_AI_PROVIDER,
+                      latency: float = 0.0,
+                      model: Optional[str] = None) -> None:
+        """
+        Accumulate the token usage, provider and latency of a response for an operation
+        
+        The usage is also recorded in the usage ledger, for the organization and
+        user of the request scope.
+        """
+        usage = getattr(response, 'usage', None)
+        prompt_details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(prompt_details, 'cached_tokens', 0) or 0
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        
+        with self.usage_lock:
+            stats = self.usage_stats.setdefault(operation, {
+                'requests': 0,
+                'prompt_tokens': 0,
+                'cached_prompt_tokens': 0,
+                'completion_tokens': 0,
+                'latency_seconds': 0.0,
+                'providers': {}
+            })
+            stats['requests'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['cached_prompt_tokens'] += cached_tokens
+            stats['completion_tokens'] += completion_tokens
+            stats['latency_seconds'] += latency
+            stats['providers'][provider] = stats['providers'].get(provider, 0) + 1
+        
+        scope = get_request_scope()
+        organization_id = scope['organization_id']
+        try:
+            get_usage_ledger().record(
+                operation,
+                model,
+                provider,
+                prompt_tokens,
+                cached_tokens,
+                completion_tokens,
+                # Users outside any organization are scoped by a string key
+                organization_id=organization_id if isinstance(organization_id, int) else None,
+                user_id=scope.get('user_id')
+            )
+        except Exception as e:
+            # Accounting must never fail the request itself
+            logger.error(f"Error recording usage for {operation}: {str(e)}")
+    
+    def get_usage_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the token usage of each operation since the service started
+        
+        Returns:
+            Dictionary of operation to request count, token totals, requests
+            per provider, and average prompt tokens and latency per request
+        """
+        with self.usage_lock:
+            usage_stats = {}
+            for operation, stats in self.usage_stats.items():
+                usage_stats[operation] = dict(stats, providers=dict(stats['providers']))
+                usage_stats[operation]['avg_prompt_tokens'] = stats['prompt_tokens'] / stats['requests']
+                usage_stats[operation]['avg_latency_seconds'] = stats['latency_seconds'] / stats['requests']
+            return usage_stats
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        Get the size of the response caches and the hit rate of the near-duplicate cache
+        
+        Returns:
+            Dictionary with the number of 'exact_entries', and the 'semantic' cache
+            stats with the hit rate and false hit audits of each operation
+        """
+        return {
+            'exact_entries': len(self.cache),
+            'semantic': self.semantic_cache.get_stats()
+        }
+    
+    def _get_batch_store(self) -> BatchJobStore:
+        """Get the batch job store, created on first use"""
+        if self.batch_store is None:
+            self.batch_store = BatchJobStore(BATCH_JOB_DIR)
+        return self.batch_store
+    
+    def _get_batch_backend(self, name: str = BATCH_BACKEND) -> Any:
+        """Get the backend running batch jobs"""
+        if name == 'local':
+            return LocalBatchBackend(self._complete_batch_request)
+        return OpenAIBatchBackend(self.client)
+    
+    def _complete_batch_request(self,
+                                operation: str,
+                                endpoint: str,
+                                body: Dict[str, Any],
+                                context: Dict[str, Any]) -> Any:
+        """Serve a batch request locally, through the provider of its operation"""
+        if endpoint == '/v1/moderations':
+            return self.client.moderations.create(**body)
+        return self._get_provider(operation).create_chat_completion(operation, context, **body)
+    
+    def _parse_batch_result(self, operation: str, body: Dict[str, Any]) -> Any:
+        """Extract the result of a batch request from its response body"""
+        return body['choices'][0]['message']['content']
+    
+    def submit_batch_job(self,
+                         operation: str,
+                         requests: List[Dict[str, Any]],
+                         endpoint: str = '/v1/chat/completions',
+                         job_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Submit non-urgent requests as an offline batch job
+        
+        Batch requests don't count against the per-minute rate limit of
+        interactive requests.
+        
+        Args:
+            operation: Name of the service operation of the requests
+            requests: The requests, each with a 'request_id', the request 'body',
+                and optionally the structured inputs of the operation as 'context'
+            endpoint: The API endpoint of the requests
+            job_id: Optional identifier of the job, generated if not provided
+            
+        Returns:
+            Dictionary containing the job manifest or error information
+        """
+        try:
+            if not requests:
+                raise ValueError("A batch job needs at least one request")
+            if len(requests) > BATCH_MAX_REQUESTS:
+                raise ValueError(f"A batch job can't have more than {BATCH_MAX_REQUESTS} requests")
+            
+            job_id = job_id or uuid.uuid4().hex
+            
+            # Log the request
+            self._log_request('submit_batch_job', job_id=job_id, operation=operation, request_count=len(requests))
+            
+            store = self._get_batch_store()
+            backend = self._get_batch_backend()
+            manifest = {
+                'job_id': job_id,
+                'operation': operation,
+                'endpoint': endpoint,
+                'backend': backend.name,
+                'status': 'submitting',
+                'request_count': len(requests),
+                'created_at': time.time()
+            }
+            store.create_job(
+                job_id,
+                manifest,
+                [
+                    {'custom_id': str(request['request_id']), 'method': 'POST', 'url': endpoint, 'body': request['body']}
+                    for request in requests
+                ],
+                {str(request['request_id']): request.get('context') or {} for request in requests}
+            )
+            
+            manifest['batch_id'] = backend.submit(store, job_id, manifest)
+            manifest['status'] = 'submitted'
+            store.save_manifest(job_id, manifest)
+            
+            # Log the response
+            self._log_response('submit_batch_job', manifest)
+            
+            return self._format_success_response(manifest)
+            
+        except Exception as e:
+            return self._handle_error(e)
+    
+    def get_batch_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Poll a batch job, and store its results by request ID once it is over
+        
+        Args:
+            job_id: Identifier of the job
+            
+        Returns:
+            The job manifest, with its 'results' once it is over, or None if the job doesn't exist
+        """
+        store = self._get_batch_store()
+        manifest = store.load_manifest(job_id)
+        if manifest is None:
+            return None
+        
+        if manifest['status'] not in TERMINAL_STATUSES:
+            backend = self._get_batch_backend(manifest['backend'])
+            status = backend.retrieve(store, job_id, manifest)
+            manifest['status'] = status['status']
+            
+            if 'output' in status:
+                results = {}
+                for line in status['output']:
+                    response = line.get('response') or {}
+                    if line.get('error') or response.get('status_code') != 200:
+                        error = line.get('error') or response.get('body', {}).get('error') or {}
+                        results[line['custom_id']] = {'success': False, 'error': error.get('message', 'Batch request failed')}
+                        continue
+                    try:
+                        data = self._parse_batch_result(manifest['operation'], response['body'])
+                        results[line['custom_id']] = {'success': True, 'data': data}
+                    except Exception as e:
+                        results[line['custom_id']] = {'success': False, 'error': str(e)}
+                    usage = response['body'].get('usage')
+                    if usage:
+                        self._record_usage(
+                            f"{manifest['operation']}_batch",
+                            SimpleNamespace(usage=SimpleNamespace(**usage)),
+                            provider=backend.name,
+                            model=response['body'].get('model')
+                        )
+                
+                store.save_results(job_id, results)
+                manifest['completed_count'] = sum(1 for result in results.values() if result['success'])
+                manifest['failed_count'] = manifest['request_count'] - manifest['completed_count']
+                manifest['finished_at'] = time.time()
+            
+            store.save_manifest(job_id, manifest)
+        
+        if manifest['status'] in TERMINAL_STATUSES:
+            manifest['results'] = store.load_results(job_id)
+        return manifest
+    
+    def _build_messages(self,
+                        system_prompt: str,
+                        user_prompt: str,
+                        brand_voice_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Build the messages of a chat completion request
+        
+        The brand voice prompt is placed first so that every request of an
+        organization starts with the same prefix, which lets the provider
+        reuse its prompt cache across operations.
+        
+        Args:
+            system_prompt: Instructions specific to the operation
+            user_prompt: The request content
+            brand_voice_prompt: Compiled brand voice profile, if any
+            
+        Returns:
+            List of chat messages
+        """
+        if brand_voice_prompt:
+            system_prompt = f"{brand_voice_prompt}\n\n{system_prompt}"
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
     
     def _log_request(self, service_name: str, **kwargs) -> None:
         """Log an AI request"""
@@ -144,6 +662,18 @@ class BaseAIService:
                 'error': 'Bad Request',
                 'message': str(error)
             }
+        elif isinstance(error, SchedulerTimeoutError):
+            return {
+                'success': False,
+                'error': 'Rate Limit Error',
+                'message': str(error)
+            }
+        elif isinstance(error, StructuredOutputError):
+            return {
+                'success': False,
+                'error': 'Invalid Response',
+                'message': str(error)
+            }
         else:
             return {
                 'success': False,
@@ -151,10 +681,13 @@ class BaseAIService:
                 'message': str(error)
             }
     
-    def _format_success_response(self, data: Any) -> Dict[str, Any]:
-        """Format a successful response"""
-        return {
+    def _format_success_response(self, data: Any, stale: bool = False) -> Dict[str, Any]:
+        """Format a successful response, flagged when it is a stale response served after an error"""
+        response = {
             'success': True,
             'data': data
         }
+        if stale:
+            response['stale'] = True
+        return response
 
@@ -0,0 +1,213 @@
+"""
+Batch Jobs
+
+This module runs non-urgent AI workloads offline: requests are written to a
+JSONL file, submitted through the provider's asynchronous batch API, polled
+for completion, and their results stored by request ID.
+"""
+
+import os
+import re
+import json
+import uuid
+import threading
+from typing import Dict, Any, List, Optional, Callable
+from .config import BATCH_JOB_DIR, BATCH_COMPLETION_WINDOW
+
+# Batch statuses after which a job doesn't change anymore
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def response_to_dict(response: Any) -> Dict[str, Any]:
+    """Convert an API response object into the JSON body returned by the batch API"""
+    if isinstance(response, dict):
+        return response
+    if hasattr(response, 'model_dump'):
+        return response.model_dump()
+    if hasattr(response, '__dict__'):
+        return {key: response_to_dict(value) for key, value in vars(response).items()}
+    if isinstance(response, list):
+        return [response_to_dict(item) for item in response]
+    return response
+
+
+class BatchJobStore:
+    """Stores batch job manifests, request files and results on disk"""
+
+    def __init__(self, storage_dir: str = BATCH_JOB_DIR):
+        """
+        Initialize the batch job store
+
+        Args:
+            storage_dir: Directory where the batch jobs are stored
+        """
+        self.storage_dir = storage_dir
+        self.lock = threading.Lock()
+
+        # Create storage directory if it doesn't exist
+        os.makedirs(self.storage_dir, exist_ok=True)
+
+    def path(self, job_id: str, suffix: str) -> str:
+        """Get the path of a file of a job"""
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', job_id or ''):
+            raise ValueError(f"Invalid batch job ID: {job_id}")
+        return os.path.join(self.storage_dir, f"{job_id}.{suffix}")
+
+    def _write_atomic(self, path: str, lines: List[str]) -> None:
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as temp_file:
+            temp_file.writelines(lines)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+
+    def create_job(self,
+                   job_id: str,
+                   manifest: Dict[str, Any],
+                   requests: List[Dict[str, Any]],
+                   contexts: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Write the request file of a new job and its manifest
+
+        Args:
+            job_id: Identifier of the job
+            manifest: Information about the job
+            requests: Request lines in the provider batch format
+            contexts: Structured inputs of each request, by request ID
+        """
+        self._write_atomic(
+            self.path(job_id, 'input.jsonl'),
+            [json.dumps(request, ensure_ascii=False) + '\n' for request in requests]
+        )
+        self._write_atomic(self.path(job_id, 'context.json'), [json.dumps(contexts, ensure_ascii=False)])
+        self.save_manifest(job_id, manifest)
+
+    def load_manifest(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Load the manifest of a job, or None if it doesn't exist"""
+        path = self.path(job_id, 'json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def save_manifest(self, job_id: str, manifest: Dict[str, Any]) -> None:
+        """Atomically write the manifest of a job"""
+        with self.lock:
+            self._write_atomic(self.path(job_id, 'json'), [json.dumps(manifest, ensure_ascii=False)])
+
+    def load_requests(self, job_id: str) -> List[Dict[str, Any]]:
+        """Load the request lines of a job"""
+        with open(self.path(job_id, 'input.jsonl'), 'r', encoding='utf-8') as input_file:
+            return [json.loads(line) for line in input_file if line.strip()]
+
+    def load_contexts(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        """Load the structured inputs of the requests of a job"""
+        with open(self.path(job_id, 'context.json'), 'r', encoding='utf-8') as context_file:
+            return json.load(context_file)
+
+    def save_results(self, job_id: str, results: Dict[str, Dict[str, Any]]) -> None:
+        """Write the results of a job, one line per request"""
+        self._write_atomic(self.path(job_id, 'results.jsonl'), [
+            json.dumps(dict(result, request_id=request_id), ensure_ascii=False) + '\n'
+            for request_id, result in results.items()
+        ])
+
+    def load_results(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        """Load the results of a job by request ID"""
+        path = self.path(job_id, 'results.jsonl')
+        results = {}
+        if not os.path.exists(path):
+            return results
+        with open(path, 'r', encoding='utf-8') as results_file:
+            for line in results_file:
+                result = json.loads(line)
+                results[result.pop('request_id')] = result
+        return results
+
+
+class OpenAIBatchBackend:
+    """Submits batch jobs through the OpenAI Batch API"""
+
+    name = 'openai'
+
+    def __init__(self, client: Any):
+        """
+        Initialize the backend
+
+        Args:
+            client: The OpenAI client
+        """
+        self.client = client
+
+    def submit(self, store: BatchJobStore, job_id: str, manifest: Dict[str, Any]) -> str:
+        """Upload the request file of a job and create its batch, returning the batch ID"""
+        with open(store.path(job_id, 'input.jsonl'), 'rb') as input_file:
+            uploaded = self.client.files.create(file=input_file, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=manifest['endpoint'],
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata={'job_id': job_id, 'operation': manifest['operation']}
+        )
+        return batch.id
+
+    def retrieve(self, store: BatchJobStore, job_id: str, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Get the status of the batch of a job
+
+        Returns:
+            Dictionary with the batch 'status' and, once it is over, its 'output' lines
+        """
+        batch = self.client.batches.retrieve(manifest['batch_id'])
+        status = {'status': batch.status}
+        if batch.status in TERMINAL_STATUSES:
+            output = []
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = self.client.files.content(file_id).text
+                    output += [json.loads(line) for line in content.splitlines() if line.strip()]
+            status['output'] = output
+        return status
+
+
+class LocalBatchBackend:
+    """
+    Local stand-in for a provider batch API
+
+    Runs the requests of a job through a local function the first time the job
+    is polled, and returns them in the output format of the provider, so that
+    batch jobs can be exercised offline.
+    """
+
+    name = 'local'
+
+    def __init__(self, complete: Callable[[str, str, Dict[str, Any], Dict[str, Any]], Any]):
+        """
+        Initialize the backend
+
+        Args:
+            complete: Function serving a request, called with the job operation and
+                endpoint, the request body and the request context, and returning the response
+        """
+        self.complete = complete
+
+    def submit(self, store: BatchJobStore, job_id: str, manifest: Dict[str, Any]) -> str:
+        return f"local_{uuid.uuid4().hex}"
+
+    def retrieve(self, store: BatchJobStore, job_id: str, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        contexts = store.load_contexts(job_id)
+        output = []
+        for request in store.load_requests(job_id):
+            line = {'id': f"batch_req_{uuid.uuid4().hex}", 'custom_id': request['custom_id'], 'response': None, 'error': None}
+            try:
+                body = self.complete(
+                    manifest['operation'],
+                    manifest['endpoint'],
+                    request['body'],
+                    contexts.get(request['custom_id']) or {}
+                )
+                line['response'] = {'status_code': 200, 'body': response_to_dict(body)}
+            except Exception as e:
+                line['error'] = {'code': type(e).__name__, 'message': str(e)}
+            output.append(line)
+        return {'status': 'completed', 'output': output}
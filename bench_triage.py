@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark for interaction triage
+
+This script compares the chained triage path (analyze_sentiment,
+check_content_moderation, generate_comment_response) with the fused
+triage_interaction request, in latency, round trips and token usage.
+
+By default the API is simulated with a fixed latency per request and token
+counts estimated from the prompts, so the benchmark runs offline. Use --live
+to call the real API.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from types import SimpleNamespace
+from dotenv import load_dotenv
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Load environment variables
+load_dotenv()
+
+from src.services.ai.content_analyzer import ContentAnalyzerService
+from src.services.ai.response_generator import ResponseGeneratorService
+
+COMMENTS = [
+    "Trop beau ce nouveau modèle, il sera dispo en magasin quand ?",
+    "Livraison en retard de deux semaines, personne ne répond au service client...",
+    "J'adore ! Je l'ai offert à ma sœur et elle est ravie 😍",
+    "Gagnez 1000€ par jour depuis chez vous, cliquez sur mon profil !!!",
+]
+POST_CONTENT = "Découvrez notre nouvelle collection printemps, disponible dès aujourd'hui en ligne !"
+BRAND_VOICE = "Chaleureuse, proche de la communauté, tutoiement, emojis avec parcimonie"
+
+
+class SimulatedClient:
+    """Stand-in for the OpenAI client with a fixed latency per request"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.round_trips = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+        self.moderations = SimpleNamespace(create=self._create_moderation)
+
+    def _create_chat_completion(self, **kwargs):
+        self.round_trips += 1
+        time.sleep(self.latency)
+        prompt_chars = sum(len(message['content']) for message in kwargs['messages'])
+        schema_name = kwargs.get('response_format', {}).get('json_schema', {}).get('name')
+        if schema_name == 'interaction_triage':
+            content = json.dumps({
+                'sentiment': {'label': 'positif', 'score': 0.8},
+                'risk': {'flagged': False, 'categories': []},
+                'intent': 'question',
+                'should_reply': True,
+                'draft_reply': "Merci pour ton message ! Elle arrive en magasin la semaine prochaine 🙂"
+            })
+        elif schema_name == 'sentiment_analysis':
+            content = json.dumps({'sentiment': 'positif', 'score': 0.8, 'émotions': ['joie'], 'confiance': 0.9})
+        else:
+            content = "Merci pour ton message ! Elle arrive en magasin la semaine prochaine 🙂"
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_chars // 4,
+            completion_tokens=len(content) // 4,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=0)
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+    def _create_moderation(self, **kwargs):
+        self.round_trips += 1
+        time.sleep(self.latency)
+        result = SimpleNamespace(flagged=False, categories={}, category_scores={})
+        return SimpleNamespace(results=[result])
+
+
+def summarize_usage(*services):
+    """Sum the token usage recorded by services"""
+    totals = {'prompt_tokens': 0, 'completion_tokens': 0}
+    for service in services:
+        for stats in service.get_usage_stats().values():
+            totals['prompt_tokens'] += stats['prompt_tokens']
+            totals['completion_tokens'] += stats['completion_tokens']
+    return totals
+
+
+def run_chained(analyzer, responder):
+    """Triage every comment with three separate requests"""
+    for comment in COMMENTS:
+        analyzer.analyze_sentiment(text=comment)
+        analyzer.check_content_moderation(text=comment)
+        responder.generate_comment_response(comment=comment, post_content=POST_CONTENT, brand_voice=BRAND_VOICE)
+
+
+def run_fused(analyzer):
+    """Triage every comment with a single structured request"""
+    for comment in COMMENTS:
+        analyzer.triage_interaction(comment=comment, post_content=POST_CONTENT, brand_voice=BRAND_VOICE)
+
+
+def main():
+    """Run the benchmark and print a comparison"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--live', action='store_true', help='call the real API instead of the simulated one')
+    parser.add_argument('--latency', type=float, default=0.8, help='simulated latency per request in seconds')
+    args = parser.parse_args()
+
+    results = {}
+    for path in ('chained', 'fused'):
+        analyzer = ContentAnalyzerService()
+        responder = ResponseGeneratorService()
+        if not args.live:
+            client = SimulatedClient(args.latency)
+            analyzer.client = client
+            responder.client = client
+
+        start = time.perf_counter()
+        if path == 'chained':
+            run_chained(analyzer, responder)
+        else:
+            run_fused(analyzer)
+        elapsed = time.perf_counter() - start
+
+        results[path] = summarize_usage(analyzer, responder)
+        results[path]['seconds_per_comment'] = elapsed / len(COMMENTS)
+        if not args.live:
+            results[path]['round_trips_per_comment'] = client.round_trips / len(COMMENTS)
+
+    print(f"{'':28}{'chained':>12}{'fused':>12}")
+    for metric in results['chained']:
+        print(f"{metric:28}{results['chained'][metric]:>12.2f}{results['fused'][metric]:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+from src.models.base import db, BaseModel
+import json
+
+class BrandVoiceProfile(db.Model, BaseModel):
+    """Brand voice profile model for reusable AI tone and style instructions"""
+    __tablename__ = 'brand_voice_profiles'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    tone = db.Column(db.String(100), nullable=True)
+    _guidelines = db.Column('guidelines', db.Text, nullable=True)
+    compiled_prompt = db.Column(db.Text, nullable=True)
+    
+    # Relationships
+    organization = db.relationship('Organization', back_populates='brand_voice_profiles')
+    
+    def __repr__(self):
+        return f'<BrandVoiceProfile {self.name}>'
+    
+    @property
+    def guidelines(self):
+        if self._guidelines:
+            return json.loads(self._guidelines)
+        return {}
+    
+    @guidelines.setter
+    def guidelines(self, value):
+        self._guidelines = json.dumps(value)
+    
+    def compile(self):
+        """Build the system prompt prefix shared by every AI request using this profile"""
+        # The output must only depend on the profile so the provider can cache the prefix
+        lines = [
+            f'Tu écris au nom de la marque avec le profil de voix "{self.name}".',
+            f"Voix de la marque: {self.description.strip()}"
+        ]
+        if self.tone:
+            lines.append(f"Ton: {self.tone}")
+        guidelines = self.guidelines
+        if guidelines.get('do'):
+            lines.append("À faire:")
+            lines.extend(f"- {item}" for item in guidelines['do'])
+        if guidelines.get('dont'):
+            lines.append("À éviter:")
+            lines.extend(f"- {item}" for item in guidelines['dont'])
+        if guidelines.get('examples'):
+            lines.append("Exemples de messages de la marque:")
+            lines.extend(f'- "{item}"' for item in guidelines['examples'])
+        self.compiled_prompt = '\n'.join(lines)
+        return self.compiled_prompt
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'organization_id': self.organization_id,
+            'name': self.name,
+            'description': self.description,
+            'tone': self.tone,
+            'guidelines': self.guidelines,
+            'compiled_prompt': self.compiled_prompt,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -5,6 +5,7 @@ This module contains configuration settings for AI services.
 """
 
 import os
+import json
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -27,17 +28,170 @@ DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = 1000
 REQUEST_TIMEOUT = 60  # seconds
 
+# Provider settings
+# Backends that chat completion requests can be routed to
+DEFAULT_AI_PROVIDER = 'openai'
+AI_PROVIDERS = {
+    'openai': {'type': 'openai'},
+    # Any OpenAI-compatible server, such as a local CPU model server
+    'local': {
+        'type': 'openai_compatible',
+        'base_url': os.getenv('LOCAL_LLM_BASE_URL', 'http://localhost:8080/v1'),
+        'api_key': os.getenv('LOCAL_LLM_API_KEY', ''),
+        'model': os.getenv('LOCAL_LLM_MODEL') or None,
+        'supports_json_schema': os.getenv('LOCAL_LLM_JSON_SCHEMA', 'false').lower() == 'true'
+    },
+    # Local rules engine for analyze_sentiment, extract_keywords and generate_hashtags
+    'rules': {'type': 'rules'}
+}
+# Provider of each operation, e.g. AI_OPERATION_ROUTES='{"generate_hashtags": "rules", "analyze_sentiment": "local"}'
+AI_OPERATION_ROUTES = {'default': DEFAULT_AI_PROVIDER, **json.loads(os.getenv('AI_OPERATION_ROUTES') or '{}')}
+
+# Batch job settings
+BATCH_JOB_DIR = os.getenv('BATCH_JOB_DIR', os.path.join(os.getcwd(), 'data', 'batch_jobs'))
+BATCH_BACKEND = os.getenv('BATCH_BACKEND', 'openai')  # 'openai' or 'local' to run batches offline
+BATCH_COMPLETION_WINDOW = '24h'
+BATCH_MAX_REQUESTS = 50000
+
+# Asynchronous job settings
+AI_JOB_DB_PATH = os.getenv('AI_JOB_DB_PATH', os.path.join(os.getcwd(), 'data', 'ai_jobs.sqlite3'))
+AI_JOB_WORKERS = 4  # threads running jobs, in each process
+AI_JOB_POLL_SECONDS = 1.0  # how often idle workers look for jobs queued by other processes
+AI_JOB_LEASE_SECONDS = 60  # renewed while a job runs; a job whose worker stops renewing it is run again
+AI_JOB_MAX_ATTEMPTS = 3
+AI_JOB_RETENTION_SECONDS = 7 * 24 * 3600  # how long finished jobs are kept
+
 # Rate limiting settings
 MAX_REQUESTS_PER_MINUTE = 60
 MAX_TOKENS_PER_MINUTE = 90000
 
+# Request scheduling settings
+# Priority lanes sharing MAX_REQUESTS_PER_MINUTE, from the highest priority to the lowest
+SCHEDULER_LANES = ['interactive', 'generation', 'batch']
+SCHEDULER_DEFAULT_LANE = 'generation'
+SCHEDULER_MAX_WAIT_SECONDS = {'interactive': 30, 'generation': 120, 'batch': None}
+# Fair queuing weight and per-minute request quota of an organization, by subscription plan
+DEFAULT_SUBSCRIPTION_PLAN = 'free'
+PLAN_AI_QUOTAS = {
+    'free': {'weight': 1, 'requests_per_minute': 10},
+    'pro': {'weight': 3, 'requests_per_minute': 30},
+    'business': {'weight': 6, 'requests_per_minute': 45},
+    'enterprise': {'weight': 10, 'requests_per_minute': 60}
+}
+
+# Image storage settings
+IMAGE_WRITE_WORKERS = 2  # background threads decoding and writing generated images
+IMAGE_VARIANT_WORKERS = 2  # processes cropping and resizing the platform variants of a master image
+IMAGE_MASTER_SIZE = "1024x1024"  # square, so that both landscape and portrait variants can be cropped from it
+IMAGE_PREVIEW_SIZE = "256x256"  # smallest size of FALLBACK_IMAGE_MODEL, for drafts of a prompt
+
+# Generated image garbage collection settings
+IMAGE_GC_INTERVAL_SECONDS = 3600
+IMAGE_GC_GRACE_SECONDS = 24 * 3600  # unreferenced images used more recently are never deleted
+IMAGE_GC_MAX_AGE_SECONDS = 30 * 24 * 3600  # unreferenced images unused for longer are deleted
+IMAGE_ORG_QUOTA_BYTES = int(os.getenv('IMAGE_ORG_QUOTA_BYTES', 1024 ** 3))  # past it, the oldest unreferenced images of an organization are deleted
+IMAGE_GC_BATCH_SIZE = 100  # files deleted between two pauses, to spread the disk load
+IMAGE_GC_BATCH_PAUSE_SECONDS = 0.5
+
+# Media asset pipeline settings
+MEDIA_PIPELINE_WORKERS = 2  # processes generating the thumbnails and metadata of media assets
+MEDIA_THUMBNAIL_SIZES = (160, 320, 640)  # longest side in pixels of the WebP thumbnails of an image
+MEDIA_THUMBNAIL_URL_SIZE = 320  # thumbnail set as the thumbnail_url of an asset
+MEDIA_THUMBNAIL_QUALITY = 80
+MEDIA_DOMINANT_COLORS = 5
+
+# Image size of each platform; variants cropped from a master image keep the
+# aspect ratio, and are only downscaled to this size
+PLATFORM_IMAGE_SIZES = {
+    'instagram': (1024, 1024),
+    'facebook': (1792, 1024),
+    'twitter': (1792, 1024),
+    'x': (1792, 1024),
+    'linkedin': (1792, 1024),
+    'pinterest': (1024, 1792),
+    'tiktok': (1024, 1792)
+}
+
 # Content moderation settings
 ENABLE_CONTENT_MODERATION = True
 CONTENT_MODERATION_MODEL = "text-moderation-latest"
 
 # Caching settings
 ENABLE_RESPONSE_CACHING = True
-CACHE_EXPIRATION = 3600  # seconds (1 hour)
+CACHE_EXPIRATION = 3600  # soft TTL: seconds (1 hour) a cached response is fresh
+CACHE_STALE_EXPIRATION = 6 * 3600  # hard TTL: until then a stale response is served while it is refreshed in the background
+CACHE_STALE_IF_ERROR = 7 * 24 * 3600  # past the hard TTL, a stale response is only served when the upstream request fails
+CACHE_REFRESH_WORKERS = 2
+# Near-duplicate cache of deterministic operations (hashtags, content ideas, keywords)
+SEMANTIC_CACHE_THRESHOLD = 0.9  # cosine similarity above which the response of a near-duplicate request is served
+SEMANTIC_CACHE_MAX_ENTRIES = 5000  # per service
+SEMANTIC_CACHE_AUDIT_RATE = 0.05  # share of near-duplicate hits recomputed in the background to audit them
+SEMANTIC_CACHE_AUDIT_AGREEMENT = 0.5  # response similarity under which an audited hit counts as false
+SEMANTIC_CACHE_AUDIT_LOG_SIZE = 50
+
+# FAQ retrieval settings
+FAQ_INDEX_DIR = os.getenv('FAQ_INDEX_DIR', os.path.join(os.getcwd(), 'data', 'faq_indexes'))
+FAQ_BM25_K1 = 1.5
+FAQ_BM25_B = 0.75
+FAQ_TOP_K = 3  # FAQ entries passed to the model
+FAQ_DIRECT_ANSWER_THRESHOLD = 0.85  # match score above which the stored answer is returned as is
+
+# Comment reply reuse settings
+REPLY_INDEX_DIR = os.getenv('REPLY_INDEX_DIR', os.path.join(os.getcwd(), 'data', 'reply_indexes'))
+REPLY_HASH_BUCKETS = 2 ** 18
+REPLY_REUSE_THRESHOLD = 0.8  # cosine similarity above which an approved reply is reused
+
+# Outreach campaign settings
+OUTREACH_CAMPAIGN_DIR = os.getenv('OUTREACH_CAMPAIGN_DIR', os.path.join(os.getcwd(), 'data', 'outreach_campaigns'))
+OUTREACH_TARGETS_PER_REQUEST = 10
+OUTREACH_MAX_CONCURRENT_REQUESTS = 4
+OUTREACH_MAX_TOKENS_PER_REQUEST = 4000
+
+# Conversation memory settings
+CONVERSATION_TOKEN_BUDGET = 2000  # history tokens above which older turns are summarized
+CONVERSATION_RECENT_TOKENS = 800  # history tokens kept verbatim after summarization
+CONVERSATION_SUMMARY_MAX_TOKENS = 300
+
+# Post generation settings
+# Character and hashtag limits applied to generated posts, per platform
+PLATFORM_POST_LIMITS = {
+    'instagram': {'max_length': 2200, 'max_hashtags': 30},
+    'facebook': {'max_length': 5000, 'max_hashtags': 10},
+    'linkedin': {'max_length': 3000, 'max_hashtags': 5},
+    'x': {'max_length': 280, 'max_hashtags': 3},
+    'twitter': {'max_length': 280, 'max_hashtags': 3},
+    'tiktok': {'max_length': 2200, 'max_hashtags': 10}
+}
+MAX_POST_VARIANTS = 5
+POST_GENERATION_MAX_TOKENS = 4000
+
+# Template bulk generation settings
+TEMPLATE_POSTS_PER_REQUEST = 7  # a week of daily posts per request
+TEMPLATE_MAX_CONCURRENT_REQUESTS = 4
+TEMPLATE_MAX_BULK_POSTS = 100
+TEMPLATE_DEFAULT_POSTING_TIMES = ['09:00']
+
+# Chunked analysis settings
+CHUNKED_ANALYSIS_THRESHOLD_TOKENS = 3000  # texts longer than this are analyzed in chunks
+ANALYSIS_CHUNK_TOKENS = 1500
+ANALYSIS_MAX_CONCURRENT_CHUNKS = 4
+
+# Structured output settings
+ENABLE_STRUCTURED_OUTPUT_REPAIR = True  # retry invalid structured responses with a repair request
+STRUCTURED_OUTPUT_REPAIR_MODEL = FALLBACK_TEXT_MODEL
+STRUCTURED_OUTPUT_REPAIR_MAX_TOKENS = 1000
+
+# Usage ledger settings
+USAGE_LEDGER_JOURNAL_DIR = os.getenv('USAGE_LEDGER_JOURNAL_DIR', os.path.join(os.getcwd(), 'data', 'usage_ledger'))
+USAGE_LEDGER_FLUSH_SECONDS = 5
+USAGE_LEDGER_MAX_BUFFER = 500  # buffered entries that trigger a flush before the interval
+USAGE_LEDGER_OUTAGE_ROWS = 10  # entries failing one by one, with none written, that mean the ledger table is down
+# Price in USD per million tokens, by model
+AI_MODEL_PRICING = {
+    'gpt-4o': {'prompt': 2.50, 'cached_prompt': 1.25, 'completion': 10.00},
+    'gpt-4o-mini': {'prompt': 0.15, 'cached_prompt': 0.075, 'completion': 0.60},
+    'gpt-3.5-turbo': {'prompt': 0.50, 'cached_prompt': 0.50, 'completion': 1.50}
+}
 
 # Logging settings
 LOG_AI_REQUESTS = True
@@ -5,6 +5,7 @@ Configuration for pytest
 import os
 import sys
 import pytest
+import tempfile
 from dotenv import load_dotenv
 
 # Add the project root to the Python path
@@ -15,6 +16,13 @@ if project_root not in sys.path:
 # Load environment variables
 load_dotenv()
 
+# Tokens are checked with the SECRET_KEY of the environment
+os.environ['SECRET_KEY'] = 'test-secret-key'
+
+# Keep the job database and usage ledger journals of the app, whose workers start with it, out of the working directory
+os.environ['AI_JOB_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='ai-jobs-'), 'ai_jobs.sqlite3')
+os.environ['USAGE_LEDGER_JOURNAL_DIR'] = tempfile.mkdtemp(prefix='usage-ledger-')
+
 from src.main import app as flask_app
 from src.models.base import db
 
@@ -60,11 +68,9 @@ def auth_token(client):
             # Create test user
             user = User(
                 email='test@example.com',
-                password='password123',
-                first_name='Test',
-                last_name='User',
-                is_active=True
+                name='Test User'
             )
+            user.set_password('password123')
             db.session.add(user)
             db.session.commit()
         
@@ -4,69 +4,245 @@ Content Analyzer Service
 This module provides content analysis capabilities using OpenAI's API.
 """
 
-from typing import Dict, Any, List, Optional, Union
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Union, TypedDict, Callable
 from .base_service import BaseAIService
+from .structured_output import StructuredSchema
+from .conversation_memory import estimate_tokens
+from .text_chunking import chunk_text
 from .config import (
     DEFAULT_TEXT_MODEL,
     DEFAULT_TEMPERATURE,
+    DEFAULT_MAX_TOKENS,
     REQUEST_TIMEOUT,
     ENABLE_CONTENT_MODERATION,
-    CONTENT_MODERATION_MODEL
+    CONTENT_MODERATION_MODEL,
+    CHUNKED_ANALYSIS_THRESHOLD_TOKENS,
+    ANALYSIS_CHUNK_TOKENS,
+    ANALYSIS_MAX_CONCURRENT_CHUNKS
 )
 
+class SentimentAnalysis(TypedDict):
+    """Result of analyze_sentiment"""
+    sentiment: str
+    score: float
+    émotions: List[str]
+    confiance: float
+
+
+class Keyword(TypedDict):
+    """Keyword returned by extract_keywords"""
+    keyword: str
+    score: float
+
+
+class EngagementAnalysis(TypedDict):
+    """Result of analyze_engagement_potential"""
+    score: float
+    forces: List[str]
+    faiblesses: List[str]
+    suggestions: List[str]
+
+
+SENTIMENT_SCHEMA = StructuredSchema('sentiment_analysis', {
+    'type': 'object',
+    'properties': {
+        'sentiment': {'type': 'string', 'enum': ['positif', 'négatif', 'neutre']},
+        'score': {'type': 'number', 'minimum': -1, 'maximum': 1},
+        'émotions': {'type': 'array', 'items': {'type': 'string'}},
+        'confiance': {'type': 'number', 'minimum': 0, 'maximum': 1}
+    },
+    'required': ['sentiment', 'score', 'émotions', 'confiance'],
+    'additionalProperties': False
+})
+
+KEYWORDS_SCHEMA = StructuredSchema('keyword_extraction', {
+    'type': 'object',
+    'properties': {
+        'keywords': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'keyword': {'type': 'string'},
+                    'score': {'type': 'number', 'minimum': 0, 'maximum': 1}
+                },
+                'required': ['keyword', 'score'],
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': ['keywords'],
+    'additionalProperties': False
+})
+
+ENGAGEMENT_SCHEMA = StructuredSchema('engagement_analysis', {
+    'type': 'object',
+    'properties': {
+        'score': {'type': 'number', 'minimum': 0, 'maximum': 100},
+        'forces': {'type': 'array', 'items': {'type': 'string'}},
+        'faiblesses': {'type': 'array', 'items': {'type': 'string'}},
+        'suggestions': {'type': 'array', 'items': {'type': 'string'}}
+    },
+    'required': ['score', 'forces', 'faiblesses', 'suggestions'],
+    'additionalProperties': False
+})
+
+# Fused triage of an incoming interaction: sentiment, moderation, intent and draft reply
+TRIAGE_SCHEMA = StructuredSchema('interaction_triage', {
+    'type': 'object',
+    'properties': {
+        'sentiment': {
+            'type': 'object',
+            'properties': {
+                'label': {'type': 'string', 'enum': ['positif', 'négatif', 'neutre']},
+                'score': {'type': 'number', 'minimum': -1, 'maximum': 1}
+            },
+            'required': ['label', 'score'],
+            'additionalProperties': False
+        },
+        'risk': {
+            'type': 'object',
+            'properties': {
+                'flagged': {'type': 'boolean'},
+                'categories': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'string',
+                        'enum': ['harassment', 'hate', 'sexual', 'violence', 'self-harm', 'spam', 'scam', 'personal-data']
+                    }
+                }
+            },
+            'required': ['flagged', 'categories'],
+            'additionalProperties': False
+        },
+        'intent': {
+            'type': 'string',
+            'enum': ['question', 'complaint', 'praise', 'purchase_intent', 'feedback', 'spam', 'other']
+        },
+        'should_reply': {'type': 'boolean'},
+        'draft_reply': {'type': 'string'}
+    },
+    'required': ['sentiment', 'risk', 'intent', 'should_reply', 'draft_reply'],
+    'additionalProperties': False
+})
+
+def merge_sentiments(analyses: List[SentimentAnalysis], weights: List[float]) -> SentimentAnalysis:
+    """
+    Reduce the sentiment analyses of the chunks of a text into one analysis
+
+    Each chunk weighs by its length and by the confidence of its analysis.
+
+    Args:
+        analyses: The sentiment analysis of each chunk
+        weights: The weight of each chunk, usually its length
+
+    Returns:
+        The sentiment analysis of the whole text
+    """
+    total_weight = sum(weights) or 1
+    confidence_weights = [weight * analysis['confiance'] for analysis, weight in zip(analyses, weights)]
+    total_confidence_weight = sum(confidence_weights) or 1
+
+    labels = {}
+    emotions = {}
+    for analysis, weight in zip(analyses, confidence_weights):
+        labels[analysis['sentiment']] = labels.get(analysis['sentiment'], 0) + weight
+        for emotion in analysis['émotions']:
+            key = emotion.strip().lower()
+            label, total = emotions.get(key, (emotion.strip(), 0))
+            emotions[key] = (label, total + weight)
+
+    return {
+        'sentiment': max(labels, key=labels.get) if labels else 'neutre',
+        'score': sum(analysis['score'] * weight for analysis, weight in zip(analyses, confidence_weights)) / total_confidence_weight,
+        'émotions': [label for label, _ in sorted(emotions.values(), key=lambda item: item[1], reverse=True)[:5]],
+        'confiance': sum(analysis['confiance'] * weight for analysis, weight in zip(analyses, weights)) / total_weight
+    }
+
+
+def merge_keywords(extractions: List[List[Keyword]], weights: List[float], count: int) -> List[Keyword]:
+    """
+    Reduce the keywords extracted from the chunks of a text into one ranking
+
+    The score of a keyword is the weighted sum of its scores in each chunk, so
+    keywords found across the text rank above keywords local to one chunk.
+
+    Args:
+        extractions: The keywords of each chunk
+        weights: The weight of each chunk, usually its length
+        count: Number of keywords to keep
+
+    Returns:
+        The most relevant keywords of the whole text
+    """
+    total_weight = sum(weights) or 1
+    merged = {}
+    for keywords, weight in zip(extractions, weights):
+        for item in keywords:
+            key = item['keyword'].strip().lower()
+            if key not in merged:
+                merged[key] = {'keyword': item['keyword'].strip(), 'score': 0.0}
+            merged[key]['score'] += item['score'] * weight / total_weight
+
+    return sorted(merged.values(), key=lambda item: item['score'], reverse=True)[:count]
+
+
 class ContentAnalyzerService(BaseAIService):
     """Service for analyzing content using AI"""
     
+    # Operations that can run as offline batch jobs
+    batch_operations = ('analyze_sentiment', 'extract_keywords', 'check_content_moderation')
+    
     def __init__(self):
         """Initialize the content analyzer service"""
         super().__init__()
     
-    def analyze_sentiment(self, text: str) -> Dict[str, Any]:
+    def _split_for_analysis(self, text: str, chunked: Optional[bool]) -> List[str]:
+        """Split a text into chunks if it is too long to analyze in one request"""
+        if chunked is None:
+            chunked = estimate_tokens(text) > CHUNKED_ANALYSIS_THRESHOLD_TOKENS
+        if not chunked:
+            return [text]
+        return chunk_text(text, ANALYSIS_CHUNK_TOKENS) or [text]
+    
+    def _map_chunks(self, analyze: Callable[[str], Any], chunks: List[str]) -> List[Any]:
+        """Analyze chunks concurrently, each request going through the rate limiter"""
+        if len(chunks) == 1:
+            return [analyze(chunks[0])]
+        with ThreadPoolExecutor(max_workers=min(ANALYSIS_MAX_CONCURRENT_CHUNKS, len(chunks))) as executor:
+            # Workers keep the request scope of the caller for the scheduler
+            futures = [executor.submit(contextvars.copy_context().run, analyze, chunk) for chunk in chunks]
+            return [future.result() for future in futures]
+    
+    def analyze_sentiment(self, text: str, chunked: Optional[bool] = None) -> Dict[str, Any]:
         """
         Analyze the sentiment of a text
         
+        Long texts are split into chunks analyzed concurrently, whose sentiments
+        are then combined, weighted by chunk length and confidence.
+        
         Args:
             text: The text to analyze
+            chunked: Whether to analyze the text in chunks, decided from its length if None
             
         Returns:
-            Dictionary containing sentiment analysis or error information
+            Dictionary containing the SentimentAnalysis or error information
         """
         try:
-            # Check rate limits
-            self._rate_limit_check()
-            
             # Log the request
             self._log_request(
                 'analyze_sentiment',
                 text=text[:100] + "..." if len(text) > 100 else text
             )
             
-            # Create the prompt
-            prompt = f"""
-            Analyse le sentiment du texte suivant et réponds uniquement avec un JSON contenant:
-            - sentiment: "positif", "négatif", ou "neutre"
-            - score: un nombre entre -1 (très négatif) et 1 (très positif)
-            - émotions: un tableau des émotions principales détectées
-            - confiance: un nombre entre 0 et 1 indiquant le niveau de confiance de l'analyse
-            
-            Texte à analyser: "{text}"
-            
-            Réponds uniquement avec le JSON, sans texte supplémentaire.
-            """
-            
-            # Make the API request
-            response = self.client.chat.completions.create(
-                model=DEFAULT_TEXT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Tu es un expert en analyse de sentiment qui répond uniquement en format JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,  # Low temperature for more consistent results
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            # Extract the analysis
-            analysis = response.choices[0].message.content
+            chunks = self._split_for_analysis(text, chunked)
+            analyses = self._map_chunks(self._analyze_sentiment_chunk, chunks)
+            if len(chunks) == 1:
+                analysis = analyses[0]
+            else:
+                analysis = merge_sentiments(analyses, [len(chunk) for chunk in chunks])
             
             # Log the response
             self._log_response('analyze_sentiment', analysis)
@@ -76,6 +252,42 @@ class ContentAnalyzerService(BaseAIService):
         except Exception as e:
             return self._handle_error(e)
     
+    def _analyze_sentiment_chunk(self, text: str) -> SentimentAnalysis:
+        """Analyze the sentiment of a text in a single request"""
+        # Check rate limits
+        self._rate_limit_check('analyze_sentiment')
+        
+        # Make the API request
+        return self._create_structured_completion(
+            'analyze_sentiment',
+            SENTIMENT_SCHEMA,
+            context={'text': text},
+            timeout=REQUEST_TIMEOUT,
+            **self._sentiment_request(text)
+        )
+    
+    def _sentiment_request(self, text: str) -> Dict[str, Any]:
+        """Build the chat completion request analyzing the sentiment of a text"""
+        # Create the prompt
+        prompt = f"""
+        Analyse le sentiment du texte suivant:
+        - sentiment: "positif", "négatif", ou "neutre"
+        - score: un nombre entre -1 (très négatif) et 1 (très positif)
+        - émotions: un tableau des émotions principales détectées
+        - confiance: un nombre entre 0 et 1 indiquant le niveau de confiance de l'analyse
+        
+        Texte à analyser: "{text}"
+        """
+        
+        return {
+            'model': DEFAULT_TEXT_MODEL,
+            'messages': [
+                {"role": "system", "content": "Tu es un expert en analyse de sentiment qui répond uniquement en format JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            'temperature': 0.1  # Low temperature for more consistent results
+        }
+    
     def check_content_moderation(self, text: str) -> Dict[str, Any]:
         """
         Check if content violates content policies
@@ -129,22 +341,31 @@ class ContentAnalyzerService(BaseAIService):
                         text: str, 
                         platform: str,
                         target_audience: str,
-                        optimization_goals: List[str] = None) -> Dict[str, Any]:
+                        optimization_goals: List[str] = None,
+                        brand_voice: Optional[str] = None,
+                        brand_voice_prompt: Optional[str] = None,
+                        chunked: Optional[bool] = None) -> Dict[str, Any]:
         """
         Optimize content for a specific platform and audience
         
+        Long texts are first condensed chunk by chunk, concurrently, and the
+        content is then optimized from the key points of every chunk.
+        
         Args:
             text: The text to optimize
             platform: The social media platform
             target_audience: Description of the target audience
             optimization_goals: List of optimization goals (e.g., "engagement", "clicks")
+            brand_voice: Optional description of the brand's voice and tone
+            brand_voice_prompt: Compiled brand voice profile, used instead of brand_voice
+            chunked: Whether to condense the text in chunks first, decided from its length if None
             
         Returns:
             Dictionary containing optimized content or error information
         """
         try:
             # Check rate limits
-            self._rate_limit_check()
+            self._rate_limit_check('optimize_content')
             
             # Set default optimization goals if none provided
             if not optimization_goals:
@@ -156,17 +377,37 @@ class ContentAnalyzerService(BaseAIService):
                 text=text[:100] + "..." if len(text) > 100 else text,
                 platform=platform,
                 target_audience=target_audience,
-                optimization_goals=optimization_goals
+                optimization_goals=optimization_goals,
+                brand_voice=brand_voice,
+                has_brand_voice_prompt=brand_voice_prompt is not None
             )
             
+            # Condense long texts so that the optimization prompt stays within the context
+            chunks = self._split_for_analysis(text, chunked)
+            if len(chunks) > 1:
+                key_points = self._map_chunks(self._condense_chunk, chunks)
+                source_label = "Idées clés du contenu original, extrait par extrait"
+                source = "\n\n".join(key_points)
+            else:
+                source_label = "Contenu original"
+                source = f'"{text}"'
+            
+            # Describe the brand voice unless the profile already does
+            voice_instruction = ""
+            if brand_voice_prompt:
+                voice_instruction = "Respecte la voix de la marque décrite dans tes instructions."
+            elif brand_voice:
+                voice_instruction = f'Respecte la voix de la marque: "{brand_voice}".'
+            
             # Create the prompt
             prompt = f"""
             Optimise le contenu suivant pour la plateforme {platform} et l'audience cible: {target_audience}.
             
             Objectifs d'optimisation: {', '.join(optimization_goals)}
+            {voice_instruction}
             
-            Contenu original:
-            "{text}"
+            {source_label}:
+            {source}
             
             Fournis une version optimisée du contenu, puis explique brièvement les modifications apportées et pourquoi elles amélioreront les performances selon les objectifs d'optimisation.
             
@@ -181,12 +422,14 @@ class ContentAnalyzerService(BaseAIService):
             """
             
             # Make the API request
-            response = self.client.chat.completions.create(
+            response = self._create_chat_completion(
+                'optimize_content',
                 model=DEFAULT_TEXT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Tu es un expert en optimisation de contenu pour les réseaux sociaux."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._build_messages(
+                    "Tu es un expert en optimisation de contenu pour les réseaux sociaux.",
+                    prompt,
+                    brand_voice_prompt=brand_voice_prompt
+                ),
                 temperature=DEFAULT_TEMPERATURE,
                 timeout=REQUEST_TIMEOUT
             )
@@ -202,21 +445,61 @@ class ContentAnalyzerService(BaseAIService):
         except Exception as e:
             return self._handle_error(e)
     
-    def extract_keywords(self, text: str, count: int = 10) -> Dict[str, Any]:
+    def _condense_chunk(self, text: str) -> str:
+        """Condense a chunk of a long text into its key points in a single request"""
+        # Check rate limits
+        self._rate_limit_check('optimize_content_condense')
+        
+        # Create the prompt
+        prompt = f"""
+        Résume l'extrait suivant en une liste concise de ses idées clés, en conservant
+        les faits, chiffres et citations importants.
+        
+        Extrait:
+        "{text}"
+        """
+        
+        # Make the API request
+        response = self._create_chat_completion(
+            'optimize_content_condense',
+            model=DEFAULT_TEXT_MODEL,
+            messages=[
+                {"role": "system", "content": "Tu es un expert en synthèse de contenu."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=ANALYSIS_CHUNK_TOKENS // 4,
+            timeout=REQUEST_TIMEOUT
+        )
+        return response.choices[0].message.content
+    
+    def extract_keywords(self, text: str, count: int = 10, chunked: Optional[bool] = None) -> Dict[str, Any]:
         """
         Extract keywords from text
         
+        Long texts are split into chunks analyzed concurrently, whose keywords
+        are then merged and their scores aggregated. The keywords of a
+        near-duplicate text are reused.
+        
         Args:
             text: The text to extract keywords from
             count: Number of keywords to extract
+            chunked: Whether to analyze the text in chunks, decided from its length if None
             
         Returns:
-            Dictionary containing extracted keywords or error information
+            Dictionary containing the list of Keyword, most relevant first,
+            or error information
         """
+        return self._get_similar_cached(
+            'extract_keywords',
+            text,
+            lambda: self._extract_keywords(text, count, chunked),
+            count=count
+        )
+    
+    def _extract_keywords(self, text: str, count: int, chunked: Optional[bool]) -> Dict[str, Any]:
+        """Extract the keywords of a text, bypassing the near-duplicate cache"""
         try:
-            # Check rate limits
-            self._rate_limit_check()
-            
             # Log the request
             self._log_request(
                 'extract_keywords',
@@ -224,28 +507,9 @@ class ContentAnalyzerService(BaseAIService):
                 count=count
             )
             
-            # Create the prompt
-            prompt = f"""
-            Extrais les {count} mots-clés ou expressions les plus pertinents du texte suivant.
-            Réponds uniquement avec un tableau JSON des mots-clés, sans texte supplémentaire.
-            
-            Texte:
-            "{text}"
-            """
-            
-            # Make the API request
-            response = self.client.chat.completions.create(
-                model=DEFAULT_TEXT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Tu es un expert en extraction de mots-clés qui répond uniquement en format JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,  # Low temperature for more consistent results
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            # Extract the keywords
-            keywords = response.choices[0].message.content
+            chunks = self._split_for_analysis(text, chunked)
+            extractions = self._map_chunks(lambda chunk: self._extract_keywords_chunk(chunk, count), chunks)
+            keywords = merge_keywords(extractions, [len(chunk) for chunk in chunks], count)
             
             # Log the response
             self._log_response('extract_keywords', keywords)
@@ -255,6 +519,41 @@ class ContentAnalyzerService(BaseAIService):
         except Exception as e:
             return self._handle_error(e)
     
+    def _extract_keywords_chunk(self, text: str, count: int) -> List[Keyword]:
+        """Extract the keywords of a text in a single request"""
+        # Check rate limits
+        self._rate_limit_check('extract_keywords')
+        
+        # Make the API request
+        extraction = self._create_structured_completion(
+            'extract_keywords',
+            KEYWORDS_SCHEMA,
+            context={'text': text, 'count': count},
+            timeout=REQUEST_TIMEOUT,
+            **self._keywords_request(text, count)
+        )
+        return extraction['keywords']
+    
+    def _keywords_request(self, text: str, count: int) -> Dict[str, Any]:
+        """Build the chat completion request extracting the keywords of a text"""
+        # Create the prompt
+        prompt = f"""
+        Extrais les {count} mots-clés ou expressions les plus pertinents du texte suivant,
+        avec pour chacun un score de pertinence entre 0 et 1.
+        
+        Texte:
+        "{text}"
+        """
+        
+        return {
+            'model': DEFAULT_TEXT_MODEL,
+            'messages': [
+                {"role": "system", "content": "Tu es un expert en extraction de mots-clés qui répond uniquement en format JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            'temperature': 0.1  # Low temperature for more consistent results
+        }
+    
     def analyze_engagement_potential(self, 
                                     text: str, 
                                     platform: str,
@@ -268,11 +567,11 @@ class ContentAnalyzerService(BaseAIService):
             target_audience: Description of the target audience
             
         Returns:
-            Dictionary containing engagement analysis or error information
+            Dictionary containing the EngagementAnalysis or error information
         """
         try:
             # Check rate limits
-            self._rate_limit_check()
+            self._rate_limit_check('analyze_engagement_potential')
             
             # Log the request
             self._log_request(
@@ -289,17 +588,17 @@ class ContentAnalyzerService(BaseAIService):
             Contenu:
             "{text}"
             
-            Réponds uniquement avec un JSON contenant:
+            Indique:
             - score: un nombre entre 0 et 100 représentant le potentiel d'engagement
             - forces: un tableau des points forts du contenu
             - faiblesses: un tableau des points faibles du contenu
             - suggestions: un tableau de suggestions pour améliorer l'engagement
-            
-            Réponds uniquement avec le JSON, sans texte supplémentaire.
             """
             
             # Make the API request
-            response = self.client.chat.completions.create(
+            analysis = self._create_structured_completion(
+                'analyze_engagement_potential',
+                ENGAGEMENT_SCHEMA,
                 model=DEFAULT_TEXT_MODEL,
                 messages=[
                     {"role": "system", "content": "Tu es un expert en analyse d'engagement sur les réseaux sociaux qui répond uniquement en format JSON."},
@@ -309,9 +608,6 @@ class ContentAnalyzerService(BaseAIService):
                 timeout=REQUEST_TIMEOUT
             )
             
-            # Extract the analysis
-            analysis = response.choices[0].message.content
-            
             # Log the response
             self._log_response('analyze_engagement_potential', analysis)
             
@@ -319,4 +615,157 @@ class ContentAnalyzerService(BaseAIService):
             
         except Exception as e:
             return self._handle_error(e)
-
+    
+    def submit_analysis_batch(self,
+                              operation: str,
+                              texts: Dict[str, str],
+                              count: int = 10,
+                              job_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Submit a non-urgent analysis of many texts as an offline batch job
+        
+        Args:
+            operation: One of batch_operations
+            texts: The texts to analyze, by request ID
+            count: Number of keywords to extract, for extract_keywords
+            job_id: Optional identifier of the job, generated if not provided
+            
+        Returns:
+            Dictionary containing the job manifest or error information
+        """
+        if operation == 'analyze_sentiment':
+            requests = [
+                {
+                    'request_id': request_id,
+                    'body': dict(self._sentiment_request(text), response_format=SENTIMENT_SCHEMA.response_format),
+                    'context': {'text': text}
+                }
+                for request_id, text in texts.items()
+            ]
+            return self.submit_batch_job(operation, requests, job_id=job_id)
+        
+        if operation == 'extract_keywords':
+            requests = [
+                {
+                    'request_id': request_id,
+                    'body': dict(self._keywords_request(text, count), response_format=KEYWORDS_SCHEMA.response_format),
+                    'context': {'text': text, 'count': count}
+                }
+                for request_id, text in texts.items()
+            ]
+            return self.submit_batch_job(operation, requests, job_id=job_id)
+        
+        if operation == 'check_content_moderation':
+            requests = [
+                {'request_id': request_id, 'body': {'model': CONTENT_MODERATION_MODEL, 'input': text}}
+                for request_id, text in texts.items()
+            ]
+            return self.submit_batch_job(operation, requests, endpoint='/v1/moderations', job_id=job_id)
+        
+        return self._handle_error(ValueError(f"Batch jobs don't support {operation}"))
+    
+    def _parse_batch_result(self, operation: str, body: Dict[str, Any]) -> Any:
+        """Extract and validate the result of a batch analysis request"""
+        if operation == 'check_content_moderation':
+            result = body['results'][0]
+            return {
+                'flagged': result['flagged'],
+                'categories': result['categories'],
+                'category_scores': result['category_scores']
+            }
+        
+        content = body['choices'][0]['message']['content']
+        if operation == 'analyze_sentiment':
+            return SENTIMENT_SCHEMA.parse(content)
+        if operation == 'extract_keywords':
+            keywords = KEYWORDS_SCHEMA.parse(content)['keywords']
+            return sorted(keywords, key=lambda item: item['score'], reverse=True)
+        return super()._parse_batch_result(operation, body)
+    
+    def triage_interaction(self,
+                           comment: str,
+                           post_content: str = "",
+                           brand_voice: Optional[str] = None,
+                           max_length: int = 200,
+                           brand_voice_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Triage an incoming comment in a single request
+        
+        Replaces the chain of analyze_sentiment, check_content_moderation and
+        generate_comment_response with one structured-output request.
+        
+        Args:
+            comment: The comment to triage
+            post_content: The content of the post the comment was made on
+            brand_voice: Description of the brand's voice and tone
+            max_length: Maximum length of the draft reply in characters
+            brand_voice_prompt: Compiled brand voice profile, used instead of brand_voice
+            
+        Returns:
+            Dictionary containing the sentiment, risk flags, intent and draft reply,
+            or error information
+        """
+        try:
+            # Check rate limits
+            self._rate_limit_check('triage_interaction')
+            
+            # Log the request
+            self._log_request(
+                'triage_interaction',
+                comment=comment[:100] + "..." if len(comment) > 100 else comment,
+                brand_voice=brand_voice,
+                has_brand_voice_prompt=brand_voice_prompt is not None,
+                max_length=max_length
+            )
+            
+            voice_instruction = "Le brouillon de réponse doit refléter la voix de la marque décrite dans tes instructions."
+            if not brand_voice_prompt and brand_voice:
+                voice_instruction = f'Le brouillon de réponse doit refléter la voix de la marque: "{brand_voice}".'
+            
+            # Create the prompt
+            prompt = f"""
+            Analyse ce commentaire reçu sur un post et prépare sa prise en charge.
+            
+            Post original:
+            "{post_content}"
+            
+            Commentaire:
+            "{comment}"
+            
+            - sentiment: le sentiment du commentaire et un score entre -1 (très négatif) et 1 (très positif)
+            - risk: si le commentaire doit être signalé à un modérateur, et les catégories de risque détectées
+            - intent: l'intention principale de l'auteur
+            - should_reply: si la marque doit répondre publiquement
+            - draft_reply: un brouillon de réponse de {max_length} caractères maximum, vide si should_reply est faux
+            
+            {voice_instruction}
+            """
+            
+            # Make the API request
+            triage = self._create_structured_completion(
+                'triage_interaction',
+                TRIAGE_SCHEMA,
+                model=DEFAULT_TEXT_MODEL,
+                messages=self._build_messages(
+                    "Tu es un community manager professionnel qui trie et modère les commentaires sur les réseaux sociaux.",
+                    prompt,
+                    brand_voice_prompt=brand_voice_prompt
+                ),
+                temperature=0.3,
+                max_tokens=min(DEFAULT_MAX_TOKENS, 150 + max_length // 2),
+                timeout=REQUEST_TIMEOUT
+            )
+            
+            # Never draft a reply to content that must be reviewed first
+            if triage['risk']['flagged']:
+                triage['should_reply'] = False
+                triage['draft_reply'] = ""
+            triage['draft_reply'] = triage['draft_reply'][:max_length]
+            
+            # Log the response
+            self._log_response('triage_interaction', triage)
+            
+            return self._format_success_response(triage)
+            
+        except Exception as e:
+            return self._handle_error(e)
@@ -46,14 +46,15 @@ class MediaAsset(db.Model, BaseModel):
     def __repr__(self):
         return f'<MediaAsset {self.id} - {self.type}>'
     
+    # Not named metadata, which SQLAlchemy reserves for the table metadata of models
     @property
-    def metadata(self):
+    def asset_metadata(self):
         if self._metadata:
             return json.loads(self._metadata)
         return {}
     
-    @metadata.setter
-    def metadata(self, value):
+    @asset_metadata.setter
+    def asset_metadata(self, value):
         self._metadata = json.dumps(value)
     
     def to_dict(self):
@@ -63,7 +64,7 @@ class MediaAsset(db.Model, BaseModel):
             'type': self.type,
             'url': self.url,
             'thumbnail_url': self.thumbnail_url,
-            'metadata': self.metadata,
+            'metadata': self.asset_metadata,
             'tags': self.tags,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
@@ -0,0 +1,69 @@
+from src.models.base import db, BaseModel
+
+class Conversation(db.Model, BaseModel):
+    """Conversation model for server-side chat and direct message history"""
+    __tablename__ = 'conversations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), nullable=True)
+    channel = db.Column(db.String(50), nullable=False, default='chat')  # chat, dm
+    summary = db.Column(db.Text, nullable=True)
+    summarized_message_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Relationships
+    user = db.relationship('User')
+    organization = db.relationship('Organization')
+    messages = db.relationship('ConversationMessage', back_populates='conversation',
+                               order_by='ConversationMessage.id', cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<Conversation {self.id} - {self.channel}>'
+    
+    @property
+    def unsummarized_messages(self):
+        """Messages that are not yet covered by the rolling summary"""
+        return self.messages[self.summarized_message_count:]
+    
+    def add_message(self, role, content):
+        message = ConversationMessage(role=role, content=content)
+        self.messages.append(message)
+        return message
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'organization_id': self.organization_id,
+            'channel': self.channel,
+            'summary': self.summary,
+            'message_count': len(self.messages),
+            'summarized_message_count': self.summarized_message_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class ConversationMessage(db.Model, BaseModel):
+    """Conversation message model for individual turns of a conversation"""
+    __tablename__ = 'conversation_messages'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
+    role = db.Column(db.String(20), nullable=False)  # user, assistant
+    content = db.Column(db.Text, nullable=False)
+    
+    # Relationships
+    conversation = db.relationship('Conversation', back_populates='messages')
+    
+    def __repr__(self):
+        return f'<ConversationMessage {self.id} in {self.conversation_id}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'conversation_id': self.conversation_id,
+            'role': self.role,
+            'content': self.content,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
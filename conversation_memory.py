@@ -0,0 +1,148 @@
+"""
+Conversation Memory Service
+
+This module keeps conversation prompts within a fixed token budget by compacting
+older turns into a rolling summary.
+"""
+
+from typing import Dict, Any, List, Optional
+from .base_service import BaseAIService, logger
+from .config import (
+    FALLBACK_TEXT_MODEL,
+    REQUEST_TIMEOUT,
+    CONVERSATION_TOKEN_BUDGET,
+    CONVERSATION_RECENT_TOKENS,
+    CONVERSATION_SUMMARY_MAX_TOKENS
+)
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens of a text (about 4 characters per token)"""
+    return len(text or '') // 4 + 4
+
+
+class ConversationMemoryService(BaseAIService):
+    """Service for compacting conversation history into a rolling summary"""
+
+    def __init__(self):
+        """Initialize the conversation memory service"""
+        super().__init__()
+
+    def compact_history(self,
+                        messages: List[Dict[str, str]],
+                        summary: Optional[str] = None,
+                        token_budget: int = CONVERSATION_TOKEN_BUDGET,
+                        recent_tokens: int = CONVERSATION_RECENT_TOKENS) -> Dict[str, Any]:
+        """
+        Compact a conversation so that its prompt fits in a token budget
+
+        When the summary and the messages exceed the budget, the oldest messages
+        are folded into the summary and only the most recent ones are kept verbatim.
+
+        Args:
+            messages: Messages not yet covered by the summary, oldest first
+            summary: The current rolling summary of older messages, if any
+            token_budget: Token budget above which the history is compacted
+            recent_tokens: Token budget of the messages kept verbatim after compaction
+
+        Returns:
+            Dictionary with the 'summary', the 'recent_messages' to send as is, and
+            'summarized_count', the number of leading messages folded into the summary
+        """
+        total_tokens = estimate_tokens(summary) + sum(estimate_tokens(msg.get('content', '')) for msg in messages)
+        if total_tokens <= token_budget:
+            return {'summary': summary, 'recent_messages': messages, 'summarized_count': 0}
+
+        # Keep the most recent messages that fit in the recent budget (always at least one)
+        kept_tokens = 0
+        split_index = len(messages)
+        while split_index > 0:
+            message_tokens = estimate_tokens(messages[split_index - 1].get('content', ''))
+            if split_index < len(messages) and kept_tokens + message_tokens > recent_tokens:
+                break
+            kept_tokens += message_tokens
+            split_index -= 1
+
+        if split_index == 0:
+            return {'summary': summary, 'recent_messages': messages, 'summarized_count': 0}
+
+        try:
+            new_summary = self.summarize(messages[:split_index], previous_summary=summary)
+        except Exception as e:
+            # Sending the full history is better than failing the conversation
+            logger.error(f"Conversation summarization failed: {str(e)}")
+            return {'summary': summary, 'recent_messages': messages, 'summarized_count': 0}
+
+        return {
+            'summary': new_summary,
+            'recent_messages': messages[split_index:],
+            'summarized_count': split_index
+        }
+
+    def summarize(self, messages: List[Dict[str, str]], previous_summary: Optional[str] = None) -> str:
+        """
+        Fold messages into a rolling conversation summary
+
+        Args:
+            messages: The messages to summarize, oldest first
+            previous_summary: The summary of the messages preceding them
+
+        Returns:
+            The updated summary
+        """
+        cache_key = self._generate_cache_key(
+            operation='summarize_conversation',
+            previous_summary=previous_summary,
+            messages=messages
+        )
+        summary, _ = self._get_cached(cache_key, lambda: self._summarize(messages, previous_summary))
+        return summary
+
+    def _summarize(self, messages: List[Dict[str, str]], previous_summary: Optional[str]) -> str:
+        """Make the summarization request, bypassing the cache"""
+        # Check rate limits
+        self._rate_limit_check('summarize_conversation')
+
+        # Log the request
+        self._log_request(
+            'summarize_conversation',
+            message_count=len(messages),
+            has_previous_summary=previous_summary is not None
+        )
+
+        formatted_messages = ""
+        for msg in messages:
+            formatted_messages += f"{msg.get('role', 'user')}: {msg.get('content', '')}\n"
+
+        prompt = f"""
+        Mets à jour le résumé de cette conversation avec les nouveaux messages.
+        Conserve les faits importants, les demandes du client, les engagements pris et les informations personnelles utiles.
+
+        Résumé actuel:
+        {previous_summary or "Aucun"}
+
+        Nouveaux messages:
+        {formatted_messages}
+
+        Réponds uniquement avec le résumé mis à jour, en quelques phrases.
+        """
+
+        # Make the API request
+        response = self._create_chat_completion(
+            'summarize_conversation',
+            model=FALLBACK_TEXT_MODEL,
+            messages=[
+                {"role": "system", "content": "Tu résumes des conversations de manière concise et factuelle."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.2,
+            max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS,
+            timeout=REQUEST_TIMEOUT
+        )
+
+        # Extract the summary
+        summary = response.choices[0].message.content
+
+        # Log the response
+        self._log_response('summarize_conversation', summary)
+
+        return summary
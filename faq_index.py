@@ -0,0 +1,212 @@
+"""
+FAQ Index
+
+This module provides a per-organization BM25 retrieval index over FAQ entries.
+"""
+
+import re
+import math
+import uuid
+from typing import Dict, Any, List, Optional
+from .index_store import OrganizationIndexStore
+from .config import (
+    FAQ_INDEX_DIR,
+    FAQ_BM25_K1,
+    FAQ_BM25_B
+)
+
+# Words that carry no retrieval signal in French and English questions
+STOPWORDS = {
+    'le', 'la', 'les', 'un', 'une', 'des', 'de', 'du', 'et', 'ou', 'en', 'au', 'aux',
+    'ce', 'ces', 'est', 'sont', 'je', 'tu', 'il', 'elle', 'nous', 'vous', 'ils', 'on',
+    'que', 'qui', 'quoi', 'pour', 'par', 'sur', 'dans', 'avec', 'pas', 'ne', 'se',
+    'mon', 'ma', 'mes', 'votre', 'vos', 'notre', 'nos', 'son', 'sa', 'ses',
+    'the', 'a', 'an', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'is', 'are',
+    'do', 'does', 'i', 'you', 'we', 'it', 'my', 'your', 'our', 'can', 'how', 'what'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens, dropping stopwords"""
+    return [
+        token for token in re.findall(r'\w+', (text or '').lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+class FAQIndex:
+    """BM25 index over the FAQ entries of a single organization"""
+
+    def __init__(self, k1: float = FAQ_BM25_K1, b: float = FAQ_BM25_B):
+        """
+        Initialize an empty FAQ index
+
+        Args:
+            k1: BM25 term frequency saturation parameter
+            b: BM25 document length normalization parameter
+        """
+        self.k1 = k1
+        self.b = b
+        self.entries = {}
+        self.term_freqs = {}
+        self.doc_lengths = {}
+        self.doc_freqs = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _document_tokens(self, entry: Dict[str, str]) -> List[str]:
+        # The question is counted twice so that it weighs more than the answer
+        question_tokens = tokenize(entry.get('question', ''))
+        return question_tokens * 2 + tokenize(entry.get('answer', ''))
+
+    def add_entry(self, question: str, answer: str, entry_id: Optional[str] = None) -> str:
+        """
+        Add or replace an FAQ entry, updating the index incrementally
+
+        Args:
+            question: The FAQ question
+            answer: The stored answer
+            entry_id: Optional identifier, generated if not provided
+
+        Returns:
+            The identifier of the entry
+        """
+        entry_id = entry_id or uuid.uuid4().hex
+        if entry_id in self.entries:
+            self.remove_entry(entry_id)
+
+        entry = {'id': entry_id, 'question': question, 'answer': answer}
+        tokens = self._document_tokens(entry)
+        term_freq = {}
+        for token in tokens:
+            term_freq[token] = term_freq.get(token, 0) + 1
+
+        self.entries[entry_id] = entry
+        self.term_freqs[entry_id] = term_freq
+        self.doc_lengths[entry_id] = len(tokens)
+        self.total_length += len(tokens)
+        for token in term_freq:
+            self.doc_freqs[token] = self.doc_freqs.get(token, 0) + 1
+
+        return entry_id
+
+    def remove_entry(self, entry_id: str) -> bool:
+        """Remove an FAQ entry from the index"""
+        if entry_id not in self.entries:
+            return False
+
+        for token in self.term_freqs[entry_id]:
+            self.doc_freqs[token] -= 1
+            if self.doc_freqs[token] == 0:
+                del self.doc_freqs[token]
+
+        self.total_length -= self.doc_lengths[entry_id]
+        del self.entries[entry_id]
+        del self.term_freqs[entry_id]
+        del self.doc_lengths[entry_id]
+        return True
+
+    def _idf(self, token: str) -> float:
+        doc_count = len(self.entries)
+        doc_freq = self.doc_freqs.get(token, 0)
+        return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Search the index for the entries most relevant to a query
+
+        Args:
+            query: The question to match
+            top_k: Maximum number of entries to return
+
+        Returns:
+            List of entries with their raw BM25 'score' and a 'match_score'
+            between 0 and 1, sorted by decreasing relevance
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens or not self.entries:
+            return []
+
+        average_length = self.total_length / len(self.entries) or 1
+        # Best achievable score for the query, used to normalize match scores
+        max_score = sum(self._idf(token) for token in query_tokens) or 1
+
+        results = []
+        for entry_id, term_freq in self.term_freqs.items():
+            length_norm = 1 - self.b + self.b * self.doc_lengths[entry_id] / average_length
+            score = 0.0
+            for token in query_tokens:
+                freq = term_freq.get(token)
+                if freq:
+                    score += self._idf(token) * freq * (self.k1 + 1) / (freq + self.k1 * length_norm)
+            if score > 0:
+                result = dict(self.entries[entry_id])
+                result['score'] = score
+                result['match_score'] = min(1.0, score / max_score)
+                results.append(result)
+
+        results.sort(key=lambda item: item['score'], reverse=True)
+        return results[:top_k]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the index entries"""
+        return {'entries': list(self.entries.values())}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FAQIndex':
+        """Rebuild an index from serialized entries"""
+        index = cls()
+        for entry in data.get('entries', []):
+            index.add_entry(entry.get('question', ''), entry.get('answer', ''), entry.get('id'))
+        return index
+
+
+class FAQIndexStore(OrganizationIndexStore):
+    """Stores one FAQ index per organization"""
+
+    index_class = FAQIndex
+
+    def __init__(self, storage_dir: str = FAQ_INDEX_DIR):
+        """
+        Initialize the FAQ index store
+
+        Args:
+            storage_dir: Directory where the organization indexes are saved
+        """
+        super().__init__(storage_dir)
+
+    def add_entries(self, organization_id: Any, entries: List[Dict[str, str]]) -> List[str]:
+        """
+        Add FAQ entries to the index of an organization
+
+        Args:
+            organization_id: The organization owning the FAQ
+            entries: List of FAQ items with 'question' and 'answer' keys,
+                and an optional 'id' to replace an existing entry
+
+        Returns:
+            List of the identifiers of the added entries
+        """
+        with self.lock:
+            index = self.get_index(organization_id)
+            entry_ids = [
+                index.add_entry(entry.get('question', ''), entry.get('answer', ''), entry.get('id'))
+                for entry in entries
+            ]
+            self.save_index(organization_id)
+        return entry_ids
+
+    def remove_entry(self, organization_id: Any, entry_id: str) -> bool:
+        """Remove an FAQ entry from the index of an organization"""
+        with self.lock:
+            removed = self.get_index(organization_id).remove_entry(entry_id)
+            if removed:
+                self.save_index(organization_id)
+        return removed
+
+    def search(self, organization_id: Any, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Search the FAQ index of an organization"""
+        with self.lock:
+            return self.get_index(organization_id).search(query, top_k=top_k)
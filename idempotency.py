@@ -0,0 +1,93 @@
+from src.models.base import db, BaseModel
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+
+class IdempotencyRecord(db.Model, BaseModel):
+    """Idempotency record model storing the response of a request made with an Idempotency-Key header"""
+    __tablename__ = 'idempotency_records'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'endpoint', 'key', name='unique_idempotency_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    endpoint = db.Column(db.String(255), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # hash of the request body
+    status = db.Column(db.String(20), nullable=False, default='in_progress')  # in_progress, completed
+    locked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyRecord {self.endpoint} - {self.key}>'
+    
+    @classmethod
+    def find(cls, user_id, endpoint, key):
+        # End the current transaction so that changes committed by other workers are visible
+        db.session.rollback()
+        return cls.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+    
+    @classmethod
+    def claim(cls, user_id, endpoint, key, fingerprint, lock_timeout):
+        """
+        Claim a key for a request
+        
+        Returns the record and whether the caller claimed it. The caller owns the
+        record when it is new, when the previous one expired, or when the request
+        holding it started more than lock_timeout seconds ago, as its worker died.
+        """
+        now = datetime.utcnow()
+        record = cls.find(user_id, endpoint, key)
+        if record and record.expires_at and record.expires_at <= now:
+            db.session.delete(record)
+            db.session.commit()
+            record = None
+        
+        if record is None:
+            record = cls(user_id=user_id, endpoint=endpoint, key=key, fingerprint=fingerprint, locked_at=now)
+            db.session.add(record)
+            try:
+                db.session.commit()
+                return record, True
+            except IntegrityError:
+                # Another worker claimed the key first
+                db.session.rollback()
+                return cls.find(user_id, endpoint, key), False
+        
+        if record.status == 'in_progress' and record.locked_at <= now - timedelta(seconds=lock_timeout):
+            # The worker of the original request died, take over its lock
+            taken = cls.query.filter_by(id=record.id, locked_at=record.locked_at).update({'locked_at': now})
+            db.session.commit()
+            if taken:
+                db.session.refresh(record)
+                return record, True
+        
+        return record, False
+    
+    def complete(self, status_code, body, ttl):
+        """Store the response to replay for ttl seconds"""
+        self.status = 'completed'
+        self.response_status = status_code
+        self.response_body = body
+        self.expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        db.session.add(self)
+        db.session.commit()
+    
+    def release(self):
+        """Forget the key, so that the request can be retried"""
+        db.session.delete(self)
+        db.session.commit()
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'endpoint': self.endpoint,
+            'key': self.key,
+            'status': self.status,
+            'response_status': self.response_status,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
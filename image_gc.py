@@ -0,0 +1,263 @@
+"""
+Image Garbage Collection
+
+This module deletes the generated images that are no longer needed: images
+referenced by the content of the app are always kept, and the others are
+deleted once unused for too long, or, oldest first, while the images of an
+organization exceed its disk quota. Deletions are spread in batches by a
+background thread.
+"""
+
+import os
+import re
+import time
+import fcntl
+import logging
+import sqlite3
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Callable
+from .image_storage import ContentAddressedImageStore
+from .config import (
+    IMAGE_GC_INTERVAL_SECONDS,
+    IMAGE_GC_GRACE_SECONDS,
+    IMAGE_GC_MAX_AGE_SECONDS,
+    IMAGE_ORG_QUOTA_BYTES,
+    IMAGE_GC_BATCH_SIZE,
+    IMAGE_GC_BATCH_PAUSE_SECONDS
+)
+
+logger = logging.getLogger('ai_service')
+
+# Images are named by their content hash, or by a UUID before images were content addressed
+_CONTENT_HASH = re.compile(r'[0-9a-f]{64}')
+
+# File name of the images referenced by a URL or a path of the uploads
+_IMAGE_REFERENCE = re.compile(r'/uploads/images/(?:[^\s"\'?#]*/)?([^\s"\'/?#]+)')
+
+
+def referenced_image_names(texts: Iterable[Optional[str]]) -> set:
+    """Find the file names of the generated images referenced in texts, such as URLs or post contents"""
+    names = set()
+    for text in texts:
+        if text:
+            names.update(_IMAGE_REFERENCE.findall(text))
+    return names
+
+
+class ImageIndex:
+    """Records the organizations each generated image was generated for, in a SQLite database"""
+
+    def __init__(self, db_path: str):
+        """
+        Initialize the index
+
+        Args:
+            db_path: Path of the SQLite database
+        """
+        self.db_path = db_path
+        self.local = threading.local()  # connections can't be shared between threads
+
+        # Create storage directory if it doesn't exist
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS image_owners ('
+            'content_hash TEXT NOT NULL, organization_id NOT NULL, used_at REAL NOT NULL, '
+            'PRIMARY KEY (content_hash, organization_id))'
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def record(self, content_hash: str, organization_id: Any) -> None:
+        """Record that an image was used by an organization"""
+        self._connect().execute(
+            'INSERT OR REPLACE INTO image_owners (content_hash, organization_id, used_at) VALUES (?, ?, ?)',
+            (content_hash, organization_id, time.time())
+        )
+
+    def owners(self) -> Dict[str, List[Any]]:
+        """Get the organizations of each recorded image"""
+        owners = {}
+        for content_hash, organization_id in self._connect().execute('SELECT content_hash, organization_id FROM image_owners'):
+            owners.setdefault(content_hash, []).append(organization_id)
+        return owners
+
+    def forget(self, content_hashes: List[str]) -> None:
+        """Remove the records of deleted images"""
+        self._connect().executemany('DELETE FROM image_owners WHERE content_hash = ?', [(h,) for h in content_hashes])
+
+
+class ImageGarbageCollector:
+    """Deletes the unreferenced images of a store, by age and per-organization quota"""
+
+    def __init__(self,
+                 store: ContentAddressedImageStore,
+                 index: ImageIndex,
+                 quota_bytes: int = IMAGE_ORG_QUOTA_BYTES,
+                 grace_seconds: float = IMAGE_GC_GRACE_SECONDS,
+                 max_age_seconds: float = IMAGE_GC_MAX_AGE_SECONDS,
+                 batch_size: int = IMAGE_GC_BATCH_SIZE,
+                 batch_pause: float = IMAGE_GC_BATCH_PAUSE_SECONDS):
+        """
+        Initialize the garbage collector
+
+        Args:
+            store: Store of the images
+            index: Index of the organizations of the images
+            quota_bytes: Bytes of images an organization can keep
+            grace_seconds: Seconds since its last use before an image can be deleted
+            max_age_seconds: Seconds since its last use after which an unreferenced image is deleted
+            batch_size: Number of files deleted between two pauses
+            batch_pause: Seconds of a pause between two batches
+        """
+        self.store = store
+        self.index = index
+        self.quota_bytes = quota_bytes
+        self.grace_seconds = grace_seconds
+        self.max_age_seconds = max_age_seconds
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.referenced_names = None
+        self.last_report = None
+        self.totals = {'runs': 0, 'deleted_files': 0, 'reclaimed_bytes': 0}
+        self.lock = threading.Lock()
+
+    def start(self, referenced_names: Callable[[], set], interval: float = IMAGE_GC_INTERVAL_SECONDS) -> None:
+        """
+        Collect images periodically in a background thread
+
+        Args:
+            referenced_names: Function returning the file names of the images referenced by the app
+            interval: Seconds between two collections
+        """
+        with self.lock:
+            if self.referenced_names is not None:
+                return
+            self.referenced_names = referenced_names
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.collect()
+                except Exception as e:
+                    logger.error(f"Error collecting generated images: {str(e)}")
+
+        threading.Thread(target=run, name='image-gc', daemon=True).start()
+
+    def _scan(self) -> List[Dict[str, Any]]:
+        files = []
+        for shard in list(os.scandir(self.store.storage_dir)):
+            entries = list(os.scandir(shard.path)) if shard.is_dir() else [shard]
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append({'name': entry.name, 'path': entry.path, 'size': stat.st_size, 'used_at': stat.st_mtime})
+        return files
+
+    def collect(self, referenced_names: Optional[set] = None) -> Dict[str, Any]:
+        """
+        Delete the unreferenced images past the age policy or the quota of their organizations
+
+        Only one process of the host collects at a time; the others skip.
+
+        Args:
+            referenced_names: File names of the referenced images, from the
+                function given to start if not given
+
+        Returns:
+            The report of the collection, with its 'deleted_files' and 'reclaimed_bytes',
+            or None if another process is collecting
+        """
+        with open(f"{self.index.db_path}.gc.lock", 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            return self._collect(referenced_names if referenced_names is not None else self.referenced_names())
+
+    def _collect(self, referenced: set) -> Dict[str, Any]:
+        started_at = time.time()
+        files = self._scan()
+        owners = self.index.owners()
+
+        # Unreferenced images out of their grace period, oldest first
+        candidates = sorted(
+            (image for image in files
+             if image['name'] not in referenced and started_at - image['used_at'] >= self.grace_seconds),
+            key=lambda image: image['used_at']
+        )
+        # Temporary files are left by writes interrupted by a crash
+        doomed = {
+            image['path']: image for image in candidates
+            if started_at - image['used_at'] >= self.max_age_seconds or image['name'].endswith('.tmp')
+        }
+
+        # Images an organization generated count against its quota, even when shared with another one
+        usage = {}
+        for image in files:
+            for organization_id in owners.get(os.path.splitext(image['name'])[0], ()):
+                usage[organization_id] = usage.get(organization_id, 0) + image['size']
+        for image in doomed.values():
+            for organization_id in owners.get(os.path.splitext(image['name'])[0], ()):
+                usage[organization_id] -= image['size']
+        over_quota = {organization_id for organization_id, used in usage.items() if used > self.quota_bytes}
+        for image in candidates:
+            image_owners = owners.get(os.path.splitext(image['name'])[0], ())
+            if image['path'] in doomed or not over_quota.intersection(image_owners):
+                continue
+            doomed[image['path']] = image
+            for organization_id in image_owners:
+                usage[organization_id] -= image['size']
+                if usage[organization_id] <= self.quota_bytes:
+                    over_quota.discard(organization_id)
+
+        deleted = self._delete(list(doomed.values()))
+        report = {
+            'started_at': started_at,
+            'duration': time.time() - started_at,
+            'scanned_files': len(files),
+            'scanned_bytes': sum(image['size'] for image in files),
+            'deleted_files': len(deleted),
+            'reclaimed_bytes': sum(image['size'] for image in deleted),
+            'organizations_over_quota': len([used for used in usage.values() if used > self.quota_bytes])
+        }
+        with self.lock:
+            self.last_report = report
+            self.totals['runs'] += 1
+            self.totals['deleted_files'] += report['deleted_files']
+            self.totals['reclaimed_bytes'] += report['reclaimed_bytes']
+        logger.info(f"Collected {report['deleted_files']} generated images, reclaiming {report['reclaimed_bytes']} bytes")
+        return report
+
+    def _delete(self, images: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        deleted = []
+        for start in range(0, len(images), self.batch_size):
+            if start:
+                time.sleep(self.batch_pause)
+            content_hashes = []
+            for image in images[start:start + self.batch_size]:
+                content_hash = os.path.splitext(image['name'])[0]
+                try:
+                    # Skip images used again or being written since the scan
+                    if content_hash in self.store.pending or os.stat(image['path']).st_mtime != image['used_at']:
+                        continue
+                    os.remove(image['path'])
+                except FileNotFoundError:
+                    continue
+                deleted.append(image)
+                if _CONTENT_HASH.fullmatch(content_hash):
+                    content_hashes.append(content_hash)
+            self.index.forget(content_hashes)
+        return deleted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the report of the last collection, and the totals since the process started"""
+        with self.lock:
+            return {'last_run': self.last_report, **self.totals}
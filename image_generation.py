@@ -5,33 +5,44 @@ This module provides image generation capabilities using OpenAI's API.
 """
 
 import os
-import base64
 import time
-import uuid
-from typing import Dict, Any, List, Optional, Union
-from .base_service import BaseAIService
+import base64
+from typing import Dict, Any, List, Optional, Union, Callable
+from .base_service import BaseAIService, logger
+from .image_storage import ContentAddressedImageStore
+from .image_variants import render_variants
+from .image_gc import ImageIndex, ImageGarbageCollector
+from .request_scheduler import get_request_scope
 from .config import (
     DEFAULT_IMAGE_MODEL,
     FALLBACK_IMAGE_MODEL,
     REQUEST_TIMEOUT,
-    PROMPT_TEMPLATES
+    PROMPT_TEMPLATES,
+    IMAGE_MASTER_SIZE,
+    IMAGE_PREVIEW_SIZE,
+    PLATFORM_IMAGE_SIZES
 )
 
 class ImageGenerationService(BaseAIService):
     """Service for generating images using AI"""
     
-    def __init__(self, upload_dir: str = "/tmp/community_ai/uploads"):
+    def __init__(self, upload_dir: str = "/tmp/community_ai/uploads", index_path: Optional[str] = None):
         """
         Initialize the image generation service
         
         Args:
             upload_dir: Directory to save generated images
+            index_path: Path of the database recording the organizations of the
+                images, for their garbage collection; images aren't recorded if not given
         """
         super().__init__()
         self.upload_dir = upload_dir
         
         # Create upload directory if it doesn't exist
         os.makedirs(self.upload_dir, exist_ok=True)
+        self.image_store = ContentAddressedImageStore(self.upload_dir)
+        self.image_index = ImageIndex(index_path) if index_path else None
+        self.image_gc = ImageGarbageCollector(self.image_store, self.image_index) if index_path else None
     
     def generate_image(self,
                       prompt: str,
@@ -55,9 +66,6 @@ class ImageGenerationService(BaseAIService):
             Dictionary containing the generated image info or error information
         """
         try:
-            # Check rate limits
-            self._rate_limit_check()
-            
             # Log the request
             self._log_request(
                 'generate_image',
@@ -67,64 +75,69 @@ class ImageGenerationService(BaseAIService):
                 quality=quality
             )
             
-            # Check cache if enabled
-            if use_cache:
+            def generate():
+                # Check rate limits
+                self._rate_limit_check()
+                
+                # Make the API request
+                response = self.client.images.generate(
+                    model=model,
+                    prompt=prompt,
+                    size=size,
+                    quality=quality,
+                    n=1,
+                    response_format="b64_json",
+                    timeout=REQUEST_TIMEOUT
+                )
+                
+                # Extract the image data
+                image_data = response.data[0].b64_json
+                
+                # Prepare the result
+                result = {
+                    'image_path': None,
+                    'content_hash': None,
+                    'prompt': prompt,
+                    'model': model,
+                    'size': size,
+                    'quality': quality,
+                    'timestamp': time.time()
+                }
+                
+                # Save the image to disk if requested, under its content hash
+                if save_to_disk and image_data:
+                    stored = self.image_store.save_b64(image_data)
+                    result['image_path'] = stored['path']
+                    result['content_hash'] = stored['content_hash']
+                else:
+                    result['image_data'] = image_data
+                return result
+            
+            # Go through the cache if enabled, which only holds paths
+            if use_cache and save_to_disk:
                 cache_key = self._generate_cache_key(
                     prompt=prompt,
                     model=model,
                     size=size,
                     quality=quality
                 )
-                cached_response = self._get_from_cache(cache_key)
-                if cached_response:
-                    return self._format_success_response(cached_response)
-            
-            # Make the API request
-            response = self.client.images.generate(
-                model=model,
-                prompt=prompt,
-                size=size,
-                quality=quality,
-                n=1,
-                response_format="b64_json",
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            # Extract the image data
-            image_data = response.data[0].b64_json
-            
-            # Save the image to disk if requested
-            image_path = None
-            if save_to_disk and image_data:
-                # Generate a unique filename
-                filename = f"{uuid.uuid4()}.png"
-                image_path = os.path.join(self.upload_dir, filename)
-                
-                # Decode and save the image
-                with open(image_path, "wb") as image_file:
-                    image_file.write(base64.b64decode(image_data))
+                cached_item = self._get_cache_entry(cache_key)
+                if cached_item and not self._image_available(cached_item['data']):
+                    # The image was deleted from disk since
+                    self.cache.pop(cache_key, None)
+                result, stale = self._get_cached(cache_key, generate)
+            else:
+                result, stale = generate(), False
             
-            # Prepare the result
-            result = {
-                'image_data': image_data,
-                'image_path': image_path,
-                'prompt': prompt,
-                'model': model,
-                'size': size,
-                'quality': quality,
-                'timestamp': time.time()
-            }
+            self._record_image_owner(result)
             
             # Log the response (without the image data)
             log_result = result.copy()
-            log_result['image_data'] = f"<base64 data of length {len(image_data) if image_data else 0}>"
+            if 'image_data' in log_result:
+                log_result['image_data'] = f"<base64 data of length {len(result['image_data'] or '')}>"
             self._log_response('generate_image', log_result)
             
-            # Cache the response if caching is enabled
-            if use_cache:
-                self._save_to_cache(cache_key, result)
-            
-            return self._format_success_response(result)
+            return self._format_success_response(result, stale=stale)
             
         except Exception as e:
             # Try fallback model if primary fails
@@ -143,25 +156,125 @@ class ImageGenerationService(BaseAIService):
             else:
                 return self._handle_error(e)
     
+    def generate_image_preview(self, prompt: str) -> Dict[str, Any]:
+        """
+        Generate a low-cost draft of an image, to iterate on its prompt
+        
+        The draft is generated at the smallest size of the cheaper fallback
+        model; finalize_image generates the chosen prompt at full quality.
+        
+        Args:
+            prompt: The prompt to generate an image from
+            
+        Returns:
+            Dictionary containing the generated image info, flagged as a 'preview',
+            or error information
+        """
+        result = self.generate_image(
+            prompt=prompt,
+            model=FALLBACK_IMAGE_MODEL,
+            size=IMAGE_PREVIEW_SIZE,
+            quality="standard"
+        )
+        if not result.get('success'):
+            return result
+        # Copy the data, as it is cached
+        return dict(result, data=dict(result['data'], preview=True))
+    
+    def finalize_image(self,
+                       prompt: str,
+                       size: str = "1024x1024",
+                       quality: str = "standard") -> Dict[str, Any]:
+        """
+        Generate the final image of a prompt chosen from its previews
+        
+        The final image is cached like any generated image, so finalizing the
+        same prompt again doesn't generate it again.
+        
+        Args:
+            prompt: The chosen prompt
+            size: Image size (e.g., "1024x1024", "1792x1024")
+            quality: Image quality ("standard" or "hd")
+            
+        Returns:
+            Dictionary containing the generated image info or error information
+        """
+        return self.generate_image(
+            prompt=prompt,
+            model=DEFAULT_IMAGE_MODEL,
+            size=size,
+            quality=quality
+        )
+    
+    def _record_image_owner(self, result: Dict[str, Any]) -> None:
+        """Record the organization of the request as a user of a stored image, which counts against its quota"""
+        if self.image_index is None or not result.get('content_hash'):
+            return
+        try:
+            self.image_index.record(result['content_hash'], get_request_scope()['organization_id'])
+        except Exception as e:
+            # The image is only collected by age
+            logger.warning(f"Error recording the owner of image {result['content_hash']}: {str(e)}")
+    
+    def start_image_gc(self, referenced_names: Callable[[], set]) -> None:
+        """
+        Start the garbage collection of the generated images, if they are recorded
+        
+        Args:
+            referenced_names: Function returning the file names of the images referenced by the app
+        """
+        if self.image_gc is not None:
+            self.image_gc.start(referenced_names)
+    
+    def get_image_gc_stats(self) -> Optional[Dict[str, Any]]:
+        """Get the reclaimed space of the garbage collection of the generated images"""
+        return self.image_gc.get_stats() if self.image_gc is not None else None
+    
+    def _image_available(self, result: Dict[str, Any]) -> bool:
+        """Whether the image of a result is on disk or being written"""
+        content_hash = result.get('content_hash')
+        return bool(content_hash) and (content_hash in self.image_store.pending or os.path.exists(result['image_path']))
+    
+    def wait_for_image(self, result: Dict[str, Any]) -> None:
+        """Wait for the pending write of the image of a result, so that its URL can be served"""
+        if result.get('content_hash'):
+            self.image_store.wait(result['content_hash'])
+    
+    def load_image_b64(self, result: Dict[str, Any]) -> str:
+        """Read the base64 encoding of a stored image, for clients that explicitly ask for its bytes"""
+        self.wait_for_image(result)
+        with open(result['image_path'], 'rb') as image_file:
+            return base64.b64encode(image_file.read()).decode('ascii')
+    
     def generate_social_media_image(self,
-                                   platform: str,
+                                   platform: Union[str, List[str]],
                                    description: str,
                                    style: str = "moderne",
                                    mood: str = "positif",
-                                   colors: str = "bleu, blanc") -> Dict[str, Any]:
+                                   colors: str = "bleu, blanc",
+                                   crop_mode: str = "saliency") -> Dict[str, Any]:
         """
         Generate an image for social media
         
+        For a list of platforms, a single master image is generated, and the
+        image of each platform is cropped from it locally.
+        
         Args:
-            platform: The social media platform (e.g., "Instagram", "LinkedIn")
+            platform: The social media platform (e.g., "Instagram", "LinkedIn"), or a list of platforms
             description: Description of the image content
             style: The visual style of the image
             mood: The mood or emotion of the image
             colors: Dominant colors to use
+            crop_mode: How the variants are cropped from the master image, one of CROP_MODES
             
         Returns:
-            Dictionary containing the generated image info or error information
+            Dictionary containing the generated image info or error information. For
+            a list of platforms, the data is the master image info, with the
+            'variants' of each platform
         """
+        if isinstance(platform, list):
+            return self._generate_platform_variants(platform, description, style, mood, colors, crop_mode)
+        
         # Format the prompt using the template
         prompt = PROMPT_TEMPLATES['image_prompt'].format(
             platform=platform,
@@ -171,28 +284,82 @@ class ImageGenerationService(BaseAIService):
             colors=colors
         )
         
-        # Determine the appropriate size based on platform
-        size = "1024x1024"  # Default square format
-        if platform.lower() == "instagram":
-            size = "1024x1024"  # Square for Instagram
-        elif platform.lower() == "facebook":
-            size = "1792x1024"  # Landscape for Facebook
-        elif platform.lower() == "twitter" or platform.lower() == "x":
-            size = "1792x1024"  # Landscape for Twitter/X
-        elif platform.lower() == "linkedin":
-            size = "1792x1024"  # Landscape for LinkedIn
-        elif platform.lower() == "pinterest":
-            size = "1024x1792"  # Portrait for Pinterest
-        elif platform.lower() == "tiktok":
-            size = "1024x1792"  # Portrait for TikTok
+        # Determine the appropriate size based on platform, square by default
+        width, height = PLATFORM_IMAGE_SIZES.get(platform.lower(), (1024, 1024))
         
         # Generate the image
         return self.generate_image(
             prompt=prompt,
-            size=size,
+            size=f"{width}x{height}",
             quality="standard"
         )
     
+    def _generate_platform_variants(self,
+                                    platforms: List[str],
+                                    description: str,
+                                    style: str,
+                                    mood: str,
+                                    colors: str,
+                                    crop_mode: str) -> Dict[str, Any]:
+        """Generate a master image, and crop the image of each platform from it"""
+        prompt = PROMPT_TEMPLATES['image_prompt'].format(
+            platform=', '.join(platforms),
+            description=description,
+            style=style,
+            mood=mood,
+            colors=colors
+        )
+        # Keep the subject away from the borders, which landscape and portrait variants crop out
+        prompt += "Le sujet principal doit être centré, avec de la marge autour.\n"
+        
+        master = self.generate_image(
+            prompt=prompt,
+            size=IMAGE_MASTER_SIZE,
+            quality="standard"
+        )
+        if not master.get('success'):
+            return master
+        
+        try:
+            master_data = master['data']
+            cache_key = self._generate_cache_key(
+                operation='image_variants',
+                content_hash=master_data['content_hash'],
+                platforms=platforms,
+                crop_mode=crop_mode
+            )
+            cached_item = self._get_cache_entry(cache_key)
+            if cached_item and not all(self._image_available(variant) for variant in cached_item['data'].values()):
+                # A variant was deleted from disk since
+                self.cache.pop(cache_key, None)
+            variants, _ = self._get_cached(cache_key, lambda: self._render_variants(master_data, platforms, crop_mode))
+            for variant in variants.values():
+                self._record_image_owner(variant)
+            
+            self._log_response('generate_platform_variants', {'master': master_data['content_hash'], 'platforms': platforms})
+            return self._format_success_response(dict(master_data, variants=variants), stale=master.get('stale', False))
+        except Exception as e:
+            return self._handle_error(e)
+    
+    def _render_variants(self, master: Dict[str, Any], platforms: List[str], crop_mode: str) -> Dict[str, Dict[str, Any]]:
+        """Crop and store the image of each platform from a stored master image"""
+        # The workers read the master from disk
+        self.image_store.wait(master['content_hash'])
+        sizes = {platform: PLATFORM_IMAGE_SIZES.get(platform.lower(), (1024, 1024)) for platform in platforms}
+        rendered = render_variants(master['image_path'], sizes, crop_mode)
+        
+        variants = {}
+        for platform, variant in rendered.items():
+            stored = self.image_store.save_b64(variant['image_b64'])
+            variants[platform] = {
+                'image_path': stored['path'],
+                'content_hash': stored['content_hash'],
+                'width': variant['width'],
+                'height': variant['height'],
+                'crop_box': variant['crop_box']
+            }
+        return variants
+    
     def generate_profile_picture(self,
                                description: str,
                                style: str = "professionnel",
@@ -0,0 +1,104 @@
+"""
+Image Storage
+
+This module stores generated images under their content hash, so that the same
+image is never written twice. Images are decoded and written by a background
+writer, to a temporary file renamed into place once complete. The modification
+time of an image is its last use, refreshed when it is generated again.
+"""
+
+import os
+import base64
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from .config import IMAGE_WRITE_WORKERS
+
+logger = logging.getLogger('ai_service')
+
+
+class ContentAddressedImageStore:
+    """Stores images in a directory, under the hash of their content"""
+
+    def __init__(self, storage_dir: str, max_workers: int = IMAGE_WRITE_WORKERS):
+        """
+        Initialize the image store
+
+        Args:
+            storage_dir: Directory where the images are stored
+            max_workers: Number of background writers
+        """
+        self.storage_dir = storage_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-writer')
+        self.pending = {}  # content hash to the future of its write
+        # Reentrant, as the callback of a write that is already over runs in the submitting thread
+        self.lock = threading.RLock()
+
+        # Create storage directory if it doesn't exist
+        os.makedirs(self.storage_dir, exist_ok=True)
+
+    @staticmethod
+    def content_hash(image_b64: str) -> str:
+        """Hash of an image, computed on its base64 encoding so that it doesn't need to be decoded"""
+        return hashlib.sha256(image_b64.encode('ascii')).hexdigest()
+
+    def path_for(self, content_hash: str, extension: str = 'png') -> str:
+        """Get the path of an image, sharded by the first characters of its hash"""
+        return os.path.join(self.storage_dir, content_hash[:2], f"{content_hash}.{extension}")
+
+    def save_b64(self, image_b64: str, extension: str = 'png') -> Dict[str, str]:
+        """
+        Store a base64 encoded image, unless the same image is already stored
+
+        The image is decoded and written in the background; the returned path is
+        final, and the file appears there atomically.
+
+        Args:
+            image_b64: The base64 encoded image
+            extension: File extension of the image format
+
+        Returns:
+            Dictionary with the 'content_hash' and 'path' of the image
+        """
+        content_hash = self.content_hash(image_b64)
+        path = self.path_for(content_hash, extension)
+
+        with self.lock:
+            if content_hash not in self.pending and not self._touch(path):
+                future = self.executor.submit(self._write, path, image_b64)
+                self.pending[content_hash] = future
+                future.add_done_callback(lambda _: self._done(content_hash))
+
+        return {'content_hash': content_hash, 'path': path}
+
+    def wait(self, content_hash: str, timeout: Optional[float] = None) -> None:
+        """Wait for the pending write of an image, if any"""
+        with self.lock:
+            future = self.pending.get(content_hash)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def _touch(self, path: str) -> bool:
+        """Mark an image as used now, so that it isn't garbage collected, returning whether it exists"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _done(self, content_hash: str) -> None:
+        with self.lock:
+            future = self.pending.pop(content_hash, None)
+        if future is not None and future.exception():
+            logger.error(f"Error writing image {content_hash}: {str(future.exception())}")
+
+    def _write(self, path: str, image_b64: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as image_file:
+            image_file.write(base64.b64decode(image_b64))
+            image_file.flush()
+            os.fsync(image_file.fileno())
+        os.replace(temp_path, path)
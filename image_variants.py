@@ -0,0 +1,141 @@
+"""
+Image Variants
+
+This module derives the platform images of a campaign from a single master
+image: the master is cropped to the aspect ratio of each platform around its
+most salient region, and downscaled, in a pool of worker processes.
+"""
+
+import io
+import base64
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Tuple
+from PIL import Image, ImageFilter
+from .config import IMAGE_VARIANT_WORKERS
+
+# Crop modes: around the region with the most detail, or in the middle of the image
+CROP_MODES = ('saliency', 'center')
+
+SALIENCY_GRID_SIZE = 64  # size of the thumbnail the saliency of an image is measured on
+CENTER_WEIGHT = 0.5  # how much less salient the borders of an image are than its center
+
+
+def _salient_offset(image: Image.Image, horizontal: bool, crop_length: int) -> int:
+    """Offset of the crop window along the cropped axis, holding the most edge energy"""
+    grid = image.convert('L')
+    grid.thumbnail((SALIENCY_GRID_SIZE, SALIENCY_GRID_SIZE))
+    edges = grid.filter(ImageFilter.FIND_EDGES)
+    grid_width, grid_height = edges.size
+    pixels = edges.load()
+
+    # Edge energy of each column or row, skipping the border, where the filter has no neighbours
+    length, depth = (grid_width, grid_height) if horizontal else (grid_height, grid_width)
+    profile = []
+    for i in range(length):
+        if i in (0, length - 1):
+            profile.append(0.0)
+            continue
+        energy = sum(pixels[i, j] if horizontal else pixels[j, i] for j in range(1, depth - 1))
+        # Center-weighted, so that the subject is kept over a detailed background
+        profile.append(energy * (1 - CENTER_WEIGHT * abs(2 * (i + 0.5) / length - 1)))
+
+    full_length = image.width if horizontal else image.height
+    window = max(1, round(crop_length * length / full_length))
+    sums = [sum(profile[start:start + window]) for start in range(length - window + 1)]
+    middle = (length - window) / 2
+    best = max(range(len(sums)), key=lambda start: (sums[start], -abs(start - middle)))
+    return min(round(best * full_length / length), full_length - crop_length)
+
+
+def crop_box(image: Image.Image, width: int, height: int, mode: str = 'saliency') -> Tuple[int, int, int, int]:
+    """
+    Get the largest box of an image with the aspect ratio of width x height
+
+    Args:
+        image: The image to crop
+        width: Width of the target size
+        height: Height of the target size
+        mode: One of CROP_MODES
+
+    Returns:
+        The (left, top, right, bottom) box
+    """
+    image_width, image_height = image.size
+    crop_width = min(image_width, round(image_height * width / height))
+    crop_height = min(image_height, round(image_width * height / width))
+
+    # Only one axis is cropped
+    horizontal = crop_width < image_width
+    crop_length, full_length = (crop_width, image_width) if horizontal else (crop_height, image_height)
+    if crop_length == full_length:
+        offset = 0
+    elif mode == 'saliency':
+        offset = _salient_offset(image, horizontal, crop_length)
+    else:
+        offset = (full_length - crop_length) // 2
+
+    if horizontal:
+        return (offset, 0, offset + crop_width, crop_height)
+    return (0, offset, crop_width, offset + crop_height)
+
+
+def render_variant(master_path: str, width: int, height: int, mode: str = 'saliency') -> Dict[str, Any]:
+    """
+    Crop and downscale a master image to a target size, in a worker process
+
+    Returns:
+        Dictionary with the base64 encoded 'image_b64' PNG, its 'width',
+        'height', and the 'crop_box' taken from the master
+    """
+    with Image.open(master_path) as master:
+        master.load()
+        box = crop_box(master, width, height, mode)
+        variant = master.crop(box)
+
+    if variant.width > width:
+        # Never upscaled, as it wouldn't add any detail
+        variant = variant.resize((width, height), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    variant.save(buffer, format='PNG')
+    return {
+        'image_b64': base64.b64encode(buffer.getvalue()).decode('ascii'),
+        'width': variant.width,
+        'height': variant.height,
+        'crop_box': list(box)
+    }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned rather than forked, as forking while other threads hold locks can deadlock the workers
+            _executor = ProcessPoolExecutor(max_workers=IMAGE_VARIANT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def render_variants(master_path: str,
+                    sizes: Dict[str, Tuple[int, int]],
+                    mode: str = 'saliency') -> Dict[str, Dict[str, Any]]:
+    """
+    Render the variants of a master image in the worker processes
+
+    Args:
+        master_path: Path of the master image
+        sizes: Dictionary of variant name to its (width, height)
+        mode: One of CROP_MODES
+
+    Returns:
+        Dictionary of variant name to its rendered image, as returned by render_variant
+    """
+    # Variants of the same size are rendered once
+    executor = _get_executor()
+    futures = {size: executor.submit(render_variant, master_path, size[0], size[1], mode) for size in set(sizes.values())}
+    return {name: futures[size].result() for name, size in sizes.items()}
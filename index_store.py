@@ -0,0 +1,56 @@
+"""
+Index Store
+
+This module provides per-organization storage for the AI retrieval indexes.
+"""
+
+import os
+import json
+import threading
+from typing import Dict, Any
+
+
+class OrganizationIndexStore:
+    """Stores one index per organization, persisted as JSON files"""
+
+    # Index class, must provide to_dict() and a from_dict() class method
+    index_class = None
+
+    def __init__(self, storage_dir: str):
+        """
+        Initialize the index store
+
+        Args:
+            storage_dir: Directory where the organization indexes are saved
+        """
+        self.storage_dir = storage_dir
+        self.indexes = {}
+        self.lock = threading.RLock()
+
+        # Create storage directory if it doesn't exist
+        os.makedirs(self.storage_dir, exist_ok=True)
+
+    def _index_path(self, organization_id: Any) -> str:
+        return os.path.join(self.storage_dir, f"org_{organization_id}.json")
+
+    def get_index(self, organization_id: Any):
+        """Get the index of an organization, loading it from disk if needed"""
+        with self.lock:
+            if organization_id not in self.indexes:
+                path = self._index_path(organization_id)
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as index_file:
+                        self.indexes[organization_id] = self.index_class.from_dict(json.load(index_file))
+                else:
+                    self.indexes[organization_id] = self.index_class()
+            return self.indexes[organization_id]
+
+    def save_index(self, organization_id: Any) -> None:
+        """Persist the index of an organization"""
+        path = self._index_path(organization_id)
+        temp_path = f"{path}.tmp"
+        with self.lock:
+            index = self.get_index(organization_id)
+            with open(temp_path, 'w', encoding='utf-8') as index_file:
+                json.dump(index.to_dict(), index_file, ensure_ascii=False)
+            os.replace(temp_path, path)
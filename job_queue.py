@@ -0,0 +1,344 @@
+"""
+Job Queue
+
+This module runs long AI operations asynchronously: jobs are stored in a local
+SQLite database shared by the processes of the host, claimed by a pool of
+worker threads, and polled by the clients for their status and result. Workers
+renew the lease of the jobs they run, and a job whose worker died is run again
+once its lease expires.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from typing import Dict, Any, Optional, Callable
+from .request_scheduler import request_scope
+from .config import (
+    AI_JOB_DB_PATH,
+    AI_JOB_WORKERS,
+    AI_JOB_POLL_SECONDS,
+    AI_JOB_LEASE_SECONDS,
+    AI_JOB_MAX_ATTEMPTS,
+    AI_JOB_RETENTION_SECONDS
+)
+
+logger = logging.getLogger('ai_service')
+
+# Job statuses after which a job doesn't change anymore
+TERMINAL_STATUSES = {'completed', 'failed'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ai_jobs (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    organization_id,  -- untyped, as it is the ID of an organization or the user_<id> share of a user
+    subscription_plan TEXT,
+    operation TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    media_asset_id INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    lease_expires_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_ai_jobs_status ON ai_jobs (status, created_at);
+"""
+
+
+class JobStore:
+    """Stores jobs in a SQLite database"""
+
+    def __init__(self, db_path: str = AI_JOB_DB_PATH):
+        """
+        Initialize the job store
+
+        Args:
+            db_path: Path of the SQLite database
+        """
+        self.db_path = db_path
+        self.local = threading.local()  # connections can't be shared between threads
+
+        # Create storage directory if it doesn't exist
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # Autocommit, with explicit transactions where rows are claimed
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def create(self,
+               operation: str,
+               params: Dict[str, Any],
+               lane: str,
+               user_id: Optional[int] = None,
+               organization_id: Optional[Any] = None,
+               subscription_plan: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a new job, returning it"""
+        job_id = uuid.uuid4().hex
+        self._connect().execute(
+            'INSERT INTO ai_jobs (id, user_id, organization_id, subscription_plan, operation, lane, params, status, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, user_id, organization_id, subscription_plan, operation, lane,
+             json.dumps(params, ensure_ascii=False), 'queued', time.time())
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job, or None if it doesn't exist"""
+        row = self._connect().execute('SELECT * FROM ai_jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def claim(self, lease_seconds: float, max_attempts: int) -> Optional[Dict[str, Any]]:
+        """
+        Claim the oldest job to run, if any
+
+        Queued jobs are claimed first, then running jobs whose lease expired, as
+        their worker died. Jobs that already used their attempts are failed.
+
+        Returns:
+            The claimed job, or None if there is no job to run
+        """
+        connection = self._connect()
+        now = time.time()
+        # Locks the database for writes, so that a job is claimed by a single worker
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "UPDATE ai_jobs SET status = 'failed', finished_at = ?, result = ? "
+                "WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?",
+                (now, json.dumps({'success': False, 'error': 'JobTimeout', 'message': 'The job did not finish in time'}),
+                 now, max_attempts)
+            )
+            row = connection.execute(
+                "SELECT * FROM ai_jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?) "
+                "ORDER BY status = 'running', created_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE ai_jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_expires_at = ? "
+                    "WHERE id = ?",
+                    (now, now + lease_seconds, row['id'])
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return self.get(row['id']) if row is not None else None
+
+    def renew(self, job_id: str, attempt: int, lease_seconds: float) -> bool:
+        """
+        Extend the lease of a running job
+
+        Args:
+            job_id: ID of the job
+            attempt: Attempt of the job the caller runs, as returned by claim
+            lease_seconds: Seconds from now the lease lasts
+
+        Returns:
+            Whether the caller still runs the job, as it wasn't claimed again
+        """
+        cursor = self._connect().execute(
+            "UPDATE ai_jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+            (time.time() + lease_seconds, job_id, attempt)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self,
+               job_id: str,
+               attempt: int,
+               status: str,
+               result: Dict[str, Any],
+               media_asset_id: Optional[int] = None) -> bool:
+        """
+        Store the result of a job
+
+        Args:
+            job_id: ID of the job
+            attempt: Attempt of the job the caller ran, as returned by claim
+
+        Returns:
+            Whether the result was stored, which it isn't once the job was claimed again
+        """
+        cursor = self._connect().execute(
+            'UPDATE ai_jobs SET status = ?, result = ?, media_asset_id = ?, finished_at = ?, lease_expires_at = NULL '
+            "WHERE id = ? AND status = 'running' AND attempts = ?",
+            (status, json.dumps(result, ensure_ascii=False, default=str), media_asset_id, time.time(), job_id, attempt)
+        )
+        return cursor.rowcount == 1
+
+    def purge(self, older_than: float) -> int:
+        """Delete the jobs finished before a timestamp, returning their number"""
+        cursor = self._connect().execute(
+            "DELETE FROM ai_jobs WHERE status IN ('completed', 'failed') AND finished_at < ?",
+            (older_than,)
+        )
+        return cursor.rowcount
+
+
+class JobQueue:
+    """
+    Runs the jobs of a store with a pool of worker threads
+
+    Jobs are only run once the queue is started with the handlers of their
+    operations, so that scripts and tests using the services don't start workers.
+    """
+
+    def __init__(self,
+                 store: Optional[JobStore] = None,
+                 workers: int = AI_JOB_WORKERS,
+                 poll_interval: float = AI_JOB_POLL_SECONDS,
+                 lease_seconds: float = AI_JOB_LEASE_SECONDS,
+                 max_attempts: int = AI_JOB_MAX_ATTEMPTS):
+        """
+        Initialize the queue
+
+        Args:
+            store: Store of the jobs, the default database if not given
+            workers: Number of worker threads
+            poll_interval: Seconds idle workers wait before looking for jobs again
+            lease_seconds: Seconds without a renewal after which another worker runs a job again
+            max_attempts: Number of times a job is run before it is failed
+        """
+        self.store = store or JobStore()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.handlers = None
+        self.on_complete = None
+        self.condition = threading.Condition()
+        self.last_purge = 0.0
+
+    def start(self,
+              handlers: Dict[str, Callable[..., Dict[str, Any]]],
+              on_complete: Optional[Callable[[Dict[str, Any], Dict[str, Any]], Optional[int]]] = None) -> None:
+        """
+        Start the worker threads
+
+        Args:
+            handlers: Function running each operation with the params of a job,
+                and returning a service response
+            on_complete: Function called with a completed job and its response,
+                returning the ID of the media asset the result was saved to, if any
+        """
+        with self.condition:
+            if self.handlers is not None:
+                return
+            self.handlers = handlers
+            self.on_complete = on_complete
+
+        for index in range(self.workers):
+            threading.Thread(target=self._run, name=f"ai-job-{index}", daemon=True).start()
+
+    def submit(self,
+               operation: str,
+               params: Dict[str, Any],
+               lane: str,
+               user_id: Optional[int] = None,
+               organization_id: Optional[Any] = None,
+               subscription_plan: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a job and wake a worker, returning the job"""
+        job = self.store.create(operation, params, lane, user_id, organization_id, subscription_plan)
+        with self.condition:
+            self.condition.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job, or None if it doesn't exist"""
+        return self.store.get(job_id)
+
+    def run_next(self) -> bool:
+        """Claim and run a job, returning whether there was one"""
+        job = self.store.claim(self.lease_seconds, self.max_attempts)
+        if job is None:
+            return False
+
+        # Renew the lease while the job runs, so that it isn't claimed again
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, stop), name='ai-job-lease', daemon=True).start()
+        try:
+            handler = self.handlers.get(job['operation'])
+            with request_scope(job['lane'], job['organization_id'], job['subscription_plan'], job['user_id']):
+                try:
+                    if handler is None:
+                        raise ValueError(f"Unknown operation: {job['operation']}")
+                    result = handler(**job['params'])
+                except Exception as e:
+                    logger.error(f"Error running job {job['id']}: {str(e)}")
+                    result = {'success': False, 'error': type(e).__name__, 'message': str(e)}
+
+            # A job claimed again in the meantime is saved by its new run
+            media_asset_id = None
+            if result.get('success') and self.on_complete is not None \
+                    and self.store.renew(job['id'], job['attempts'], self.lease_seconds):
+                try:
+                    media_asset_id = self.on_complete(job, result)
+                except Exception as e:
+                    # The result is still returned to the client
+                    logger.error(f"Error saving the result of job {job['id']}: {str(e)}")
+
+            status = 'completed' if result.get('success') else 'failed'
+            if not self.store.finish(job['id'], job['attempts'], status, result, media_asset_id):
+                logger.warning(f"Discarded the result of job {job['id']}, which was claimed again")
+        finally:
+            stop.set()
+        return True
+
+    def _heartbeat(self, job: Dict[str, Any], stop: threading.Event) -> None:
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.store.renew(job['id'], job['attempts'], self.lease_seconds):
+                    return
+            except Exception as e:
+                # Retried at the next beat, before the lease expires
+                logger.error(f"Error renewing the lease of job {job['id']}: {str(e)}")
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.run_next():
+                    continue
+                if time.time() - self.last_purge > self.lease_seconds:
+                    self.last_purge = time.time()
+                    self.store.purge(time.time() - AI_JOB_RETENTION_SECONDS)
+            except Exception as e:
+                logger.error(f"Error in job worker: {str(e)}")
+            with self.condition:
+                self.condition.wait(self.poll_interval)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Get the job queue shared by the routes of the process"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
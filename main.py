@@ -3,7 +3,8 @@ import sys
 # DON'T CHANGE THIS LINE
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, send_from_directory, abort, Response
+from werkzeug.security import safe_join
 from flask_cors import CORS
 from src.models.base import db
 from src.routes.user import user_bp
@@ -12,8 +13,11 @@ from src.routes.organization import organization_bp
 from src.routes.social_account import social_account_bp
 from src.routes.post import post_bp
 from src.routes.ai_assistant import ai_assistant_bp
-from src.models import User, Organization, OrganizationMember, SocialAccount, ContentLibrary, MediaAsset, ContentTemplate, Post, PostSchedule, Interaction, AutoResponse, AIPrompt, Analytics, Report
+from src.models import User, Organization, OrganizationMember, SocialAccount, ContentLibrary, MediaAsset, ContentTemplate, Post, PostSchedule, Interaction, AutoResponse, AIPrompt, Analytics, Report, Conversation, ConversationMessage, BrandVoiceProfile, AIUsageEntry, IdempotencyRecord
 import os
+import re
+import mimetypes
+from urllib.parse import quote
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -33,6 +37,14 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///com
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key')
 
+# Uploads are streamed by the front proxy instead of a worker when set to
+# 'x-accel' (nginx) or 'x-sendfile' (Apache, lighttpd). For nginx, the internal
+# location of UPLOADS_ACCEL_PREFIX must alias the uploads volume:
+#     location /protected-uploads/ { internal; alias /var/www/uploads/; }
+app.config['UPLOADS_OFFLOAD'] = os.getenv('UPLOADS_OFFLOAD', '')
+app.config['UPLOADS_ACCEL_PREFIX'] = os.getenv('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+app.config['USE_X_SENDFILE'] = app.config['UPLOADS_OFFLOAD'] == 'x-sendfile'
+
 # Initialize database
 db.init_app(app)
 
@@ -44,10 +56,37 @@ app.register_blueprint(social_account_bp)
 app.register_blueprint(post_bp)
 app.register_blueprint(ai_assistant_bp)
 
+# Files named by the hash of their content never change
+CONTENT_HASHED_FILE = re.compile(r'(?:.*/)?([0-9a-f]{64})\.\w+')
+
 # Serve uploaded files
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(uploads_dir, filename)
+    path = safe_join(uploads_dir, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    
+    content_hashed = CONTENT_HASHED_FILE.fullmatch(filename)
+    if app.config['UPLOADS_OFFLOAD'] == 'x-accel':
+        # nginx streams the file, and handles conditional and range requests itself
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = app.config['UPLOADS_ACCEL_PREFIX'] + quote(filename)
+    else:
+        # Conditional and range requests are answered from the ETag and Last-Modified of the file.
+        # The ETag of a content-hashed file is its hash, as its modification time is its last use
+        response = send_from_directory(
+            uploads_dir,
+            filename,
+            etag=content_hashed.group(1) if content_hashed else True,
+            conditional=True
+        )
+    
+    if content_hashed:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # Other uploads can be replaced, so clients revalidate them with their ETag
+        response.headers['Cache-Control'] = 'public, no-cache'
+    return response
 
 # Root route
 @app.route('/')
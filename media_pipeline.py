@@ -0,0 +1,224 @@
+"""
+Media Pipeline
+
+This module processes the images of media assets in the background: it
+generates WebP thumbnails in several sizes, and extracts the dimensions, EXIF
+tags, dominant colours and perceptual hash of each image, in a pool of worker
+processes. Results are handed back to a save function, which writes them to
+the asset.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from urllib.parse import urlparse, unquote
+from PIL import Image, ImageOps, ExifTags
+from .config import (
+    MEDIA_PIPELINE_WORKERS,
+    MEDIA_THUMBNAIL_SIZES,
+    MEDIA_THUMBNAIL_URL_SIZE,
+    MEDIA_THUMBNAIL_QUALITY,
+    MEDIA_DOMINANT_COLORS
+)
+
+logger = logging.getLogger('ai_service')
+
+
+def _exif_value(value: Any) -> Any:
+    """Convert an EXIF value to JSON, or None for binary values"""
+    if isinstance(value, (str, int, float)):
+        return value.strip('\x00 ') if isinstance(value, str) else value
+    if isinstance(value, tuple):
+        values = [_exif_value(item) for item in value]
+        return None if None in values else values
+    try:
+        # Rationals
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_exif(image: Image.Image) -> Dict[str, Any]:
+    """Get the EXIF tags of an image by name, without binary values such as maker notes"""
+    exif = {}
+    for tag, value in image.getexif().items():
+        name = ExifTags.TAGS.get(tag)
+        value = _exif_value(value)
+        if name and value is not None:
+            exif[name] = value
+    return exif
+
+
+def dominant_colors(image: Image.Image, count: int = MEDIA_DOMINANT_COLORS) -> List[Dict[str, Any]]:
+    """Get the dominant colours of an image, as hex codes with their share of the image"""
+    thumbnail = image.convert('RGB')
+    thumbnail.thumbnail((64, 64))
+    palette_image = thumbnail.quantize(colors=count, method=Image.Quantize.MEDIANCUT)
+    palette = palette_image.getpalette()
+    pixels = thumbnail.width * thumbnail.height
+    return [
+        {
+            'color': '#{:02x}{:02x}{:02x}'.format(*palette[index * 3:index * 3 + 3]),
+            'share': round(occurrences / pixels, 3)
+        }
+        for occurrences, index in sorted(palette_image.getcolors(), reverse=True)
+    ]
+
+
+def perceptual_hash(image: Image.Image) -> str:
+    """
+    Compute the difference hash of an image
+
+    Visually similar images have hashes a few bits apart, whatever their size or encoding.
+    """
+    grid = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = grid.tobytes()  # one byte per pixel in L mode
+    bits = 0
+    for row in range(8):
+        for column in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return f"{bits:016x}"
+
+
+def process_image(source_path: str,
+                  thumbnail_dir: str,
+                  sizes: Tuple[int, ...] = MEDIA_THUMBNAIL_SIZES) -> Dict[str, Any]:
+    """
+    Generate the thumbnails and extract the metadata of an image, in a worker process
+
+    Thumbnails are named by the hash of their source, so that processing the
+    same image again reuses them.
+
+    Args:
+        source_path: Path of the image
+        thumbnail_dir: Directory of the thumbnails, with a subdirectory per size
+        sizes: Longest side of each thumbnail
+
+    Returns:
+        Dictionary with the 'width', 'height', 'format', 'exif', 'dominant_colors'
+        and 'perceptual_hash' of the image, and the path of each of its 'thumbnails' by size
+    """
+    with open(source_path, 'rb') as source_file:
+        source_hash = hashlib.sha256(source_file.read()).hexdigest()
+
+    with Image.open(source_path) as image:
+        image.load()
+        metadata = {'format': image.format, 'exif': extract_exif(image)}
+        # Everything else as the image is displayed, once rotated by its EXIF orientation
+        upright = ImageOps.exif_transpose(image)
+
+    metadata['width'], metadata['height'] = upright.size
+    metadata['dominant_colors'] = dominant_colors(upright)
+    metadata['perceptual_hash'] = perceptual_hash(upright)
+
+    thumbnails = {}
+    for size in sizes:
+        path = os.path.join(thumbnail_dir, str(size), f"{source_hash}.webp")
+        if not os.path.exists(path):
+            thumbnail = upright.convert('RGBA' if 'A' in upright.getbands() else 'RGB')
+            # Never upscaled, as it wouldn't add any detail
+            thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            thumbnail.save(temp_path, format='WEBP', quality=MEDIA_THUMBNAIL_QUALITY)
+            os.replace(temp_path, path)
+        thumbnails[size] = path
+    metadata['thumbnails'] = thumbnails
+    return metadata
+
+
+class MediaPipeline:
+    """
+    Processes the images of media assets stored in the uploads directory
+
+    Assets are only processed once the pipeline is started with a save
+    function, so that scripts and tests creating assets don't start workers.
+    """
+
+    def __init__(self,
+                 uploads_dir: str,
+                 workers: int = MEDIA_PIPELINE_WORKERS,
+                 sizes: Tuple[int, ...] = MEDIA_THUMBNAIL_SIZES):
+        """
+        Initialize the pipeline
+
+        Args:
+            uploads_dir: Directory served under /uploads, where thumbnails are written too
+            workers: Number of worker processes
+            sizes: Longest side of each thumbnail
+        """
+        self.uploads_dir = uploads_dir
+        self.thumbnail_dir = os.path.join(uploads_dir, 'thumbnails')
+        self.workers = workers
+        self.sizes = sizes
+        self.save = None
+        self.executor = None
+        # Results are saved off the thread collecting the results of the processes
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='media-writer')
+        self.lock = threading.Lock()
+
+    def start(self, save: Callable[[int, Dict[str, Any]], None]) -> None:
+        """
+        Start processing assets
+
+        Args:
+            save: Function writing the processing results of an asset, called
+                with its ID and the 'thumbnail_url' and 'metadata' to set
+        """
+        with self.lock:
+            if self.save is None:
+                self.save = save
+                # Spawned rather than forked, as forking while other threads hold locks can deadlock the workers
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def local_path(self, url: Optional[str]) -> Optional[str]:
+        """Get the path of an asset URL served from the uploads directory, or None for other URLs"""
+        path = unquote(urlparse(url or '').path)
+        if not path.startswith('/uploads/'):
+            return None
+        local_path = os.path.realpath(os.path.join(self.uploads_dir, path[len('/uploads/'):]))
+        if not local_path.startswith(os.path.realpath(self.uploads_dir) + os.sep):
+            return None
+        return local_path
+
+    def url_for(self, path: str) -> str:
+        """Get the /uploads URL of a file of the uploads directory"""
+        return f"/uploads/{os.path.relpath(path, self.uploads_dir).replace(os.sep, '/')}"
+
+    def submit(self, asset_id: int, url: str) -> Optional[Future]:
+        """
+        Process the image of an asset in the background
+
+        Returns:
+            The future of the processing, or None if the pipeline isn't started
+            or the image isn't in the uploads directory
+        """
+        source_path = self.local_path(url)
+        if self.save is None or source_path is None:
+            return None
+
+        future = self.executor.submit(process_image, source_path, self.thumbnail_dir, self.sizes)
+        future.add_done_callback(lambda done: self.writer.submit(self._save_result, asset_id, done))
+        return future
+
+    def _save_result(self, asset_id: int, future: Future) -> None:
+        try:
+            metadata = future.result()
+        except Exception as e:
+            logger.error(f"Error processing media asset {asset_id}: {str(e)}")
+            # The message may hold server paths, which are exposed with the asset
+            metadata = {'media_status': 'failed', 'media_error': type(e).__name__}
+            thumbnail_url = None
+        else:
+            metadata['thumbnails'] = {str(size): self.url_for(path) for size, path in metadata['thumbnails'].items()}
+            metadata['media_status'] = 'processed'
+            thumbnail_url = metadata['thumbnails'].get(str(MEDIA_THUMBNAIL_URL_SIZE))
+
+        try:
+            self.save(asset_id, {'thumbnail_url': thumbnail_url, 'metadata': metadata})
+        except Exception as e:
+            logger.error(f"Error saving the processing of media asset {asset_id}: {str(e)}")
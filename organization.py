@@ -19,6 +19,7 @@ class Organization(db.Model, BaseModel):
     posts = db.relationship('Post', back_populates='organization')
     auto_responses = db.relationship('AutoResponse', back_populates='organization')
     ai_prompts = db.relationship('AIPrompt', back_populates='organization')
+    brand_voice_profiles = db.relationship('BrandVoiceProfile', back_populates='organization')
     
     def __repr__(self):
         return f'<Organization {self.name}>'
@@ -0,0 +1,92 @@
+"""
+Outreach Campaign Store
+
+This module checkpoints bulk outreach campaigns on disk so that an interrupted
+campaign can be resumed without regenerating the messages already produced.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+from typing import Dict, Any, List, Optional
+from .config import OUTREACH_CAMPAIGN_DIR
+
+# Campaign IDs are used as file names
+CAMPAIGN_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def profile_fingerprint(target_profile: Dict[str, Any]) -> str:
+    """Compute a stable fingerprint of a target profile"""
+    serialized = json.dumps(target_profile, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:16]
+
+
+class OutreachCampaignStore:
+    """Stores campaign manifests and generated messages as append-only files"""
+
+    def __init__(self, storage_dir: str = OUTREACH_CAMPAIGN_DIR):
+        """
+        Initialize the campaign store
+
+        Args:
+            storage_dir: Directory where campaigns are checkpointed
+        """
+        self.storage_dir = storage_dir
+        self.lock = threading.Lock()
+
+        # Create storage directory if it doesn't exist
+        os.makedirs(self.storage_dir, exist_ok=True)
+
+    def _path(self, campaign_id: str, extension: str) -> str:
+        if not isinstance(campaign_id, str) or not CAMPAIGN_ID_PATTERN.fullmatch(campaign_id):
+            raise ValueError(f"Invalid campaign ID: {campaign_id}")
+        return os.path.join(self.storage_dir, f"{campaign_id}.{extension}")
+
+    def load_manifest(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """Load the manifest of a campaign, or None if it doesn't exist"""
+        path = self._path(campaign_id, 'json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def save_manifest(self, campaign_id: str, manifest: Dict[str, Any]) -> None:
+        """Atomically write the manifest of a campaign"""
+        path = self._path(campaign_id, 'json')
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def load_results(self, campaign_id: str) -> Dict[int, Dict[str, Any]]:
+        """
+        Load the messages already generated for a campaign
+
+        Returns:
+            Dictionary of target index to result ('target_index', 'fingerprint', 'message')
+        """
+        path = self._path(campaign_id, 'jsonl')
+        results = {}
+        if not os.path.exists(path):
+            return results
+        with open(path, 'r', encoding='utf-8') as results_file:
+            for line in results_file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A crash can leave a truncated last line behind
+                    continue
+                results[result['target_index']] = result
+        return results
+
+    def append_results(self, campaign_id: str, results: List[Dict[str, Any]]) -> None:
+        """Durably append generated messages to the checkpoint of a campaign"""
+        path = self._path(campaign_id, 'jsonl')
+        with self.lock:
+            with open(path, 'a', encoding='utf-8') as results_file:
+                for result in results:
+                    results_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                results_file.flush()
+                os.fsync(results_file.fileno())
@@ -0,0 +1,236 @@
+"""
+AI Providers
+
+This module provides the backends chat completion requests can be routed to:
+OpenAI itself, any OpenAI-compatible endpoint (such as a local model server),
+and a local rules engine for cheap, high-volume operations.
+"""
+
+import re
+import json
+import threading
+import unicodedata
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional
+from openai import OpenAI
+from .faq_index import tokenize
+from .config import (
+    OPENAI_API_KEY,
+    OPENAI_ORG_ID,
+    AI_PROVIDERS,
+    AI_OPERATION_ROUTES,
+    DEFAULT_AI_PROVIDER
+)
+
+
+def make_response(content: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> Any:
+    """Build a response shaped like an OpenAI chat completion"""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason='stop')],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            prompt_tokens_details=None
+        )
+    )
+
+
+class AIProvider:
+    """Base class for the backends serving chat completion requests"""
+
+    name = 'provider'
+    local = False  # whether requests are served in process, without any upstream capacity
+
+    def supports(self, operation: str) -> bool:
+        """Whether the provider can serve an operation"""
+        return True
+
+    def create_chat_completion(self, operation: str, context: Dict[str, Any], **kwargs) -> Any:
+        """
+        Serve a chat completion request
+
+        Args:
+            operation: Name of the service operation making the request
+            context: The structured inputs of the operation, for providers that don't use the prompt
+            **kwargs: Parameters of the chat completion request
+
+        Returns:
+            A response shaped like an OpenAI chat completion
+        """
+        raise NotImplementedError
+
+
+class OpenAIProvider(AIProvider):
+    """Sends requests to the OpenAI API, or any OpenAI-compatible endpoint"""
+
+    name = 'openai'
+
+    def __init__(self,
+                 client: Optional[OpenAI] = None,
+                 base_url: Optional[str] = None,
+                 api_key: Optional[str] = None,
+                 organization: Optional[str] = None,
+                 model: Optional[str] = None,
+                 supports_json_schema: bool = True,
+                 name: Optional[str] = None):
+        """
+        Initialize the provider
+
+        Args:
+            client: An existing OpenAI client, created from the other arguments if not provided
+            base_url: URL of an OpenAI-compatible endpoint
+            api_key: API key of the endpoint
+            organization: OpenAI organization ID
+            model: Model served by the endpoint, replacing the model of every request
+            supports_json_schema: Whether the endpoint supports json_schema response formats
+            name: Name of the provider in the metrics
+        """
+        self.client = client or OpenAI(
+            api_key=api_key or 'not-needed',
+            organization=organization or None,
+            base_url=base_url
+        )
+        self.model = model
+        self.supports_json_schema = supports_json_schema
+        if name:
+            self.name = name
+
+    def create_chat_completion(self, operation: str, context: Dict[str, Any], **kwargs) -> Any:
+        if self.model:
+            kwargs['model'] = self.model
+        # Endpoints without structured outputs still get valid JSON, checked by the schema afterwards
+        response_format = kwargs.get('response_format')
+        if response_format and response_format.get('type') == 'json_schema' and not self.supports_json_schema:
+            kwargs['response_format'] = {'type': 'json_object'}
+        return self.client.chat.completions.create(**kwargs)
+
+
+# Sentiment lexicon of the rules engine: word stem to (polarity, emotion)
+SENTIMENT_LEXICON = {
+    'super': (1, 'joie'), 'genial': (1, 'joie'), 'top': (1, 'joie'), 'bravo': (1, 'joie'),
+    'merci': (1, 'gratitude'), 'adore': (1, 'joie'), 'aime': (1, 'joie'), 'parfait': (1, 'joie'),
+    'excellent': (1, 'joie'), 'magnifique': (1, 'joie'), 'beau': (1, 'joie'), 'ravi': (1, 'joie'),
+    'content': (1, 'joie'), 'incroyable': (1, 'surprise'), 'wow': (1, 'surprise'),
+    'love': (1, 'joie'), 'great': (1, 'joie'), 'amazing': (1, 'surprise'), 'thanks': (1, 'gratitude'),
+    'nul': (-1, 'colère'), 'mauvais': (-1, 'colère'), 'decu': (-1, 'tristesse'), 'decevant': (-1, 'tristesse'),
+    'retard': (-1, 'colère'), 'arnaque': (-1, 'colère'), 'honte': (-1, 'colère'), 'horrible': (-1, 'dégoût'),
+    'probleme': (-1, 'frustration'), 'panne': (-1, 'frustration'), 'rembourse': (-1, 'frustration'),
+    'triste': (-1, 'tristesse'), 'inadmissible': (-1, 'colère'),
+    'bad': (-1, 'colère'), 'worst': (-1, 'colère'), 'terrible': (-1, 'dégoût'), 'disappointed': (-1, 'tristesse')
+}
+POSITIVE_EMOJIS = set('😍🥰😊😀😃😄😁🙂👍👏🎉❤💯🔥✨')
+NEGATIVE_EMOJIS = set('😡😠🤬😞😢😭👎💔😤🙁')
+NEGATIONS = {'pas', 'jamais', 'not', 'never', 'aucun'}
+# Endings of the inflections of a lexicon stem, so that stems don't match longer words ("beau" in "beaucoup")
+LEXICON_ENDINGS = {'', 's', 'x', 'e', 'es', 'le', 'les', 'r', 'ment', 'ments', 'd', 'ly'}
+# Words whose polarity a negation doesn't flip ("pas terrible" is negative in French)
+NEGATION_PROOF = {'terrible'}
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+class RulesProvider(AIProvider):
+    """Answers cheap operations locally with rules, without any network round trip"""
+
+    name = 'rules'
+    local = True
+
+    def __init__(self):
+        """Initialize the rules engine"""
+        self.handlers = {
+            'analyze_sentiment': self._analyze_sentiment,
+            'extract_keywords': self._extract_keywords,
+            'generate_hashtags': self._generate_hashtags
+        }
+
+    def supports(self, operation: str) -> bool:
+        return operation in self.handlers
+
+    def create_chat_completion(self, operation: str, context: Dict[str, Any], **kwargs) -> Any:
+        if operation not in self.handlers:
+            raise ValueError(f"The rules provider doesn't support {operation}")
+        return make_response(self.handlers[operation](**context))
+
+    def _analyze_sentiment(self, text: str, **kwargs) -> str:
+        words = re.findall(r'\w+', _strip_accents(text.lower()))
+        polarity = 0
+        hits = 0
+        emotions = {}
+        for index, word in enumerate(words):
+            for stem, (value, emotion) in SENTIMENT_LEXICON.items():
+                if word.startswith(stem) and word[len(stem):] in LEXICON_ENDINGS:
+                    hits += 1
+                    # A preceding negation flips the polarity ("pas génial")
+                    if index and words[index - 1] in NEGATIONS and stem not in NEGATION_PROOF:
+                        polarity -= value
+                    else:
+                        polarity += value
+                        emotions[emotion] = emotions.get(emotion, 0) + 1
+                    break
+        for char in text:
+            if char in POSITIVE_EMOJIS or char in NEGATIVE_EMOJIS:
+                polarity += 1 if char in POSITIVE_EMOJIS else -1
+                hits += 1
+
+        score = polarity / hits if hits else 0.0
+        sentiment = 'positif' if score > 0.2 else 'négatif' if score < -0.2 else 'neutre'
+        return json.dumps({
+            'sentiment': sentiment,
+            'score': round(score, 2),
+            'émotions': sorted(emotions, key=emotions.get, reverse=True)[:3],
+            'confiance': round(min(0.9, 0.3 + 0.1 * hits), 2)
+        }, ensure_ascii=False)
+
+    def _extract_keywords(self, text: str, count: int = 10, **kwargs) -> str:
+        frequencies = {}
+        for token in tokenize(text):
+            if len(token) > 3 and not token.isdigit():
+                frequencies[token] = frequencies.get(token, 0) + 1
+        top = sorted(frequencies.items(), key=lambda item: item[1], reverse=True)[:count]
+        highest = top[0][1] if top else 1
+        return json.dumps({
+            'keywords': [{'keyword': token, 'score': round(freq / highest, 2)} for token, freq in top]
+        }, ensure_ascii=False)
+
+    def _generate_hashtags(self, topic: str, count: int = 10, **kwargs) -> str:
+        words = [word for word in tokenize(_strip_accents(topic)) if len(word) > 2]
+        hashtags = [''.join(word.capitalize() for word in words)] if len(words) > 1 else []
+        hashtags += [word.capitalize() for word in words]
+        return ' '.join(f"#{tag}" for tag in list(dict.fromkeys(hashtags))[:count])
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name: str) -> AIProvider:
+    """
+    Get a configured provider, shared by every service
+
+    Args:
+        name: Name of the provider in AI_PROVIDERS
+
+    Returns:
+        The provider
+    """
+    with _providers_lock:
+        if name not in _providers:
+            settings = dict(AI_PROVIDERS.get(name) or {})
+            provider_type = settings.pop('type', None)
+            if provider_type == 'rules':
+                _providers[name] = RulesProvider()
+            elif provider_type == 'openai':
+                _providers[name] = OpenAIProvider(api_key=OPENAI_API_KEY, organization=OPENAI_ORG_ID)
+            elif provider_type == 'openai_compatible':
+                _providers[name] = OpenAIProvider(name=name, **settings)
+            else:
+                raise ValueError(f"Unknown AI provider: {name}")
+        return _providers[name]
+
+
+def route_operation(operation: str) -> str:
+    """Get the name of the provider an operation is routed to"""
+    return AI_OPERATION_ROUTES.get(operation, AI_OPERATION_ROUTES.get('default', DEFAULT_AI_PROVIDER))
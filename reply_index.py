@@ -0,0 +1,229 @@
+"""
+Reply Index
+
+This module provides a per-organization similarity index over approved comment
+replies, so that replies to near-duplicate comments can be reused.
+"""
+
+import re
+import math
+import uuid
+import zlib
+import unicodedata
+from typing import Dict, Any, List, Optional
+from .index_store import OrganizationIndexStore
+from .config import (
+    REPLY_INDEX_DIR,
+    REPLY_HASH_BUCKETS
+)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase text, strip accents and punctuation, and squeeze repeated letters"""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'(\w)\1{2,}', r'\1', text)  # "loooove" -> "love"
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def hashed_vector(text: str, buckets: int = REPLY_HASH_BUCKETS) -> Dict[int, float]:
+    """
+    Project a text into a hashed vector space of word and character trigram features
+
+    Args:
+        text: The text to vectorize
+        buckets: Number of hash buckets of the vector space
+
+    Returns:
+        Sparse L2-normalized vector as a dictionary of bucket to weight
+    """
+    normalized = normalize_text(text)
+    features = normalized.split()
+    padded = f" {normalized} "
+    features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    vector = {}
+    for feature in features:
+        bucket = zlib.crc32(feature.encode('utf-8')) % buckets
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+
+    norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+    return {bucket: weight / norm for bucket, weight in vector.items()}
+
+
+def adapt_reply(reply: str,
+                original_author: Optional[str] = None,
+                author_name: Optional[str] = None,
+                max_length: Optional[int] = None) -> str:
+    """
+    Adapt a stored reply to a new comment
+
+    Args:
+        reply: The stored reply
+        original_author: Name of the author the stored reply was written for
+        author_name: Name of the author of the new comment
+        max_length: Maximum length of the reply in characters
+
+    Returns:
+        The adapted reply
+    """
+    if original_author and author_name:
+        reply = re.sub(rf'\b{re.escape(original_author)}\b', author_name, reply)
+    elif original_author:
+        # Drop the name of the original author, and the punctuation it leaves behind
+        reply = re.sub(rf'@?\b{re.escape(original_author)}\b,?', '', reply)
+        reply = re.sub(r' {2,}', ' ', reply).strip()
+        reply = re.sub(r' ([,.])', r'\1', reply)
+        reply = reply[:1].upper() + reply[1:]
+
+    if max_length and len(reply) > max_length:
+        reply = reply[:max_length].rsplit(' ', 1)[0].rstrip(',;:') + '…'
+
+    return reply
+
+
+class ReplyIndex:
+    """Similarity index over the approved comment replies of a single organization"""
+
+    def __init__(self):
+        """Initialize an empty reply index"""
+        self.entries = {}
+        self.vectors = {}
+        self.postings = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add_pair(self,
+                 comment: str,
+                 reply: str,
+                 response_type: str = "standard",
+                 author_name: Optional[str] = None,
+                 entry_id: Optional[str] = None) -> str:
+        """
+        Add an approved (comment, reply) pair to the index
+
+        Args:
+            comment: The comment that was answered
+            reply: The approved reply
+            response_type: Type of response the reply was written as
+            author_name: Name of the author of the comment
+            entry_id: Optional identifier, generated if not provided
+
+        Returns:
+            The identifier of the pair
+        """
+        entry_id = entry_id or uuid.uuid4().hex
+        if entry_id in self.entries:
+            self.remove_pair(entry_id)
+
+        vector = hashed_vector(comment)
+        self.entries[entry_id] = {
+            'id': entry_id,
+            'comment': comment,
+            'reply': reply,
+            'response_type': response_type,
+            'author_name': author_name
+        }
+        self.vectors[entry_id] = vector
+        for bucket in vector:
+            self.postings.setdefault(bucket, set()).add(entry_id)
+
+        return entry_id
+
+    def remove_pair(self, entry_id: str) -> bool:
+        """Remove a pair from the index"""
+        if entry_id not in self.entries:
+            return False
+
+        for bucket in self.vectors[entry_id]:
+            self.postings[bucket].discard(entry_id)
+            if not self.postings[bucket]:
+                del self.postings[bucket]
+
+        del self.entries[entry_id]
+        del self.vectors[entry_id]
+        return True
+
+    def find_similar(self, comment: str, response_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Find the stored pair whose comment is most similar to a new comment
+
+        Args:
+            comment: The new comment
+            response_type: Only consider pairs of this response type if provided
+
+        Returns:
+            The best pair with its cosine 'similarity', or None if no pair shares a feature
+        """
+        vector = hashed_vector(comment)
+
+        # Accumulate dot products over the pairs sharing at least one feature
+        scores = {}
+        for bucket, weight in vector.items():
+            for entry_id in self.postings.get(bucket, ()):
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight * self.vectors[entry_id][bucket]
+
+        best = None
+        for entry_id, score in scores.items():
+            entry = self.entries[entry_id]
+            if response_type and entry['response_type'] != response_type:
+                continue
+            if best is None or score > best['similarity']:
+                best = dict(entry)
+                best['similarity'] = min(1.0, score)
+
+        return best
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the index pairs"""
+        return {'entries': list(self.entries.values())}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ReplyIndex':
+        """Rebuild an index from serialized pairs"""
+        index = cls()
+        for entry in data.get('entries', []):
+            index.add_pair(
+                entry.get('comment', ''),
+                entry.get('reply', ''),
+                response_type=entry.get('response_type', 'standard'),
+                author_name=entry.get('author_name'),
+                entry_id=entry.get('id')
+            )
+        return index
+
+
+class ReplyIndexStore(OrganizationIndexStore):
+    """Stores one reply index per organization"""
+
+    index_class = ReplyIndex
+
+    def __init__(self, storage_dir: str = REPLY_INDEX_DIR):
+        """
+        Initialize the reply index store
+
+        Args:
+            storage_dir: Directory where the organization indexes are saved
+        """
+        super().__init__(storage_dir)
+
+    def add_pair(self, organization_id: Any, comment: str, reply: str, **kwargs) -> str:
+        """Add an approved (comment, reply) pair to the index of an organization"""
+        with self.lock:
+            entry_id = self.get_index(organization_id).add_pair(comment, reply, **kwargs)
+            self.save_index(organization_id)
+        return entry_id
+
+    def remove_pair(self, organization_id: Any, entry_id: str) -> bool:
+        """Remove a pair from the index of an organization"""
+        with self.lock:
+            removed = self.get_index(organization_id).remove_pair(entry_id)
+            if removed:
+                self.save_index(organization_id)
+        return removed
+
+    def find_similar(self, organization_id: Any, comment: str, response_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Find the most similar approved pair in the index of an organization"""
+        with self.lock:
+            return self.get_index(organization_id).find_similar(comment, response_type=response_type)
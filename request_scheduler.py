@@ -0,0 +1,249 @@
+"""
+Request Scheduler
+
+This module shares the upstream AI request capacity between priority lanes
+and, within a lane, between organizations with weighted fair queuing.
+"""
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterator
+from .config import (
+    MAX_REQUESTS_PER_MINUTE,
+    SCHEDULER_LANES,
+    SCHEDULER_DEFAULT_LANE,
+    SCHEDULER_MAX_WAIT_SECONDS,
+    PLAN_AI_QUOTAS,
+    DEFAULT_SUBSCRIPTION_PLAN
+)
+
+
+class SchedulerTimeoutError(Exception):
+    """Raised when a request waits longer than its lane allows for upstream capacity"""
+
+
+# Who a request is made for: its lane, and the organization and plan it counts against
+_request_scope = contextvars.ContextVar('ai_request_scope', default=None)
+
+
+def set_request_scope(lane: str = SCHEDULER_DEFAULT_LANE,
+                      organization_id: Optional[Any] = None,
+                      subscription_plan: Optional[str] = None,
+                      user_id: Optional[int] = None) -> contextvars.Token:
+    """
+    Set the lane, organization, plan and user of the AI requests made in the current context
+
+    Returns:
+        Token to restore the previous scope with reset_request_scope
+    """
+    return _request_scope.set({
+        'lane': lane,
+        'organization_id': organization_id,
+        'subscription_plan': subscription_plan or DEFAULT_SUBSCRIPTION_PLAN,
+        'user_id': user_id
+    })
+
+
+def reset_request_scope(token: contextvars.Token) -> None:
+    """Restore the request scope that was set before set_request_scope"""
+    _request_scope.reset(token)
+
+
+def get_request_scope() -> Dict[str, Any]:
+    """Get the lane, organization, plan and user of the AI requests made in the current context"""
+    return _request_scope.get() or {
+        'lane': SCHEDULER_DEFAULT_LANE,
+        'organization_id': None,
+        'subscription_plan': DEFAULT_SUBSCRIPTION_PLAN,
+        'user_id': None
+    }
+
+
+@contextmanager
+def request_scope(lane: str,
+                  organization_id: Optional[Any] = None,
+                  subscription_plan: Optional[str] = None,
+                  user_id: Optional[int] = None) -> Iterator[None]:
+    """Run a block of code with a request scope"""
+    token = set_request_scope(lane, organization_id, subscription_plan, user_id)
+    try:
+        yield
+    finally:
+        reset_request_scope(token)
+
+
+class RequestScheduler:
+    """
+    Grants upstream AI requests within the per-minute capacity
+
+    Waiting requests are served by lane priority first. Within a lane, each
+    organization gets a share of the capacity proportional to the weight of its
+    plan (weighted fair queuing on virtual finish times), and no more requests
+    per minute than its plan quota.
+    """
+
+    def __init__(self,
+                 requests_per_minute: int = MAX_REQUESTS_PER_MINUTE,
+                 lanes: List[str] = SCHEDULER_LANES,
+                 plan_quotas: Dict[str, Dict[str, Any]] = PLAN_AI_QUOTAS):
+        """
+        Initialize the scheduler
+
+        Args:
+            requests_per_minute: Upstream capacity shared by every lane
+            lanes: Lane names, from the highest priority to the lowest
+            plan_quotas: Fair queuing 'weight' and 'requests_per_minute' quota of each plan
+        """
+        self.requests_per_minute = requests_per_minute
+        self.lanes = list(lanes)
+        self.plan_quotas = plan_quotas
+        self.condition = threading.Condition()
+        self.granted = []  # grant times over the last minute
+        self.org_granted = {}  # organization to its grant times over the last minute
+        self.queues = {lane: [] for lane in self.lanes}
+        self.virtual_time = {lane: 0.0 for lane in self.lanes}
+        self.last_finish = {lane: {} for lane in self.lanes}
+        self.sequence = 0
+        self.stats = {lane: {'granted': 0, 'timed_out': 0, 'total_wait': 0.0, 'max_wait': 0.0} for lane in self.lanes}
+
+    def _quota(self, plan: str) -> Dict[str, Any]:
+        return self.plan_quotas.get(plan) or self.plan_quotas[DEFAULT_SUBSCRIPTION_PLAN]
+
+    def _prune(self, now: float) -> None:
+        self.granted = [granted_at for granted_at in self.granted if now - granted_at < 60]
+        for org_key in list(self.org_granted):
+            self.org_granted[org_key] = [granted_at for granted_at in self.org_granted[org_key] if now - granted_at < 60]
+            if not self.org_granted[org_key]:
+                del self.org_granted[org_key]
+
+    def _eligible(self, ticket: Dict[str, Any]) -> bool:
+        quota = self._quota(ticket['plan'])['requests_per_minute']
+        return len(self.org_granted.get(ticket['org_key'], ())) < quota
+
+    def _next_ticket(self) -> Optional[Dict[str, Any]]:
+        """The ticket to grant next: highest lane first, then smallest virtual finish time"""
+        for lane in self.lanes:
+            eligible = [ticket for ticket in self.queues[lane] if self._eligible(ticket)]
+            if eligible:
+                return min(eligible, key=lambda ticket: (ticket['finish'], ticket['sequence']))
+        return None
+
+    def _next_release(self, now: float) -> float:
+        """Seconds until a grant leaves the window and capacity may free up"""
+        oldest = [self.granted[0]] if self.granted else []
+        oldest += [grants[0] for grants in self.org_granted.values() if grants]
+        return max(0.01, min(60 - (now - granted_at) for granted_at in oldest)) if oldest else 1.0
+
+    def acquire(self,
+                lane: Optional[str] = None,
+                organization_id: Optional[Any] = None,
+                subscription_plan: Optional[str] = None,
+                timeout: Optional[float] = None) -> float:
+        """
+        Wait for the capacity to make an upstream request
+
+        Args:
+            lane: Priority lane of the request, from the request scope if not provided
+            organization_id: Organization the request counts against, from the request scope if not provided
+            subscription_plan: Plan of the organization, from the request scope if not provided
+            timeout: Maximum wait in seconds, from SCHEDULER_MAX_WAIT_SECONDS if not provided
+
+        Returns:
+            The time waited in seconds
+
+        Raises:
+            SchedulerTimeoutError: If no capacity was granted within the timeout
+        """
+        scope = get_request_scope()
+        lane = lane or scope['lane']
+        if lane not in self.queues:
+            lane = SCHEDULER_DEFAULT_LANE
+        if organization_id is None:
+            organization_id = scope['organization_id']
+        plan = subscription_plan or scope['subscription_plan']
+        timeout = SCHEDULER_MAX_WAIT_SECONDS.get(lane) if timeout is None else timeout
+
+        with self.condition:
+            start = time.time()
+            org_key = str(organization_id)
+            # Virtual finish time: an organization with twice the weight advances half as fast
+            weight = self._quota(plan)['weight']
+            finish = max(self.virtual_time[lane], self.last_finish[lane].get(org_key, 0.0)) + 1.0 / weight
+            self.last_finish[lane][org_key] = finish
+            self.sequence += 1
+            ticket = {'org_key': org_key, 'plan': plan, 'finish': finish, 'sequence': self.sequence, 'enqueued_at': start}
+            self.queues[lane].append(ticket)
+
+            try:
+                while True:
+                    now = time.time()
+                    self._prune(now)
+                    if len(self.granted) < self.requests_per_minute and self._next_ticket() is ticket:
+                        break
+                    if timeout is not None and now - start >= timeout:
+                        self.stats[lane]['timed_out'] += 1
+                        raise SchedulerTimeoutError(f"No AI capacity available for the {lane} lane within {timeout} seconds")
+                    wait = self._next_release(now)
+                    if timeout is not None:
+                        wait = min(wait, timeout - (now - start))
+                    self.condition.wait(max(wait, 0.01))
+            finally:
+                self.queues[lane].remove(ticket)
+                # Let the next waiter check whether it is its turn
+                self.condition.notify_all()
+
+            now = time.time()
+            self.granted.append(now)
+            self.org_granted.setdefault(org_key, []).append(now)
+            self.virtual_time[lane] = max(self.virtual_time[lane], ticket['finish'] - 1.0 / weight)
+
+            waited = now - start
+            stats = self.stats[lane]
+            stats['granted'] += 1
+            stats['total_wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+            return waited
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the queue depth and wait times of each lane
+
+        Returns:
+            Dictionary of lane to its queue depth, oldest wait of queued requests,
+            and granted, timed out, average and maximum wait of past requests
+        """
+        with self.condition:
+            now = time.time()
+            lanes = {}
+            for lane in self.lanes:
+                stats = self.stats[lane]
+                queue = self.queues[lane]
+                lanes[lane] = {
+                    'queue_depth': len(queue),
+                    'oldest_wait_seconds': max((now - ticket['enqueued_at'] for ticket in queue), default=0.0),
+                    'granted': stats['granted'],
+                    'timed_out': stats['timed_out'],
+                    'avg_wait_seconds': stats['total_wait'] / stats['granted'] if stats['granted'] else 0.0,
+                    'max_wait_seconds': stats['max_wait']
+                }
+            self._prune(now)
+            return {
+                'lanes': lanes,
+                'requests_last_minute': len(self.granted),
+                'requests_per_minute': self.requests_per_minute
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """Get the scheduler shared by every AI service of the process"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -4,44 +4,104 @@ Response Generator Service
 This module provides automated response generation capabilities using OpenAI's API.
 """
 
-from typing import Dict, Any, List, Optional, Union
+import json
+import time
+import uuid
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional, Union, Iterator
 from .base_service import BaseAIService
+from .faq_index import FAQIndex, FAQIndexStore
+from .reply_index import ReplyIndexStore, adapt_reply
+from .outreach_campaign import OutreachCampaignStore, profile_fingerprint
 from .config import (
     DEFAULT_TEXT_MODEL,
     DEFAULT_TEMPERATURE,
     DEFAULT_MAX_TOKENS,
-    REQUEST_TIMEOUT
+    REQUEST_TIMEOUT,
+    FAQ_INDEX_DIR,
+    FAQ_TOP_K,
+    FAQ_DIRECT_ANSWER_THRESHOLD,
+    REPLY_INDEX_DIR,
+    REPLY_REUSE_THRESHOLD,
+    OUTREACH_CAMPAIGN_DIR,
+    OUTREACH_TARGETS_PER_REQUEST,
+    OUTREACH_MAX_CONCURRENT_REQUESTS,
+    OUTREACH_MAX_TOKENS_PER_REQUEST
 )
 
 class ResponseGeneratorService(BaseAIService):
     """Service for generating automated responses using AI"""
     
-    def __init__(self):
-        """Initialize the response generator service"""
+    def __init__(self,
+                 faq_index_dir: str = FAQ_INDEX_DIR,
+                 reply_index_dir: str = REPLY_INDEX_DIR,
+                 campaign_dir: str = OUTREACH_CAMPAIGN_DIR):
+        """
+        Initialize the response generator service
+        
+        Args:
+            faq_index_dir: Directory where organization FAQ indexes are stored
+            reply_index_dir: Directory where organization approved reply indexes are stored
+            campaign_dir: Directory where outreach campaigns are checkpointed
+        """
         super().__init__()
+        self.faq_store = FAQIndexStore(storage_dir=faq_index_dir)
+        self.reply_store = ReplyIndexStore(storage_dir=reply_index_dir)
+        self.campaign_store = OutreachCampaignStore(storage_dir=campaign_dir)
+    
+    def _brand_voice_clause(self, brand_voice: Optional[str], brand_voice_prompt: Optional[str]) -> str:
+        """Describe the brand in the prompt, unless it is already described by the brand voice profile"""
+        if brand_voice_prompt:
+            return "pour la marque décrite dans tes instructions"
+        return f'pour une marque avec la voix suivante: "{brand_voice}"'
     
     def generate_comment_response(self,
                                  comment: str,
                                  post_content: str,
                                  brand_voice: str,
                                  response_type: str = "standard",
-                                 max_length: int = 200) -> Dict[str, Any]:
+                                 max_length: int = 200,
+                                 organization_id: Optional[int] = None,
+                                 author_name: Optional[str] = None,
+                                 force_generate: bool = False,
+                                 brand_voice_prompt: Optional[str] = None) -> Dict[str, Any]:
         """
         Generate a response to a comment on a post
         
+        When the organization has approved a reply to a near-duplicate comment,
+        that reply is adapted and returned instead of generating a new one.
+        
         Args:
             comment: The comment to respond to
             post_content: The content of the original post
             brand_voice: Description of the brand's voice and tone
             response_type: Type of response (e.g., "standard", "question", "promotional")
             max_length: Maximum length of the response in characters
+            organization_id: Organization whose approved replies can be reused
+            author_name: Name of the author of the comment
+            force_generate: Whether to always generate a fresh response
+            brand_voice_prompt: Compiled brand voice profile, used instead of brand_voice
             
         Returns:
             Dictionary containing the generated response or error information
         """
         try:
+            # Reuse an approved reply to a similar comment if there is one
+            similar = None
+            if organization_id is not None:
+                similar = self.reply_store.find_similar(organization_id, comment, response_type=response_type)
+                if similar and similar['similarity'] >= REPLY_REUSE_THRESHOLD and not force_generate:
+                    reply = adapt_reply(similar['reply'], similar['author_name'], author_name, max_length)
+                    self._log_response('generate_comment_response', f"Reused approved reply {similar['id']}")
+                    result = self._format_success_response(reply)
+                    result['reused'] = True
+                    result['similarity'] = similar['similarity']
+                    result['source_reply_id'] = similar['id']
+                    return result
+            
             # Check rate limits
-            self._rate_limit_check()
+            self._rate_limit_check('generate_comment_response')
             
             # Log the request
             self._log_request(
@@ -49,13 +109,16 @@ class ResponseGeneratorService(BaseAIService):
                 comment=comment,
                 post_content=post_content[:100] + "..." if len(post_content) > 100 else post_content,
                 brand_voice=brand_voice,
+                has_brand_voice_prompt=brand_voice_prompt is not None,
                 response_type=response_type,
-                max_length=max_length
+                max_length=max_length,
+                organization_id=organization_id,
+                force_generate=force_generate
             )
             
             # Create the prompt
             prompt = f"""
-            En tant que community manager pour une marque avec la voix suivante: "{brand_voice}",
+            En tant que community manager {self._brand_voice_clause(brand_voice, brand_voice_prompt)},
             génère une réponse à ce commentaire sur un post.
             
             Post original:
@@ -71,12 +134,14 @@ class ResponseGeneratorService(BaseAIService):
             """
             
             # Make the API request
-            response = self.client.chat.completions.create(
+            response = self._create_chat_completion(
+                'generate_comment_response',
                 model=DEFAULT_TEXT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Tu es un community manager professionnel qui répond aux commentaires sur les réseaux sociaux."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._build_messages(
+                    "Tu es un community manager professionnel qui répond aux commentaires sur les réseaux sociaux.",
+                    prompt,
+                    brand_voice_prompt=brand_voice_prompt
+                ),
                 temperature=DEFAULT_TEMPERATURE,
                 max_tokens=min(DEFAULT_MAX_TOKENS, max_length // 2),  # Estimate tokens based on characters
                 timeout=REQUEST_TIMEOUT
@@ -88,7 +153,10 @@ class ResponseGeneratorService(BaseAIService):
             # Log the response
             self._log_response('generate_comment_response', generated_response)
             
-            return self._format_success_response(generated_response)
+            result = self._format_success_response(generated_response)
+            result['reused'] = False
+            result['similarity'] = similar['similarity'] if similar else 0.0
+            return result
             
         except Exception as e:
             return self._handle_error(e)
@@ -98,27 +166,34 @@ class ResponseGeneratorService(BaseAIService):
                             conversation_history: List[Dict[str, str]],
                             brand_voice: str,
                             customer_info: Dict[str, Any] = None,
-                            max_length: int = 500) -> Dict[str, Any]:
+                            max_length: int = 500,
+                            conversation_summary: Optional[str] = None,
+                            brand_voice_prompt: Optional[str] = None) -> Dict[str, Any]:
         """
         Generate a response to a direct message
         
         Args:
             message: The message to respond to
             conversation_history: List of previous messages in the conversation
+                that are not covered by the summary
             brand_voice: Description of the brand's voice and tone
             customer_info: Optional information about the customer
             max_length: Maximum length of the response in characters
+            conversation_summary: Optional rolling summary of older messages
+            brand_voice_prompt: Compiled brand voice profile, used instead of brand_voice
             
         Returns:
             Dictionary containing the generated response or error information
         """
         try:
             # Check rate limits
-            self._rate_limit_check()
+            self._rate_limit_check('generate_dm_response')
             
             # Format conversation history
             formatted_history = ""
-            for msg in conversation_history[-5:]:  # Only use the last 5 messages
+            if conversation_summary:
+                formatted_history += f"Résumé des échanges précédents: {conversation_summary}\n"
+            for msg in conversation_history:
                 role = msg.get('role', 'unknown')
                 content = msg.get('content', '')
                 formatted_history += f"{role}: {content}\n"
@@ -135,14 +210,16 @@ class ResponseGeneratorService(BaseAIService):
                 'generate_dm_response',
                 message=message,
                 conversation_history_length=len(conversation_history),
+                has_conversation_summary=conversation_summary is not None,
                 brand_voice=brand_voice,
+                has_brand_voice_prompt=brand_voice_prompt is not None,
                 has_customer_info=customer_info is not None,
                 max_length=max_length
             )
             
             # Create the prompt
             prompt = f"""
-            En tant que community manager pour une marque avec la voix suivante: "{brand_voice}",
+            En tant que community manager {self._brand_voice_clause(brand_voice, brand_voice_prompt)},
             génère une réponse à ce message direct.
             
             {customer_context if customer_context else ""}
@@ -159,12 +236,14 @@ class ResponseGeneratorService(BaseAIService):
             """
             
             # Make the API request
-            response = self.client.chat.completions.create(
+            response = self._create_chat_completion(
+                'generate_dm_response',
                 model=DEFAULT_TEXT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Tu es un community manager professionnel qui répond aux messages directs sur les réseaux sociaux."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._build_messages(
+                    "Tu es un community manager professionnel qui répond aux messages directs sur les réseaux sociaux.",
+                    prompt,
+                    brand_voice_prompt=brand_voice_prompt
+                ),
                 temperature=DEFAULT_TEMPERATURE,
                 max_tokens=min(DEFAULT_MAX_TOKENS, max_length // 2),  # Estimate tokens based on characters
                 timeout=REQUEST_TIMEOUT
@@ -183,44 +262,72 @@ class ResponseGeneratorService(BaseAIService):
     
     def generate_faq_response(self,
                              question: str,
-                             faq_data: List[Dict[str, str]],
+                             faq_data: Optional[List[Dict[str, str]]],
                              brand_voice: str,
-                             max_length: int = 500) -> Dict[str, Any]:
+                             max_length: int = 500,
+                             organization_id: Optional[int] = None,
+                             top_k: int = FAQ_TOP_K,
+                             brand_voice_prompt: Optional[str] = None) -> Dict[str, Any]:
         """
         Generate a response to a frequently asked question
         
+        Only the FAQ entries most relevant to the question are passed to the model.
+        When the best entry matches closely enough, its stored answer is returned
+        directly without calling the model.
+        
         Args:
             question: The question to answer
-            faq_data: List of FAQ items with 'question' and 'answer' keys
+            faq_data: List of FAQ items with 'question' and 'answer' keys, used
+                when no organization index is available
             brand_voice: Description of the brand's voice and tone
             max_length: Maximum length of the response in characters
+            organization_id: Organization whose stored FAQ index should be searched
+            top_k: Maximum number of FAQ entries to include in the prompt
+            brand_voice_prompt: Compiled brand voice profile, used instead of brand_voice
             
         Returns:
             Dictionary containing the generated response or error information
         """
         try:
+            # Retrieve the relevant FAQ entries
+            if organization_id is not None:
+                matches = self.faq_store.search(organization_id, question, top_k=top_k)
+            else:
+                matches = FAQIndex.from_dict({'entries': faq_data or []}).search(question, top_k=top_k)
+            
+            # Return the stored answer when the match is close enough
+            if matches and matches[0]['match_score'] >= FAQ_DIRECT_ANSWER_THRESHOLD:
+                best_match = matches[0]
+                self._log_response('generate_faq_response', f"Direct answer from FAQ entry {best_match['id']}")
+                result = self._format_success_response(best_match['answer'])
+                result['direct_answer'] = True
+                result['match_score'] = best_match['match_score']
+                return result
+            
             # Check rate limits
-            self._rate_limit_check()
+            self._rate_limit_check('generate_faq_response')
             
             # Format FAQ data
             formatted_faq = ""
-            for item in faq_data:
-                q = item.get('question', '')
-                a = item.get('answer', '')
-                formatted_faq += f"Q: {q}\nR: {a}\n\n"
+            for item in matches:
+                formatted_faq += f"Q: {item['question']}\nR: {item['answer']}\n\n"
+            if not formatted_faq:
+                formatted_faq = "Aucune entrée de la FAQ ne correspond à cette question.\n"
             
             # Log the request
             self._log_request(
                 'generate_faq_response',
                 question=question,
-                faq_data_length=len(faq_data),
+                organization_id=organization_id,
+                faq_matches=len(matches),
                 brand_voice=brand_voice,
+                has_brand_voice_prompt=brand_voice_prompt is not None,
                 max_length=max_length
             )
             
             # Create the prompt
             prompt = f"""
-            En tant que community manager pour une marque avec la voix suivante: "{brand_voice}",
+            En tant que community manager {self._brand_voice_clause(brand_voice, brand_voice_prompt)},
             réponds à cette question en utilisant les informations de la FAQ ci-dessous.
             
             Question du client:
@@ -237,12 +344,14 @@ class ResponseGeneratorService(BaseAIService):
             """
             
             # Make the API request
-            response = self.client.chat.completions.create(
+            response = self._create_chat_completion(
+                'generate_faq_response',
                 model=DEFAULT_TEXT_MODEL,
-                messages=[
-                    {"role": "system", "content": "Tu es un community manager professionnel qui répond aux questions fréquemment posées."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._build_messages(
+                    "Tu es un community manager professionnel qui répond aux questions fréquemment posées.",
+                    prompt,
+                    brand_voice_prompt=brand_voice_prompt
+                ),
                 temperature=DEFAULT_TEMPERATURE,
                 max_tokens=min(DEFAULT_MAX_TOKENS, max_length // 2),  # Estimate tokens based on characters
                 timeout=REQUEST_TIMEOUT
@@ -254,7 +363,10 @@ class ResponseGeneratorService(BaseAIService):
             # Log the response
             self._log_response('generate_faq_response', generated_response)
             
-            return self._format_success_response(generated_response)
+            result = self._format_success_response(generated_response)
+            result['direct_answer'] = False
+            result['match_score'] = matches[0]['match_score'] if matches else 0.0
+            return result
             
         except Exception as e:
             return self._handle_error(e)
@@ -280,7 +392,7 @@ class ResponseGeneratorService(BaseAIService):
         """
         try:
             # Check rate limits
-            self._rate_limit_check()
+            self._rate_limit_check('generate_outreach_message')
             
             # Format target profile
             formatted_profile = ""
@@ -320,7 +432,8 @@ class ResponseGeneratorService(BaseAIService):
             """
             
             # Make the API request
-            response = self.client.chat.completions.create(
+            response = self._create_chat_completion(
+                'generate_outreach_message',
                 model=DEFAULT_TEXT_MODEL,
                 messages=[
                     {"role": "system", "content": "Tu es un community manager professionnel spécialisé dans la prospection et l'outreach."},
@@ -342,3 +455,193 @@ class ResponseGeneratorService(BaseAIService):
         except Exception as e:
             return self._handle_error(e)
 
+    
+    def generate_outreach_campaign(self,
+                                   campaign_info: Dict[str, Any],
+                                   target_profiles: List[Dict[str, Any]],
+                                   brand_voice: str,
+                                   platform: str,
+                                   max_length: int = 500,
+                                   campaign_id: Optional[str] = None,
+                                   targets_per_request: int = OUTREACH_TARGETS_PER_REQUEST,
+                                   max_concurrent_requests: int = OUTREACH_MAX_CONCURRENT_REQUESTS) -> Iterator[Dict[str, Any]]:
+        """
+        Generate personalized outreach messages for a whole campaign
+        
+        Targets are grouped into multi-target requests that share the same campaign
+        prefix, and groups run concurrently within the rate limit. Messages are
+        checkpointed as they arrive, so calling again with the same campaign ID
+        resumes the campaign instead of starting over.
+        
+        Args:
+            campaign_info: Information about the campaign, shared by all targets
+            target_profiles: Information about each target recipient
+            brand_voice: Description of the brand's voice and tone
+            platform: The platform for the outreach (e.g., "LinkedIn", "Email")
+            max_length: Maximum length of each message in characters
+            campaign_id: Identifier of the campaign to resume, generated if not provided
+            targets_per_request: Number of targets per request
+            max_concurrent_requests: Number of requests running at the same time
+            
+        Yields:
+            Progress events: 'started', then 'result' and 'error' events as groups
+            complete, each followed by a 'progress' event, and finally 'completed'
+        """
+        campaign_id = campaign_id or uuid.uuid4().hex
+        fingerprints = [profile_fingerprint(profile) for profile in target_profiles]
+        
+        # Skip the targets whose message was generated before an interruption
+        if self.campaign_store.load_manifest(campaign_id) is None:
+            self.campaign_store.save_manifest(campaign_id, {
+                'campaign_id': campaign_id,
+                'campaign_info': campaign_info,
+                'platform': platform,
+                'max_length': max_length,
+                'target_count': len(target_profiles),
+                'created_at': time.time()
+            })
+        done = {
+            index for index, result in self.campaign_store.load_results(campaign_id).items()
+            if index < len(fingerprints) and result.get('fingerprint') == fingerprints[index]
+        }
+        pending = [index for index in range(len(target_profiles)) if index not in done]
+        groups = [pending[i:i + targets_per_request] for i in range(0, len(pending), targets_per_request)]
+        
+        self._log_request(
+            'generate_outreach_campaign',
+            campaign_id=campaign_id,
+            campaign_info=campaign_info,
+            brand_voice=brand_voice,
+            platform=platform,
+            target_count=len(target_profiles),
+            resumed_count=len(done),
+            request_count=len(groups)
+        )
+        
+        completed = len(done)
+        failed = 0
+        yield {'type': 'started', 'campaign_id': campaign_id, 'total': len(target_profiles), 'completed': completed}
+        
+        # The shared prefix is identical for every group so the provider can cache it
+        system_prompt = self._build_outreach_campaign_prefix(campaign_info, brand_voice, platform, max_length)
+        
+        with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self._generate_outreach_group, system_prompt, target_profiles, group, max_length
+                ): group
+                for group in groups
+            }
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    messages = future.result()
+                except Exception as e:
+                    messages = {}
+                    error = self._handle_error(e)
+                else:
+                    error = {'error': 'Invalid Response', 'message': 'No message generated for this target'}
+                
+                results = [
+                    {'target_index': index, 'fingerprint': fingerprints[index], 'message': messages[index]}
+                    for index in group if messages.get(index)
+                ]
+                self.campaign_store.append_results(campaign_id, results)
+                completed += len(results)
+                
+                for result in results:
+                    yield {'type': 'result', 'target_index': result['target_index'], 'message': result['message']}
+                
+                missing = [index for index in group if not messages.get(index)]
+                if missing:
+                    failed += len(missing)
+                    yield {'type': 'error', 'target_indexes': missing, 'error': error['error'], 'message': error['message']}
+                
+                yield {'type': 'progress', 'campaign_id': campaign_id, 'completed': completed, 'total': len(target_profiles)}
+        
+        self._log_response('generate_outreach_campaign', f"Campaign {campaign_id}: {completed} generated, {failed} failed")
+        
+        yield {'type': 'completed', 'campaign_id': campaign_id, 'completed': completed, 'failed': failed, 'total': len(target_profiles)}
+    
+    def get_outreach_campaign_results(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the messages generated so far for a campaign
+        
+        Args:
+            campaign_id: Identifier of the campaign
+            
+        Returns:
+            Dictionary with the campaign manifest and its messages, or None if the campaign doesn't exist
+        """
+        manifest = self.campaign_store.load_manifest(campaign_id)
+        if manifest is None:
+            return None
+        results = self.campaign_store.load_results(campaign_id)
+        manifest['messages'] = [
+            {'target_index': index, 'message': results[index]['message']}
+            for index in sorted(results)
+        ]
+        return manifest
+    
+    def _build_outreach_campaign_prefix(self,
+                                        campaign_info: Dict[str, Any],
+                                        brand_voice: str,
+                                        platform: str,
+                                        max_length: int) -> str:
+        """Build the system prompt shared by every request of a campaign"""
+        formatted_campaign = ""
+        for key, value in campaign_info.items():
+            formatted_campaign += f"- {key}: {value}\n"
+        
+        return f"""
+        Tu es un community manager professionnel spécialisé dans la prospection et l'outreach,
+        pour une marque avec la voix suivante: "{brand_voice}".
+        
+        Tu génères des messages de prospection personnalisés pour la plateforme {platform}.
+        
+        Informations sur la campagne:
+        {formatted_campaign}
+        
+        Longueur maximale de chaque message: {max_length} caractères
+        
+        Chaque message doit être personnalisé, non-intrusif, et refléter la voix de la marque.
+        Il doit établir une connexion authentique et inclure un appel à l'action clair.
+        
+        Pour chaque cible reçue, réponds uniquement avec un JSON de la forme:
+        {{"messages": [{{"id": <id de la cible>, "message": "<message personnalisé>"}}]}}
+        """
+    
+    def _generate_outreach_group(self,
+                                 system_prompt: str,
+                                 target_profiles: List[Dict[str, Any]],
+                                 group: List[int],
+                                 max_length: int) -> Dict[int, str]:
+        """Generate the messages of a group of targets in a single request"""
+        # Check rate limits
+        self._rate_limit_check('generate_outreach_campaign')
+        
+        targets = [{'id': index, 'profil': target_profiles[index]} for index in group]
+        
+        # Make the API request
+        response = self._create_chat_completion(
+            'generate_outreach_campaign',
+            model=DEFAULT_TEXT_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": json.dumps({'cibles': targets}, ensure_ascii=False, default=str)}
+            ],
+            temperature=DEFAULT_TEMPERATURE,
+            max_tokens=min(OUTREACH_MAX_TOKENS_PER_REQUEST, len(group) * (max_length // 2 + 20)),
+            response_format={"type": "json_object"},
+            timeout=REQUEST_TIMEOUT
+        )
+        
+        # Keep only the messages of the targets that were requested
+        content = json.loads(response.choices[0].message.content)
+        messages = {}
+        for item in content.get('messages', []):
+            if item.get('id') in group and isinstance(item.get('message'), str):
+                messages[item['id']] = item['message'][:max_length]
+        
+        return messages
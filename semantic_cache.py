@@ -0,0 +1,211 @@
+"""
+Semantic Cache
+
+This module provides a second-tier response cache that serves the response of
+a near-duplicate request: texts are normalized and projected into hashed
+n-gram vectors, and a cached response is reused above a similarity threshold.
+"""
+
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional
+from .reply_index import normalize_text, hashed_vector
+from .config import (
+    CACHE_EXPIRATION,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_AUDIT_LOG_SIZE
+)
+
+
+def _flatten_text(data: Any) -> str:
+    """Join the string values of a response, without the keys of its dictionaries"""
+    if isinstance(data, str):
+        return data
+    if isinstance(data, dict):
+        return ' '.join(_flatten_text(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return ' '.join(_flatten_text(item) for item in data)
+    return ''
+
+
+def response_similarity(first: Any, second: Any) -> float:
+    """Cosine similarity between the texts of two responses"""
+    first_vector = hashed_vector(_flatten_text(first))
+    second_vector = hashed_vector(_flatten_text(second))
+    return min(1.0, sum(weight * second_vector.get(bucket, 0.0) for bucket, weight in first_vector.items()))
+
+
+class SemanticCache:
+    """
+    Near-duplicate response cache
+
+    Entries are grouped in namespaces of an operation, its exact parameters
+    (platform, count...) and the numbers of its text, and only the rest of the
+    free text of the request is compared: numbers barely move the vector of a
+    text, but a request with other figures needs another response.
+    Entries are keyed by a digest of their namespace and normalized text.
+    """
+
+    def __init__(self,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 expiration: float = CACHE_EXPIRATION):
+        """
+        Initialize the cache
+
+        Args:
+            threshold: Cosine similarity above which a cached response is served
+            max_entries: Number of entries above which the oldest are evicted
+            expiration: Seconds an entry can be served
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.expiration = expiration
+        self.entries = OrderedDict()  # digest to entry, oldest first
+        self.postings = {}  # namespace to bucket to digests
+        self.stats = {}
+        self.audits = deque(maxlen=SEMANTIC_CACHE_AUDIT_LOG_SIZE)
+        self.lock = threading.Lock()
+
+    def _namespace(self, operation: str, params: Dict[str, Any], text: str) -> str:
+        # Read from the raw text, as normalizing squeezes repeated digits
+        numbers = re.findall(r'\d+(?:[.,]\d+)*', text or '')
+        return hashlib.sha256(json.dumps([operation, sorted(params.items()), numbers], default=str).encode('utf-8')).hexdigest()[:16]
+
+    def _digest(self, namespace: str, normalized: str) -> str:
+        return hashlib.sha256(f"{namespace}:{normalized}".encode('utf-8')).hexdigest()[:32]
+
+    def _operation_stats(self, operation: str) -> Dict[str, int]:
+        return self.stats.setdefault(operation, {
+            'lookups': 0,
+            'exact_hits': 0,
+            'near_hits': 0,
+            'audits': 0,
+            'false_hits': 0
+        })
+
+    def _remove(self, digest: str) -> None:
+        entry = self.entries.pop(digest)
+        postings = self.postings[entry['namespace']]
+        for bucket in entry['vector']:
+            postings[bucket].discard(digest)
+            if not postings[bucket]:
+                del postings[bucket]
+
+    def lookup(self, operation: str, text: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Find the cached response of the most similar request
+
+        Args:
+            operation: Name of the operation
+            text: Free text of the request
+            params: Other parameters of the request, which must match exactly,
+                like the numbers of the text
+
+        Returns:
+            Dictionary with the cached 'data', the 'similarity' and the 'digest'
+            of the entry, or None if no entry is similar enough
+        """
+        namespace = self._namespace(operation, params, text)
+        normalized = normalize_text(text)
+        now = time.time()
+
+        with self.lock:
+            stats = self._operation_stats(operation)
+            stats['lookups'] += 1
+
+            digest = self._digest(namespace, normalized)
+            entry = self.entries.get(digest)
+            similarity = 1.0
+            if entry is None:
+                vector = hashed_vector(text)
+                postings = self.postings.get(namespace, {})
+                scores = {}
+                for bucket, weight in vector.items():
+                    for candidate in postings.get(bucket, ()):
+                        scores[candidate] = scores.get(candidate, 0.0) + weight * self.entries[candidate]['vector'][bucket]
+                candidates = [
+                    (score, candidate) for candidate, score in scores.items()
+                    if score >= self.threshold and now - self.entries[candidate]['timestamp'] < self.expiration
+                ]
+                if not candidates:
+                    return None
+                similarity, digest = max(candidates)
+                entry = self.entries[digest]
+            elif now - entry['timestamp'] >= self.expiration:
+                self._remove(digest)
+                return None
+
+            stats['exact_hits' if entry['text'] == normalized else 'near_hits'] += 1
+            return {'data': entry['data'], 'similarity': min(1.0, similarity), 'digest': digest, 'text': entry['text']}
+
+    def store(self, operation: str, text: str, params: Dict[str, Any], data: Any) -> str:
+        """Cache the response of a request, returning the digest of its entry"""
+        namespace = self._namespace(operation, params, text)
+        normalized = normalize_text(text)
+        digest = self._digest(namespace, normalized)
+        vector = hashed_vector(text)
+
+        with self.lock:
+            if digest in self.entries:
+                self._remove(digest)
+            self.entries[digest] = {
+                'namespace': namespace,
+                'text': normalized,
+                'vector': vector,
+                'data': data,
+                'timestamp': time.time()
+            }
+            postings = self.postings.setdefault(namespace, {})
+            for bucket in vector:
+                postings.setdefault(bucket, set()).add(digest)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+        return digest
+
+    def record_audit(self, operation: str, text: str, hit: Dict[str, Any], agreement: float, false_hit: bool) -> None:
+        """Record the comparison of a near-duplicate hit with the response recomputed for its request"""
+        with self.lock:
+            stats = self._operation_stats(operation)
+            stats['audits'] += 1
+            if false_hit:
+                stats['false_hits'] += 1
+            self.audits.append({
+                'operation': operation,
+                'text': normalize_text(text)[:100],
+                'cached_text': hit['text'][:100],
+                'similarity': round(hit['similarity'], 3),
+                'agreement': round(agreement, 3),
+                'false_hit': false_hit,
+                'timestamp': time.time()
+            })
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get the hit rate and audits of each operation
+
+        Returns:
+            Dictionary with the number of 'entries', the stats of each operation
+            with its 'hit_rate' and 'false_hit_rate', and the latest 'audits'
+        """
+        with self.lock:
+            operations = {}
+            for operation, stats in self.stats.items():
+                hits = stats['exact_hits'] + stats['near_hits']
+                operations[operation] = dict(
+                    stats,
+                    hit_rate=hits / stats['lookups'] if stats['lookups'] else 0.0,
+                    false_hit_rate=stats['false_hits'] / stats['audits'] if stats['audits'] else 0.0
+                )
+            return {
+                'entries': len(self.entries),
+                'operations': operations,
+                'audits': list(self.audits)
+            }
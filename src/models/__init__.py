@@ -7,9 +7,15 @@ from .content import ContentTemplate, Post, PostSchedule
 from .interaction import Interaction
 from .automation import AutoResponse, AIPrompt
 from .analytics import Analytics, Report
+from .conversation import Conversation, ConversationMessage
+from .brand_voice import BrandVoiceProfile
+from .ai_usage import AIUsageEntry
+from .idempotency import IdempotencyRecord
 
 __all__ = [
     'db', 'BaseModel', 'User', 'Organization', 'OrganizationMember',
     'SocialAccount', 'ContentLibrary', 'MediaAsset', 'ContentTemplate', 'Post',
-    'PostSchedule', 'Interaction', 'AutoResponse', 'AIPrompt', 'Analytics', 'Report'
+    'PostSchedule', 'Interaction', 'AutoResponse', 'AIPrompt', 'Analytics', 'Report',
+    'Conversation', 'ConversationMessage', 'BrandVoiceProfile', 'AIUsageEntry',
+    'IdempotencyRecord'
 ]
@@ -0,0 +1,3 @@
+from ai_usage import AIUsageEntry
+
+__all__ = ['AIUsageEntry']
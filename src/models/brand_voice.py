@@ -0,0 +1,3 @@
+from brand_voice import BrandVoiceProfile
+
+__all__ = ['BrandVoiceProfile']
@@ -0,0 +1,3 @@
+from conversation import Conversation, ConversationMessage
+
+__all__ = ['Conversation', 'ConversationMessage']
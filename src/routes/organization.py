@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request
 from .auth import token_required
-from src.models import db, Organization, OrganizationMember
+from src.models import db, Organization, OrganizationMember, BrandVoiceProfile
 
 organization_bp = Blueprint('organization', __name__, url_prefix='/api/organizations')
 
@@ -10,6 +10,18 @@ def is_org_member(user_id: int, org_id: int) -> bool:
     return member is not None
 
 
+def _brand_voice_error(data: dict, partial: bool = False):
+    """Check the fields of a brand voice sent by a client, returning an error message or None"""
+    for field in ('name', 'description'):
+        if (field in data or not partial) and (not isinstance(data.get(field), str) or not data[field].strip()):
+            return f'{field} must be a non-empty string'
+    guidelines = data.get('guidelines', {})
+    if not isinstance(guidelines, dict) \
+            or not all(isinstance(guidelines.get(key) or [], list) for key in ('do', 'dont', 'examples')):
+        return 'guidelines must be an object with do, dont and examples lists'
+    return None
+
+
 @organization_bp.route('', methods=['POST'])
 @token_required
 def create_organization(current_user_id):
@@ -34,4 +46,65 @@ def get_organizations(current_user_id):
     orgs = Organization.query.filter_by(owner_id=current_user_id).all()
     return jsonify({'success': True, 'organizations': [o.to_dict() for o in orgs]}), 200
 
+
+
+@organization_bp.route('/<int:org_id>/brand-voices', methods=['POST'])
+@token_required
+def create_brand_voice(current_user_id, org_id):
+    if not is_org_member(current_user_id, org_id):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    data = request.get_json() or {}
+    if not data.get('name') or not data.get('description'):
+        return jsonify({'success': False, 'message': 'Missing name or description'}), 400
+    error = _brand_voice_error(data)
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+    profile = BrandVoiceProfile(
+        organization_id=org_id,
+        name=data['name'],
+        description=data['description'],
+        tone=data.get('tone')
+    )
+    profile.guidelines = data.get('guidelines', {})
+    profile.compile()
+    db.session.add(profile)
+    db.session.commit()
+    return jsonify({'success': True, 'brand_voice': profile.to_dict()}), 201
+
+
+@organization_bp.route('/<int:org_id>/brand-voices', methods=['GET'])
+@token_required
+def get_brand_voices(current_user_id, org_id):
+    if not is_org_member(current_user_id, org_id):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    profiles = BrandVoiceProfile.query.filter_by(organization_id=org_id).all()
+    return jsonify({'success': True, 'brand_voices': [p.to_dict() for p in profiles]}), 200
+
+
+@organization_bp.route('/<int:org_id>/brand-voices/<int:profile_id>', methods=['PUT'])
+@token_required
+def update_brand_voice(current_user_id, org_id, profile_id):
+    if not is_org_member(current_user_id, org_id):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    profile = BrandVoiceProfile.query.filter_by(id=profile_id, organization_id=org_id).first()
+    if not profile:
+        return jsonify({'success': False, 'message': 'Brand voice not found'}), 404
+    data = request.get_json() or {}
+    error = _brand_voice_error(data, partial=True)
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+    changed = False
+    for field in ('name', 'description', 'tone'):
+        if field in data and data[field] != getattr(profile, field):
+            setattr(profile, field, data[field])
+            changed = True
+    if 'guidelines' in data and data['guidelines'] != profile.guidelines:
+        profile.guidelines = data['guidelines']
+        changed = True
+    # Recompile only when the profile changes, so the prompt prefix stays stable between edits
+    if changed or not profile.compiled_prompt:
+        profile.compile()
+    db.session.commit()
+    return jsonify({'success': True, 'brand_voice': profile.to_dict()}), 200
+
 __all__ = ['organization_bp', 'is_org_member']
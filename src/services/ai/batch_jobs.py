@@ -0,0 +1,3 @@
+from batch_jobs import BatchJobStore, OpenAIBatchBackend, LocalBatchBackend, TERMINAL_STATUSES
+
+__all__ = ['BatchJobStore', 'OpenAIBatchBackend', 'LocalBatchBackend', 'TERMINAL_STATUSES']
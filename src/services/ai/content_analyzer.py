@@ -1,3 +1,3 @@
-from content_analyzer import ContentAnalyzerService
+from content_analyzer import ContentAnalyzerService, merge_sentiments, merge_keywords, SENTIMENT_SCHEMA, KEYWORDS_SCHEMA, ENGAGEMENT_SCHEMA
 
-__all__ = ['ContentAnalyzerService']
+__all__ = ['ContentAnalyzerService', 'merge_sentiments', 'merge_keywords', 'SENTIMENT_SCHEMA', 'KEYWORDS_SCHEMA', 'ENGAGEMENT_SCHEMA']
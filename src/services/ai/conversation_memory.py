@@ -0,0 +1,3 @@
+from conversation_memory import ConversationMemoryService, estimate_tokens
+
+__all__ = ['ConversationMemoryService', 'estimate_tokens']
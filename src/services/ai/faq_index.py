@@ -0,0 +1,3 @@
+from faq_index import FAQIndex, FAQIndexStore, tokenize
+
+__all__ = ['FAQIndex', 'FAQIndexStore', 'tokenize']
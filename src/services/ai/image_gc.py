@@ -0,0 +1,3 @@
+from image_gc import ImageIndex, ImageGarbageCollector, referenced_image_names
+
+__all__ = ['ImageIndex', 'ImageGarbageCollector', 'referenced_image_names']
@@ -0,0 +1,3 @@
+from image_storage import ContentAddressedImageStore
+
+__all__ = ['ContentAddressedImageStore']
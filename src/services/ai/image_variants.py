@@ -0,0 +1,3 @@
+from image_variants import CROP_MODES, crop_box, render_variant, render_variants
+
+__all__ = ['CROP_MODES', 'crop_box', 'render_variant', 'render_variants']
@@ -0,0 +1,3 @@
+from index_store import OrganizationIndexStore
+
+__all__ = ['OrganizationIndexStore']
@@ -0,0 +1,3 @@
+from job_queue import JobStore, JobQueue, TERMINAL_STATUSES, get_job_queue
+
+__all__ = ['JobStore', 'JobQueue', 'TERMINAL_STATUSES', 'get_job_queue']
@@ -0,0 +1,3 @@
+from media_pipeline import MediaPipeline, process_image, perceptual_hash, dominant_colors, extract_exif
+
+__all__ = ['MediaPipeline', 'process_image', 'perceptual_hash', 'dominant_colors', 'extract_exif']
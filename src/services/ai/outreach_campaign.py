@@ -0,0 +1,3 @@
+from outreach_campaign import CAMPAIGN_ID_PATTERN, OutreachCampaignStore, profile_fingerprint
+
+__all__ = ['CAMPAIGN_ID_PATTERN', 'OutreachCampaignStore', 'profile_fingerprint']
@@ -0,0 +1,3 @@
+from providers import AIProvider, OpenAIProvider, RulesProvider, get_provider, route_operation, make_response
+
+__all__ = ['AIProvider', 'OpenAIProvider', 'RulesProvider', 'get_provider', 'route_operation', 'make_response']
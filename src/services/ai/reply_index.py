@@ -0,0 +1,3 @@
+from reply_index import ReplyIndex, ReplyIndexStore, adapt_reply, hashed_vector, normalize_text
+
+__all__ = ['ReplyIndex', 'ReplyIndexStore', 'adapt_reply', 'hashed_vector', 'normalize_text']
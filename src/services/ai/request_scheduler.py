@@ -0,0 +1,3 @@
+from request_scheduler import RequestScheduler, SchedulerTimeoutError, get_scheduler, set_request_scope, reset_request_scope, get_request_scope, request_scope
+
+__all__ = ['RequestScheduler', 'SchedulerTimeoutError', 'get_scheduler', 'set_request_scope', 'reset_request_scope', 'get_request_scope', 'request_scope']
@@ -0,0 +1,3 @@
+from semantic_cache import SemanticCache, response_similarity
+
+__all__ = ['SemanticCache', 'response_similarity']
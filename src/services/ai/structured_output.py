@@ -0,0 +1,3 @@
+from structured_output import StructuredSchema, StructuredOutputError, compile_schema
+
+__all__ = ['StructuredSchema', 'StructuredOutputError', 'compile_schema']
@@ -0,0 +1,3 @@
+from text_chunking import split_sentences, chunk_text
+
+__all__ = ['split_sentences', 'chunk_text']
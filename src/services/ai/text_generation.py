@@ -1,3 +1,3 @@
-from text_generation import TextGenerationService
+from text_generation import TextGenerationService, build_template_slots
 
-__all__ = ['TextGenerationService']
+__all__ = ['TextGenerationService', 'build_template_slots']
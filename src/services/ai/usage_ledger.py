@@ -0,0 +1,3 @@
+from usage_ledger import UsageLedger, get_usage_ledger, usage_cost
+
+__all__ = ['UsageLedger', 'get_usage_ledger', 'usage_cost']
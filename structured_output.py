@@ -0,0 +1,145 @@
+"""
+Structured Output
+
+This module compiles JSON schemas into fast validators for the structured
+responses returned by the AI services.
+"""
+
+import json
+from typing import Dict, Any, Callable
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a model response doesn't match its expected schema"""
+
+
+_TYPE_CHECKS = {
+    'object': lambda value: isinstance(value, dict),
+    'array': lambda value: isinstance(value, list),
+    'string': lambda value: isinstance(value, str),
+    'number': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'integer': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'boolean': lambda value: isinstance(value, bool),
+    'null': lambda value: value is None
+}
+
+
+def compile_schema(schema: Dict[str, Any]) -> Callable[[Any, str], None]:
+    """
+    Compile a JSON schema into a validator
+
+    Supports the subset of JSON schema used by the provider's strict structured
+    outputs: type (or list of types), properties, required, additionalProperties,
+    items, enum, minimum and maximum.
+
+    Args:
+        schema: The JSON schema to compile
+
+    Returns:
+        Function taking a value and its path, raising StructuredOutputError if invalid
+    """
+    checks = []
+
+    types = schema.get('type')
+    if types:
+        type_names = types if isinstance(types, list) else [types]
+        type_checks = [_TYPE_CHECKS[type_name] for type_name in type_names]
+
+        def check_type(value, path):
+            if not any(type_check(value) for type_check in type_checks):
+                raise StructuredOutputError(f"{path}: expected {' or '.join(type_names)}")
+        checks.append(check_type)
+
+    if 'enum' in schema:
+        allowed = schema['enum']
+
+        def check_enum(value, path):
+            if value not in allowed:
+                raise StructuredOutputError(f"{path}: {value!r} is not one of {allowed}")
+        checks.append(check_enum)
+
+    if 'minimum' in schema or 'maximum' in schema:
+        minimum = schema.get('minimum', float('-inf'))
+        maximum = schema.get('maximum', float('inf'))
+
+        def check_range(value, path):
+            if isinstance(value, (int, float)) and not minimum <= value <= maximum:
+                raise StructuredOutputError(f"{path}: {value} is not between {minimum} and {maximum}")
+        checks.append(check_range)
+
+    if 'properties' in schema:
+        properties = {name: compile_schema(prop) for name, prop in schema['properties'].items()}
+        required = schema.get('required', [])
+        allow_extra = schema.get('additionalProperties', True) is not False
+
+        def check_properties(value, path):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    raise StructuredOutputError(f"{path}: missing property '{name}'")
+            for name, item in value.items():
+                if name in properties:
+                    properties[name](item, f"{path}.{name}")
+                elif not allow_extra:
+                    raise StructuredOutputError(f"{path}: unexpected property '{name}'")
+        checks.append(check_properties)
+
+    if 'items' in schema:
+        validate_item = compile_schema(schema['items'])
+
+        def check_items(value, path):
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    validate_item(item, f"{path}[{index}]")
+        checks.append(check_items)
+
+    def validate(value, path='$'):
+        for check in checks:
+            check(value, path)
+
+    return validate
+
+
+class StructuredSchema:
+    """A named JSON schema compiled once and reused for every response"""
+
+    def __init__(self, name: str, schema: Dict[str, Any]):
+        """
+        Initialize and compile a structured output schema
+
+        Args:
+            name: Name of the schema, sent to the provider
+            schema: The JSON schema
+        """
+        self.name = name
+        self.schema = schema
+        self.validate = compile_schema(schema)
+
+    @property
+    def response_format(self) -> Dict[str, Any]:
+        """The response_format parameter requesting this schema from the provider"""
+        return {
+            'type': 'json_schema',
+            'json_schema': {'name': self.name, 'strict': True, 'schema': self.schema}
+        }
+
+    def parse(self, content: str) -> Any:
+        """
+        Parse and validate a model response
+
+        Args:
+            content: The raw response content
+
+        Returns:
+            The parsed value
+
+        Raises:
+            StructuredOutputError: If the content is not valid JSON or doesn't match the schema
+        """
+        try:
+            value = json.loads(content)
+        except (TypeError, ValueError) as e:
+            raise StructuredOutputError(f"Invalid JSON: {str(e)}")
+        self.validate(value)
+        return value
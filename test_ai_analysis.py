@@ -0,0 +1,352 @@
+"""
+Tests for the AI service helpers: chunked analysis, providers, scheduling, caches and images
+"""
+
+import io
+import os
+import json
+import time
+import base64
+import threading
+import pytest
+from src.services.ai.text_chunking import chunk_text
+from src.services.ai.content_analyzer import ContentAnalyzerService, merge_sentiments, merge_keywords, SENTIMENT_SCHEMA
+from src.services.ai.providers import RulesProvider
+from src.services.ai.batch_jobs import BatchJobStore, LocalBatchBackend
+from src.services.ai.request_scheduler import RequestScheduler, SchedulerTimeoutError, get_scheduler, request_scope
+from src.services.ai.usage_ledger import UsageLedger, usage_cost
+from src.services.ai.text_generation import TextGenerationService
+from src.services.ai.semantic_cache import SemanticCache
+from src.services.ai.image_storage import ContentAddressedImageStore
+from src.services.ai.image_generation import ImageGenerationService
+from src.services.ai.job_queue import JobStore, JobQueue
+from src.services.ai.image_gc import ImageIndex, ImageGarbageCollector, referenced_image_names
+from src.services.ai.media_pipeline import process_image, perceptual_hash
+from src.services.ai.image_variants import crop_box, render_variant
+
+def test_chunk_text_on_sentence_boundaries():
+    """Test that chunks hold whole sentences within the token budget"""
+    text = " ".join(f"Ceci est la phrase numéro {i}." for i in range(200))
+
+    chunks = chunk_text(text, max_tokens=100)
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith('.') for chunk in chunks)
+    assert all(len(chunk) // 4 + 4 <= 100 for chunk in chunks)
+    assert " ".join(chunks) == text
+
+def test_merge_sentiments():
+    """Test that chunk sentiments are weighted by length and confidence"""
+    analyses = [
+        {'sentiment': 'positif', 'score': 0.8, 'émotions': ['Joie'], 'confiance': 0.9},
+        {'sentiment': 'négatif', 'score': -0.6, 'émotions': ['colère', 'joie'], 'confiance': 0.5}
+    ]
+
+    merged = merge_sentiments(analyses, [300, 100])
+
+    assert merged['sentiment'] == 'positif'
+    assert merged['score'] == pytest.approx((0.8 * 270 - 0.6 * 50) / 320)
+    assert merged['émotions'][0] == 'Joie'
+
+def test_merge_keywords():
+    """Test that keywords found across chunks rank first"""
+    extractions = [
+        [{'keyword': 'Vélo', 'score': 0.6}, {'keyword': 'montagne', 'score': 0.9}],
+        [{'keyword': 'vélo', 'score': 0.7}, {'keyword': 'ville', 'score': 0.8}]
+    ]
+
+    merged = merge_keywords(extractions, [100, 100], count=2)
+
+    assert [item['keyword'] for item in merged] == ['Vélo', 'montagne']
+    assert merged[0]['score'] == pytest.approx(0.65)
+
+def test_rules_provider():
+    """Test that the rules engine answers cheap operations locally"""
+    provider = RulesProvider()
+
+    response = provider.create_chat_completion('analyze_sentiment', {'text': "Livraison en retard, c'est nul 😡"})
+    analysis = SENTIMENT_SCHEMA.parse(response.choices[0].message.content)
+
+    assert analysis['sentiment'] == 'négatif'
+
+    # "pas terrible" is negative, and stems only match their inflections
+    for text in ("Franchement pas terrible ce produit", "Beaucoup trop de retard sur ma commande"):
+        response = provider.create_chat_completion('analyze_sentiment', {'text': text})
+        analysis = SENTIMENT_SCHEMA.parse(response.choices[0].message.content)
+        assert analysis['sentiment'] == 'négatif'
+        assert 'joie' not in analysis['émotions']
+    response = provider.create_chat_completion('analyze_sentiment', {'text': "Badge perdu au supermarché"})
+    assert SENTIMENT_SCHEMA.parse(response.choices[0].message.content)['sentiment'] == 'neutre'
+    assert provider.supports('generate_hashtags')
+    assert not provider.supports('optimize_content')
+
+def test_local_provider_skips_scheduler(monkeypatch):
+    """Test that operations routed to the rules engine don't wait for upstream capacity"""
+    service = ContentAnalyzerService()
+    monkeypatch.setattr(service, '_get_provider', lambda operation: RulesProvider())
+    scheduler = get_scheduler()
+    granted = scheduler.get_stats()['lanes']['batch']['granted']
+
+    with request_scope('batch', organization_id=1):
+        result = service.analyze_sentiment("Livraison en retard, c'est nul")
+
+    assert result['data']['sentiment'] == 'négatif'
+    assert scheduler.get_stats()['lanes']['batch']['granted'] == granted
+
+def test_local_batch_backend(tmp_path):
+    """Test that the local stand-in runs batch requests in the provider output format"""
+    store = BatchJobStore(str(tmp_path))
+    store.create_job(
+        'job_1',
+        {'operation': 'analyze_sentiment', 'endpoint': '/v1/chat/completions'},
+        [{'custom_id': 'c1', 'method': 'POST', 'url': '/v1/chat/completions', 'body': {}}],
+        {'c1': {'text': "J'adore 😍"}}
+    )
+    provider = RulesProvider()
+    backend = LocalBatchBackend(lambda operation, endpoint, body, context: provider.create_chat_completion(operation, context, **body))
+
+    status = backend.retrieve(store, 'job_1', store.load_manifest('job_1'))
+
+    assert status['status'] == 'completed'
+    body = status['output'][0]['response']['body']
+    assert SENTIMENT_SCHEMA.parse(body['choices'][0]['message']['content'])['sentiment'] == 'positif'
+
+def test_scheduler_plan_quota():
+    """Test that an organization over its plan quota waits while others are served"""
+    scheduler = RequestScheduler(requests_per_minute=10, plan_quotas={'free': {'weight': 1, 'requests_per_minute': 2}})
+
+    with request_scope('interactive', organization_id=1, subscription_plan='free'):
+        scheduler.acquire()
+        scheduler.acquire()
+        with pytest.raises(SchedulerTimeoutError):
+            scheduler.acquire(timeout=0.1)
+
+    assert scheduler.acquire('interactive', organization_id=2, subscription_plan='free') < 0.1
+    stats = scheduler.get_stats()
+    assert stats['lanes']['interactive']['granted'] == 3
+    assert stats['lanes']['interactive']['timed_out'] == 1
+
+def test_usage_ledger_replays_journal(tmp_path):
+    """Test that the journaled entries of a crashed process are flushed with the new ones"""
+    entry = {'entry_id': 'e1', 'organization_id': 1, 'user_id': 2, 'operation': 'generate_text', 'cost': 0.5}
+    # Journal of a process that is no longer running, with a line torn by the crash
+    (tmp_path / '99999999.journal').write_text(json.dumps(entry) + '\n{"entry_id": "e2', encoding='utf-8')
+    written = []
+    ledger = UsageLedger(journal_dir=str(tmp_path), flush_interval=3600)
+    
+    ledger.start(written.extend)
+    ledger.record('extract_keywords', 'gpt-4o-mini-2024-07-18', 'openai', 1000, 0, 100, user_id=2)
+    
+    assert ledger.flush() == 2
+    assert [item['entry_id'] for item in written][0] == 'e1'
+    assert written[1]['cost'] == pytest.approx(usage_cost('gpt-4o-mini', 1000, 0, 100))
+    assert [path.name for path in tmp_path.iterdir()] == [f"{os.getpid()}.journal"]
+
+def test_usage_ledger_dead_letters_rejected_entries(tmp_path):
+    """Test that an entry the writer always rejects is moved aside instead of blocking the ledger"""
+    written = []
+    
+    def writer(entries):
+        if any(entry['user_id'] == 404 for entry in entries):
+            raise ValueError('user 404 does not exist')
+        written.extend(entries)
+    
+    ledger = UsageLedger(journal_dir=str(tmp_path), flush_interval=3600)
+    ledger.start(writer)
+    ledger.record('generate_text', 'gpt-4o', 'openai', 10, 0, 10, user_id=404)
+    ledger.record('generate_text', 'gpt-4o', 'openai', 10, 0, 10, user_id=2)
+    
+    assert ledger.flush() == 1
+    assert [entry['user_id'] for entry in written] == [2]
+    dead_letters = (tmp_path / 'dead_letter.jsonl').read_text(encoding='utf-8').splitlines()
+    assert [json.loads(line)['user_id'] for line in dead_letters] == [404]
+    assert ledger.flush() == 0
+    
+    # While the writer fails for every entry, entries stay buffered
+    ledger.writer = lambda entries: 1 / 0
+    ledger.record('generate_text', 'gpt-4o', 'openai', 10, 0, 10, user_id=3)
+    assert ledger.flush() == 0
+    assert len(ledger.buffer) == 1
+    
+    # And are written once it recovers, rather than at exit
+    ledger.writer = writer
+    assert ledger.flush() == 1
+
+def test_stale_response_served_on_error():
+    """Test that an expired cached response is served, flagged, when the upstream request fails"""
+    service = TextGenerationService()
+    service._save_to_cache('key', 'cached text')
+    service.cache['key']['timestamp'] -= 7 * 3600
+    
+    def outage():
+        raise ConnectionError('upstream down')
+    
+    assert service._get_cached('key', outage) == ('cached text', True)
+    assert service._format_success_response('cached text', stale=True)['stale'] is True
+    with pytest.raises(ConnectionError):
+        service._get_cached('other key', outage)
+
+def test_semantic_cache_near_duplicates():
+    """Test that near-duplicate texts share a cached response, but only with the same parameters"""
+    cache = SemanticCache(threshold=0.85)
+    digest = cache.store('generate_hashtags', "Summer sale for our shop", {'count': 5}, ['#SummerSale'])
+    
+    exact = cache.lookup('generate_hashtags', "summer sale for our shop!", {'count': 5})
+    near = cache.lookup('generate_hashtags', "summer sales for our shop", {'count': 5})
+    
+    assert len(digest) == 32
+    assert exact['similarity'] == 1.0 and exact['data'] == ['#SummerSale']
+    assert 0.85 <= near['similarity'] < 1.0
+    assert cache.lookup('generate_hashtags', "winter collection launch", {'count': 5}) is None
+    assert cache.lookup('generate_hashtags', "Summer sale for our shop", {'count': 10}) is None
+    stats = cache.get_stats()['operations']['generate_hashtags']
+    assert (stats['exact_hits'], stats['near_hits'], stats['lookups']) == (1, 1, 4)
+
+def test_semantic_cache_numbers_match_exactly():
+    """Test that near-duplicate texts with other numbers don't share a cached response"""
+    cache = SemanticCache(threshold=0.85)
+    cache.store('generate_hashtags', "Black Friday sale: 10% off everything", {}, ['#10PercentOff'])
+    
+    assert cache.lookup('generate_hashtags', "Black Friday sale: 50% off everything", {}) is None
+    assert cache.lookup('generate_hashtags', "Black Friday sale: 1000% off everything", {}) is None
+    assert cache.lookup('generate_hashtags', "Black Friday sales: 10% off everything", {})['data'] == ['#10PercentOff']
+
+def test_image_store_deduplicates_content(tmp_path):
+    """Test that identical images are written once, under their content hash"""
+    store = ContentAddressedImageStore(str(tmp_path))
+    image_b64 = base64.b64encode(b'image bytes').decode()
+    
+    first = store.save_b64(image_b64)
+    second = store.save_b64(image_b64)
+    store.wait(first['content_hash'])
+    
+    assert first == second
+    assert open(first['path'], 'rb').read() == b'image bytes'
+    assert [path.name for path in tmp_path.rglob('*') if path.is_file()] == [f"{first['content_hash']}.png"]
+
+def test_image_variants_cropped_around_salient_region(tmp_path):
+    """Test that platform variants keep the detailed region of the master, without upscaling"""
+    from PIL import Image, ImageDraw
+    master = Image.new('RGB', (1024, 1024), 'white')
+    draw = ImageDraw.Draw(master)
+    for x in range(60, 260, 10):
+        draw.rectangle([x, 300, x + 4, 700], fill='black')
+    master_path = str(tmp_path / 'master.png')
+    master.save(master_path)
+    
+    left, top, right, bottom = crop_box(master, 1024, 1792)
+    assert (top, bottom) == (0, 1024) and right - left == 585
+    assert left < 60 and right > 260
+    assert crop_box(master, 1024, 1792, mode='center')[0] == 219
+    
+    variant = render_variant(master_path, 1792, 1024)
+    assert (variant['width'], variant['height']) == (1024, 585)
+    assert Image.open(io.BytesIO(base64.b64decode(variant['image_b64']))).size == (1024, 585)
+
+def test_image_preview_then_finalize(tmp_path, monkeypatch):
+    """Test that previews use the cheap model and size, and that finalizing twice generates once"""
+    from types import SimpleNamespace
+    service = ImageGenerationService(upload_dir=str(tmp_path))
+    calls = []
+    
+    def generate(**kwargs):
+        calls.append((kwargs['model'], kwargs['size']))
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=base64.b64encode(kwargs['model'].encode()).decode())])
+    
+    monkeypatch.setattr(service, 'client', SimpleNamespace(images=SimpleNamespace(generate=generate)))
+    preview = service.generate_image_preview("A lighthouse at dawn")
+    final = service.finalize_image("A lighthouse at dawn")
+    service.finalize_image("A lighthouse at dawn")
+    
+    assert preview['data']['preview'] is True
+    assert 'preview' not in final['data']
+    assert calls == [('dall-e-2', '256x256'), ('dall-e-3', '1024x1024')]
+
+def test_job_queue_runs_and_recovers_jobs(tmp_path):
+    """Test that jobs run in the scope of their owner, and that abandoned jobs are run again"""
+    from src.services.ai.request_scheduler import get_request_scope
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    queue = JobQueue(store=store, lease_seconds=0.05, max_attempts=2)
+    queue.handlers = {'shout': lambda text: {'success': True, 'data': (text.upper(), get_request_scope()['organization_id'])}}
+    queue.on_complete = lambda job, result: 7
+    
+    job = queue.submit('shout', {'text': 'hello'}, 'generation', user_id=1, organization_id=4)
+    assert queue.run_next() and not queue.run_next()
+    done = queue.get(job['id'])
+    assert (done['status'], done['result']['data'], done['media_asset_id']) == ('completed', ['HELLO', 4], 7)
+    
+    # A worker that claims a job and dies
+    abandoned = store.create('shout', {'text': 'again'}, 'batch')
+    assert store.claim(0.05, 2)['id'] == abandoned['id']
+    time.sleep(0.06)
+    assert store.claim(0.05, 2)['attempts'] == 2
+    time.sleep(0.06)
+    assert store.claim(0.05, 2) is None
+    assert store.get(abandoned['id'])['status'] == 'failed'
+
+def test_job_queue_renews_leases(tmp_path):
+    """Test that a job running past its lease isn't run again, and that a stale run can't store its result"""
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    queue = JobQueue(store=store, lease_seconds=0.1, max_attempts=2)
+    queue.handlers = {'slow': lambda: time.sleep(0.35) or {'success': True, 'data': 'done'}}
+    
+    job = queue.submit('slow', {}, 'batch')
+    worker = threading.Thread(target=queue.run_next)
+    worker.start()
+    time.sleep(0.25)
+    assert store.claim(0.1, 2) is None
+    worker.join()
+    assert store.get(job['id'])['status'] == 'completed'
+    
+    # A run whose lease expired and was claimed again
+    abandoned = store.create('slow', {}, 'batch')
+    first = store.claim(0.01, 2)
+    time.sleep(0.02)
+    second = store.claim(0.01, 2)
+    assert not store.renew(first['id'], first['attempts'], 0.01)
+    assert not store.finish(first['id'], first['attempts'], 'completed', {'success': True, 'data': 'stale'})
+    assert store.finish(second['id'], second['attempts'], 'completed', {'success': True, 'data': 'fresh'})
+    assert store.get(abandoned['id'])['result']['data'] == 'fresh'
+
+def test_image_gc_keeps_referenced_and_recent_images(tmp_path):
+    """Test that unreferenced images are deleted by age, then oldest first while over the quota"""
+    store = ContentAddressedImageStore(str(tmp_path / 'images'))
+    index = ImageIndex(str(tmp_path / 'index.sqlite3'))
+    now = time.time()
+    
+    def add(content, age, organization_id=1):
+        stored = store.save_b64(base64.b64encode(content).decode())
+        store.wait(stored['content_hash'])
+        index.record(stored['content_hash'], organization_id)
+        os.utime(stored['path'], (now - age, now - age))
+        return stored['path']
+    
+    aged = add(b'a' * 100, 40 * 86400, organization_id=2)
+    referenced = add(b'b' * 100, 40 * 86400)
+    oldest = add(b'c' * 100, 3 * 86400)
+    recent = add(b'd' * 100, 60)
+    references = referenced_image_names([f'{{"image": "/uploads/images/ab/{os.path.basename(referenced)}"}}'])
+    
+    report = ImageGarbageCollector(store, index, quota_bytes=250, batch_pause=0).collect(references)
+    
+    assert (report['deleted_files'], report['reclaimed_bytes']) == (2, 200)
+    assert [os.path.exists(path) for path in (aged, referenced, oldest, recent)] == [False, True, False, True]
+
+def test_media_pipeline_thumbnails_and_metadata(tmp_path):
+    """Test that images get WebP thumbnails and metadata as displayed, once rotated by their EXIF orientation"""
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (1200, 800), 'navy')
+    ImageDraw.Draw(image).rectangle([0, 0, 400, 800], fill='orange')
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees
+    exif[0x010F] = 'Canon'
+    image.save(str(tmp_path / 'photo.jpg'), exif=exif)
+    
+    metadata = process_image(str(tmp_path / 'photo.jpg'), str(tmp_path / 'thumbnails'), sizes=(160, 320))
+    
+    assert (metadata['width'], metadata['height']) == (800, 1200)
+    assert metadata['exif']['Make'] == 'Canon'
+    assert metadata['dominant_colors'][0]['color'].startswith('#0')
+    assert Image.open(metadata['thumbnails'][320]).size == (213, 320)
+    assert Image.open(metadata['thumbnails'][160]).format == 'WEBP'
+    assert perceptual_hash(image) == perceptual_hash(image.resize((300, 200)))
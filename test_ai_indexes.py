@@ -0,0 +1,62 @@
+"""
+Tests for the AI retrieval indexes
+"""
+
+import pytest
+from src.services.ai.faq_index import FAQIndex, FAQIndexStore
+
+def test_faq_index_search():
+    """Test BM25 ranking of FAQ entries"""
+    index = FAQIndex()
+    index.add_entry("Quels sont vos horaires d'ouverture ?", "Nous sommes ouverts de 9h à 18h.", 'hours')
+    index.add_entry("Livrez-vous à l'international ?", "Oui, nous livrons dans toute l'Europe.", 'shipping')
+    index.add_entry("Comment annuler ma commande ?", "Depuis votre espace client, rubrique commandes.", 'cancel')
+    
+    results = index.search("horaires d'ouverture", top_k=2)
+    
+    assert results[0]['id'] == 'hours'
+    assert results[0]['match_score'] > 0.8
+    assert index.search("météo demain") == []
+
+def test_faq_index_incremental_update():
+    """Test adding, replacing and removing FAQ entries"""
+    index = FAQIndex()
+    index.add_entry("Comment annuler ma commande ?", "Contactez-nous.", 'cancel')
+    index.add_entry("Comment annuler ma commande ?", "Depuis votre espace client.", 'cancel')
+    
+    assert len(index) == 1
+    assert index.search("annuler commande")[0]['answer'] == "Depuis votre espace client."
+    
+    assert index.remove_entry('cancel') is True
+    assert index.search("annuler commande") == []
+    assert index.doc_freqs == {}
+
+def test_faq_index_store_persistence(tmp_path):
+    """Test that organization indexes are persisted to disk"""
+    store = FAQIndexStore(storage_dir=str(tmp_path))
+    store.add_entries(1, [{'question': "Livrez-vous en Belgique ?", 'answer': "Oui."}])
+    
+    reloaded = FAQIndexStore(storage_dir=str(tmp_path))
+    
+    assert reloaded.search(1, "livraison Belgique")[0]['answer'] == "Oui."
+    assert reloaded.search(2, "livraison Belgique") == []
+
+def test_reply_index_near_duplicates():
+    """Test that near-duplicate comments match an approved reply"""
+    from src.services.ai.reply_index import ReplyIndex
+    
+    index = ReplyIndex()
+    index.add_pair("Love it!", "Merci beaucoup Julie ! 💙", author_name="Julie", entry_id='love')
+    index.add_pair("Where can I buy this?", "Disponible sur notre site, lien en bio !", entry_id='buy')
+    
+    assert index.find_similar("Looooove it!!")['id'] == 'love'
+    assert index.find_similar("where can i buy this")['similarity'] > 0.95
+    assert index.find_similar("Where can I buy this?", response_type='promotional') is None
+
+def test_adapt_reply():
+    """Test adapting an approved reply to a new comment author"""
+    from src.services.ai.reply_index import adapt_reply
+    
+    assert adapt_reply("Merci beaucoup @Julie !", "Julie", "Marc") == "Merci beaucoup @Marc !"
+    assert adapt_reply("Julie, merci pour ton retour", "Julie") == "Merci pour ton retour"
+    assert len(adapt_reply("Merci pour ton retour, on adore aussi", max_length=20)) <= 21
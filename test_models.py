@@ -7,6 +7,9 @@ from src.models.user import User
 from src.models.organization import Organization, OrganizationMember
 from src.models.social_account import SocialAccount
 from src.models.content import ContentTemplate, Post, PostSchedule
+from src.models.conversation import Conversation
+from src.models.brand_voice import BrandVoiceProfile
+from src.models.content_library import ContentLibrary, MediaAsset
 from src.models.base import db
 
 def test_user_model(app):
@@ -371,3 +374,94 @@ def test_post_schedule_model(app):
         # Check the relationship with the post
         assert queried_schedule.post.content == 'This is a scheduled post'
 
+def test_conversation_model(app):
+    """Test the Conversation model"""
+    with app.app_context():
+        # Create a user
+        user = User(email='conversation@example.com', name='Conversation User')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        
+        # Create a conversation with a few messages
+        conversation = Conversation(user_id=user.id, channel='dm')
+        conversation.add_message('user', 'Bonjour')
+        conversation.add_message('assistant', 'Bonjour, comment puis-je vous aider ?')
+        conversation.add_message('user', 'Où en est ma commande ?')
+        db.session.add(conversation)
+        db.session.commit()
+        
+        # Fold the first two messages into the summary
+        conversation.summary = 'Le client a salué la marque.'
+        conversation.summarized_message_count = 2
+        db.session.commit()
+        
+        # Query the conversation
+        queried_conversation = Conversation.query.get(conversation.id)
+        
+        # Check that the conversation was created correctly
+        assert queried_conversation.channel == 'dm'
+        assert len(queried_conversation.messages) == 3
+        assert [msg.content for msg in queried_conversation.unsummarized_messages] == ['Où en est ma commande ?']
+        assert queried_conversation.to_dict()['message_count'] == 3
+
+def test_brand_voice_profile_model(app):
+    """Test the BrandVoiceProfile model"""
+    with app.app_context():
+        # Create a user and an organization
+        user = User(email='brand_voice@example.com', name='Brand Owner')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        
+        org = Organization(name='Brand Organization', owner_id=user.id)
+        db.session.add(org)
+        db.session.commit()
+        
+        # Create a brand voice profile
+        profile = BrandVoiceProfile(
+            organization_id=org.id,
+            name='Chaleureux',
+            description='Proche de la communauté, tutoiement, emojis avec parcimonie.',
+            tone='amical'
+        )
+        profile.guidelines = {'do': ['Remercier la personne'], 'dont': ['Parler de la concurrence']}
+        compiled_prompt = profile.compile()
+        db.session.add(profile)
+        db.session.commit()
+        
+        # Check that the compiled prompt is stored and stable
+        queried_profile = BrandVoiceProfile.query.filter_by(organization_id=org.id).first()
+        assert queried_profile.compiled_prompt == compiled_prompt
+        assert queried_profile.compile() == compiled_prompt
+        assert '- Remercier la personne' in compiled_prompt
+        assert queried_profile in org.brand_voice_profiles
+
+def test_media_asset_model(app):
+    """Test the MediaAsset model"""
+    with app.app_context():
+        # Create a user, an organization and a library
+        user = User(email='media@example.com', name='Media Owner')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        
+        org = Organization(name='Media Organization', owner_id=user.id)
+        db.session.add(org)
+        db.session.commit()
+        
+        library = ContentLibrary(organization_id=org.id, name='Visuels')
+        db.session.add(library)
+        db.session.commit()
+        
+        # Create a media asset with metadata
+        asset = MediaAsset(library_id=library.id, type='image', url='https://cdn.example.com/visuel.png')
+        asset.asset_metadata = {'width': 1024, 'height': 1024}
+        db.session.add(asset)
+        db.session.commit()
+        
+        # Check that the metadata is stored as JSON and exposed as metadata
+        queried_asset = MediaAsset.query.get(asset.id)
+        assert queried_asset.asset_metadata == {'width': 1024, 'height': 1024}
+        assert queried_asset.to_dict()['metadata'] == {'width': 1024, 'height': 1024}
+        assert queried_asset in library.media_assets
@@ -8,6 +8,21 @@ from src.models.user import User
 from src.models.organization import Organization
 from src.models.base import db
 
+def _user_token(app, email):
+    """Create a user and get an authentication token for them"""
+    import jwt
+    import datetime
+    
+    with app.app_context():
+        user = User(email=email, name='Other User')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        return jwt.encode({
+            'user_id': user.id,
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+        }, app.config['SECRET_KEY'], algorithm='HS256')
+
 def test_index_route(client):
     """Test the index route"""
     response = client.get('/')
@@ -195,6 +210,313 @@ def test_ai_assistant_routes(client, auth_token, monkeypatch):
     # Restore the original method
     monkeypatch.setattr(TextGenerationService, 'generate_text', original_generate_text)
 
+def test_idempotency_key_replays_response(client, auth_token, monkeypatch):
+    """Test that a retried AI request with the same Idempotency-Key is not generated twice"""
+    from src.services.ai.text_generation import TextGenerationService
+    
+    calls = []
+    
+    def mock_generate_text(self, prompt, **kwargs):
+        calls.append(prompt)
+        return {'success': True, 'data': f"Generated text {len(calls)}"}
+    
+    monkeypatch.setattr(TextGenerationService, 'generate_text', mock_generate_text)
+    headers = {'Authorization': f'Bearer {auth_token}', 'Idempotency-Key': 'retry-1'}
+    
+    first = client.post('/api/ai/generate-text', json={'prompt': 'Test prompt'}, headers=headers)
+    retry = client.post('/api/ai/generate-text', json={'prompt': 'Test prompt'}, headers=headers)
+    reused = client.post('/api/ai/generate-text', json={'prompt': 'Other prompt'}, headers=headers)
+    
+    assert first.status_code == 200
+    assert retry.status_code == 200
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert json.loads(retry.data) == json.loads(first.data)
+    assert reused.status_code == 422
+    assert len(calls) == 1
+
+def test_chat_conversation_outside_organization(client, auth_token, monkeypatch, app):
+    """Test that conversations aren't attached to organizations the user isn't a member of"""
+    from types import SimpleNamespace
+    from src.services.ai.text_generation import TextGenerationService
+    
+    with app.app_context():
+        owner = User(email='other_owner@example.com', name='Other Owner')
+        owner.set_password('password123')
+        db.session.add(owner)
+        db.session.commit()
+        org = Organization(name='Other Organization', owner_id=owner.id)
+        db.session.add(org)
+        db.session.commit()
+        org_id = org.id
+    
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='Bonjour !'))])
+    monkeypatch.setattr(TextGenerationService, '_create_chat_completion', lambda self, operation, **kwargs: completion)
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/ai/chat', json={'message': 'Bonjour', 'organization_id': org_id}, headers=headers)
+    assert response.status_code == 200
+    conversation_id = json.loads(response.data)['data']['conversation_id']
+    
+    response = client.get(f'/api/ai/conversations/{conversation_id}', headers=headers)
+    assert json.loads(response.data)['data']['organization_id'] is None
+
+def test_generate_template_posts_rejects_invalid_dates(client, auth_token, app):
+    """Test that template post dates that aren't date strings are rejected"""
+    import jwt
+    from src.models.organization import OrganizationMember
+    from src.models.content import ContentTemplate
+    
+    with app.app_context():
+        user_id = jwt.decode(auth_token, app.config['SECRET_KEY'], algorithms=['HS256'])['user_id']
+        org = Organization(name='Template Organization', owner_id=user_id)
+        db.session.add(org)
+        db.session.commit()
+        db.session.add(OrganizationMember(organization_id=org.id, user_id=user_id, role='owner'))
+        template = ContentTemplate(organization_id=org.id, name='Promo')
+        template.content = {'text': 'Promo de la semaine'}
+        db.session.add(template)
+        db.session.commit()
+        template_id = template.id
+    
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    for dates in ({'start_date': 20260101, 'end_date': '2026-01-07'}, {'start_date': '2026-01-07', 'end_date': '2026-01-01'}):
+        response = client.post(f'/api/ai/templates/{template_id}/generate-posts',
+                               json=dict(dates, platforms=['instagram']), headers=headers)
+        assert response.status_code == 400
+
+def test_brand_voice_rejects_invalid_fields(client, auth_token, app):
+    """Test that brand voices with a description or guidelines of the wrong type are rejected"""
+    import jwt
+    from src.models.organization import OrganizationMember
+    
+    with app.app_context():
+        user_id = jwt.decode(auth_token, app.config['SECRET_KEY'], algorithms=['HS256'])['user_id']
+        org = Organization(name='Brand Organization', owner_id=user_id)
+        db.session.add(org)
+        db.session.commit()
+        db.session.add(OrganizationMember(organization_id=org.id, user_id=user_id, role='owner'))
+        db.session.commit()
+        org_id = org.id
+    
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    voice = {'name': 'Amical', 'description': 'Chaleureux et direct', 'guidelines': {'do': ['Tutoyer']}}
+    response = client.post(f'/api/organizations/{org_id}/brand-voices', json=voice, headers=headers)
+    assert response.status_code == 201
+    profile_id = json.loads(response.data)['brand_voice']['id']
+    
+    response = client.post(f'/api/organizations/{org_id}/brand-voices', json=dict(voice, guidelines=['Tutoyer']), headers=headers)
+    assert response.status_code == 400
+    for update in ({'description': None}, {'description': 42}, {'guidelines': 'Tutoyer'}, {'guidelines': {'do': 'Tutoyer'}}):
+        response = client.put(f'/api/organizations/{org_id}/brand-voices/{profile_id}', json=update, headers=headers)
+        assert response.status_code == 400
+    
+    response = client.put(f'/api/organizations/{org_id}/brand-voices/{profile_id}', json={'tone': 'joyeux'}, headers=headers)
+    assert response.status_code == 200
+
+def test_outreach_campaign_rejects_invalid_ids(client, auth_token):
+    """Test that invalid campaign IDs are rejected before the campaign is streamed"""
+    import jwt
+    user_id = jwt.decode(auth_token, 'test-secret-key', algorithms=['HS256'])['user_id']
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    campaign = {'campaign_info': {}, 'target_profiles': [], 'brand_voice': 'amical', 'platform': 'instagram'}
+    
+    for campaign_id in (42, ['x'], f"{user_id}_../../etc", 'other_campaign'):
+        response = client.post('/api/ai/outreach-campaigns', json=dict(campaign, campaign_id=campaign_id), headers=headers)
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Invalid campaign_id'
+
+def test_generate_image_returns_url(client, auth_token, monkeypatch):
+    """Test that the image routes return the URL of the image, and its bytes only when asked for"""
+    import os
+    from src.services.ai.image_generation import ImageGenerationService
+    
+    image_path = os.path.join(os.getcwd(), 'uploads', 'images', 'ab', 'abcd.png')
+    
+    def mock_generate_image(self, prompt, **kwargs):
+        return {'success': True, 'data': {'image_path': image_path, 'content_hash': 'abcd', 'prompt': prompt}}
+    
+    monkeypatch.setattr(ImageGenerationService, 'generate_image', mock_generate_image)
+    monkeypatch.setattr(ImageGenerationService, 'load_image_b64', lambda self, result: 'aW1hZ2U=')
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/ai/generate-image', json={'prompt': 'A cat'}, headers=headers)
+    data = json.loads(response.data)['data']
+    assert response.status_code == 200
+    assert data['image_url'] == '/uploads/images/ab/abcd.png'
+    assert 'image_data' not in data
+    
+    response = client.post('/api/ai/generate-image', json={'prompt': 'A cat', 'response_format': 'b64_json'}, headers=headers)
+    assert json.loads(response.data)['data']['image_data'] == 'aW1hZ2U='
+    
+    response = client.post('/api/ai/generate-image', json={'prompt': 'A cat', 'response_format': 'png'}, headers=headers)
+    assert response.status_code == 400
+
+def test_generate_social_media_image_rejects_invalid_platforms(client, auth_token):
+    """Test that social media images for platforms that aren't strings are rejected"""
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    for platforms in ({'platform': 42}, {'platform': None}, {'platforms': ['instagram', 7]}, {'platforms': 'instagram'}):
+        response = client.post('/api/ai/generate-social-media-image', json=dict(platforms, description='Soldes'), headers=headers)
+        assert response.status_code == 400
+    
+    response = client.post('/api/ai/generate-social-media-image',
+                           json={'platform': 'instagram', 'description': 'Soldes', 'crop_mode': 'stretch'}, headers=headers)
+    assert response.status_code == 400
+
+def test_generate_image_url_is_written(client, auth_token, monkeypatch):
+    """Test that the image routes only return the URL of an image once it is written"""
+    import os
+    import time
+    import base64
+    from src.services.ai.image_generation import ImageGenerationService
+    from src.services.ai.image_storage import ContentAddressedImageStore
+    
+    original_write = ContentAddressedImageStore._write
+    
+    def slow_write(self, path, image_b64):
+        time.sleep(0.2)
+        original_write(self, path, image_b64)
+    
+    def mock_generate_image(self, prompt, **kwargs):
+        stored = self.image_store.save_b64(base64.b64encode(f"image of {time.time()}".encode()).decode())
+        return {'success': True, 'data': {'image_path': stored['path'], 'content_hash': stored['content_hash'], 'prompt': prompt}}
+    
+    monkeypatch.setattr(ContentAddressedImageStore, '_write', slow_write)
+    monkeypatch.setattr(ImageGenerationService, 'generate_image', mock_generate_image)
+    
+    response = client.post('/api/ai/generate-image', json={'prompt': 'A cat'}, headers={'Authorization': f'Bearer {auth_token}'})
+    image_url = json.loads(response.data)['data']['image_url']
+    assert client.get(image_url).status_code == 200
+    
+    os.remove(os.path.join(os.getcwd(), image_url.lstrip('/')))
+
+def test_submit_ai_job(client, auth_token, monkeypatch, app):
+    """Test that AI operations are queued as jobs, readable by their owner only"""
+    import time
+    from src.services.ai.job_queue import get_job_queue
+    
+    # The workers of the app run the jobs, without calling the API
+    monkeypatch.setitem(get_job_queue().handlers, 'generate_hashtags', lambda **params: {'success': True, 'data': ['#SummerSale']})
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/ai/jobs', json={'operation': 'generate_hashtags', 'params': {'topic': 'Summer sale', 'platform': 'instagram'}}, headers=headers)
+    job = json.loads(response.data)['data']
+    assert response.status_code == 202
+    assert response.headers['Location'] == f"/api/ai/jobs/{job['id']}"
+    
+    for _ in range(50):
+        response = client.get(f"/api/ai/jobs/{job['id']}", headers=headers)
+        job = json.loads(response.data)['data']
+        if job['status'] == 'completed':
+            break
+        time.sleep(0.1)
+    assert job['result']['data'] == ['#SummerSale']
+    assert client.get('/api/ai/jobs/unknown', headers=headers).status_code == 404
+    
+    other_token = _user_token(app, 'job_reader@example.com')
+    for path in (f"/api/ai/jobs/{job['id']}", f"/api/ai/jobs/{job['id']}/events"):
+        assert client.get(path, headers={'Authorization': f'Bearer {other_token}'}).status_code == 404
+    
+    response = client.post('/api/ai/jobs', json={'operation': 'generate_hashtags', 'params': {'subject': 'x'}}, headers=headers)
+    assert response.status_code == 400
+    response = client.post('/api/ai/jobs', json={'operation': 'delete_everything'}, headers=headers)
+    assert response.status_code == 400
+
+def test_ai_job_events(client, auth_token, monkeypatch):
+    """Test that the events of a job are streamed until it is over"""
+    from src.services.ai.job_queue import get_job_queue
+    
+    monkeypatch.setitem(get_job_queue().handlers, 'generate_hashtags', lambda **params: {'success': True, 'data': ['#SummerSale']})
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    
+    response = client.post('/api/ai/jobs', json={'operation': 'generate_hashtags', 'params': {'topic': 'Summer sale', 'platform': 'instagram'}}, headers=headers)
+    job_id = json.loads(response.data)['data']['id']
+    
+    response = client.get(f"/api/ai/jobs/{job_id}/events", headers=headers)
+    assert response.mimetype == 'text/event-stream'
+    events = [event.split('\n') for event in response.get_data(as_text=True).strip().split('\n\n')]
+    assert events[-1][0] == 'event: completed'
+    assert json.loads(events[-1][1][len('data: '):])['result']['data'] == ['#SummerSale']
+
+def test_ai_job_checks_params(client, auth_token, app):
+    """Test that job params get the checks of the synchronous routes before being queued"""
+    with app.app_context():
+        owner = User(email='job_org_owner@example.com', name='Org Owner')
+        owner.set_password('password123')
+        db.session.add(owner)
+        db.session.commit()
+        org = Organization(name='Job Organization', owner_id=owner.id)
+        db.session.add(org)
+        db.session.commit()
+        org_id = org.id
+    
+    headers = {'Authorization': f'Bearer {auth_token}'}
+    comment = {'comment': 'Super produit', 'post_content': 'Nouveau produit', 'brand_voice': 'amical', 'organization_id': org_id}
+    response = client.post('/api/ai/jobs', json={'operation': 'generate_comment_response', 'params': comment}, headers=headers)
+    assert response.status_code == 403
+    
+    for params in ({'platform': 42, 'description': 'Soldes'},
+                   {'platform': 'instagram', 'description': 'Soldes', 'crop_mode': 'stretch'},
+                   {'platform': 'instagram', 'description': 'Soldes', 'response_format': 'b64_json'}):
+        response = client.post('/api/ai/jobs', json={'operation': 'generate_social_media_image', 'params': params}, headers=headers)
+        assert response.status_code == 400
+
+def test_media_pipeline_saves_results_to_asset(app):
+    """Test that the processing results of an image are merged into its media asset"""
+    from src.models.content_library import ContentLibrary, MediaAsset
+    from src.routes.ai_assistant import media_pipeline
+    
+    with app.app_context():
+        user = User(email='media_pipeline@example.com', name='Media User')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        org = Organization(name='Media Organization', owner_id=user.id)
+        db.session.add(org)
+        db.session.commit()
+        library = ContentLibrary(organization_id=org.id, name='Visuels')
+        db.session.add(library)
+        db.session.commit()
+        # Not in the uploads directory, so not processed when created
+        asset = MediaAsset(library_id=library.id, type='image', url='https://cdn.example.com/visuel.png')
+        asset.asset_metadata = {'source': 'upload'}
+        db.session.add(asset)
+        db.session.commit()
+        asset_id = asset.id
+    
+    media_pipeline.save(asset_id, {
+        'thumbnail_url': '/uploads/thumbnails/320/abcd.webp',
+        'metadata': {'width': 640, 'height': 480, 'media_status': 'processed'}
+    })
+    
+    with app.app_context():
+        data = MediaAsset.query.get(asset_id).to_dict()
+        assert data['thumbnail_url'] == '/uploads/thumbnails/320/abcd.webp'
+        assert data['metadata'] == {'source': 'upload', 'width': 640, 'height': 480, 'media_status': 'processed'}
+
+def test_image_gc_keeps_variants_of_media_assets(app):
+    """Test that the platform variants of a saved media asset count as referenced images"""
+    from src.models.content_library import ContentLibrary, MediaAsset
+    from src.routes.ai_assistant import image_generation_service
+    
+    with app.app_context():
+        user = User(email='image_gc@example.com', name='Image User')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        org = Organization(name='Image Organization', owner_id=user.id)
+        db.session.add(org)
+        db.session.commit()
+        library = ContentLibrary(organization_id=org.id, name='AI generations')
+        db.session.add(library)
+        db.session.commit()
+        asset = MediaAsset(library_id=library.id, type='image', url='https://cdn.example.com/master.png')
+        asset.asset_metadata = {'variants': {'x': '/uploads/images/cd/cdef.png'}}
+        db.session.add(asset)
+        db.session.commit()
+    
+    assert 'cdef.png' in image_generation_service.image_gc.referenced_names()
+
 def test_uploads_directory(client):
     """Test access to the uploads directory"""
     # Create a test file in the uploads directory
@@ -215,3 +537,25 @@ def test_uploads_directory(client):
     # Clean up
     os.remove(test_file_path)
 
+def test_uploads_conditional_and_range_requests(client):
+    """Test that content-hashed uploads are cached forever, revalidated by hash and served by range"""
+    import os
+    import hashlib
+    content_hash = hashlib.sha256(b'image').hexdigest()
+    image_dir = os.path.join(os.getcwd(), 'uploads', 'images', content_hash[:2])
+    os.makedirs(image_dir, exist_ok=True)
+    image_path = os.path.join(image_dir, f"{content_hash}.png")
+    with open(image_path, 'wb') as f:
+        f.write(b'0123456789')
+    url = f"/uploads/images/{content_hash[:2]}/{content_hash}.png"
+    
+    response = client.get(url)
+    assert response.headers['ETag'] == f'"{content_hash}"'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get(url, headers={'If-None-Match': f'"{content_hash}"'}).status_code == 304
+    
+    response = client.get(url, headers={'Range': 'bytes=2-4'})
+    assert response.status_code == 206
+    assert response.data == b'234'
+    
+    os.remove(image_path)
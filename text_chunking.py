@@ -0,0 +1,58 @@
+"""
+Text Chunking
+
+This module splits long texts into chunks on sentence boundaries so that they
+can be analyzed in parallel and the partial results reduced.
+"""
+
+import re
+from typing import List
+from .conversation_memory import estimate_tokens
+from .config import ANALYSIS_CHUNK_TOKENS
+
+# A sentence ends with terminal punctuation, or at a paragraph break
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+|\n\s*\n')
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a text into sentences"""
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text or '') if sentence.strip()]
+
+
+def chunk_text(text: str, max_tokens: int = ANALYSIS_CHUNK_TOKENS) -> List[str]:
+    """
+    Split a text into chunks of whole sentences
+
+    Sentences are packed greedily into chunks of at most max_tokens. A sentence
+    longer than a chunk is split on word boundaries.
+
+    Args:
+        text: The text to split
+        max_tokens: Maximum estimated number of tokens per chunk
+
+    Returns:
+        List of chunks, in the order of the text
+    """
+    max_chars = max_tokens * 4
+
+    pieces = []
+    for sentence in split_sentences(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks = []
+    current = []
+    for piece in pieces:
+        if current and estimate_tokens(' '.join(current + [piece])) > max_tokens:
+            chunks.append(' '.join(current))
+            current = []
+        current.append(piece)
+    if current:
+        chunks.append(' '.join(current))
+
+    return chunks
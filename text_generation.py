@@ -4,18 +4,154 @@ Text Generation Service
 This module provides text generation capabilities using OpenAI's API.
 """
 
+import json
 import time
-from typing import Dict, Any, List, Optional, Union
+import contextvars
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional, Union, Iterator
 from .base_service import BaseAIService
+from .structured_output import StructuredSchema
 from .config import (
     DEFAULT_TEXT_MODEL,
     FALLBACK_TEXT_MODEL,
     DEFAULT_TEMPERATURE,
     DEFAULT_MAX_TOKENS,
     REQUEST_TIMEOUT,
-    PROMPT_TEMPLATES
+    PROMPT_TEMPLATES,
+    PLATFORM_POST_LIMITS,
+    MAX_POST_VARIANTS,
+    POST_GENERATION_MAX_TOKENS,
+    TEMPLATE_POSTS_PER_REQUEST,
+    TEMPLATE_MAX_CONCURRENT_REQUESTS,
+    TEMPLATE_MAX_BULK_POSTS,
+    TEMPLATE_DEFAULT_POSTING_TIMES
 )
 
+
+def post_limits(platform: str, length: int, hashtag_count: int) -> Dict[str, int]:
+    """Clamp the requested post length and hashtag count to the limits of a platform"""
+    limits = PLATFORM_POST_LIMITS.get(platform.strip().lower(), {})
+    return {
+        'length': min(length, limits.get('max_length', length)),
+        'hashtag_count': min(hashtag_count, limits.get('max_hashtags', hashtag_count))
+    }
+
+
+def build_post_variants_schema(platforms: List[str]) -> StructuredSchema:
+    """Build the schema of a multi-platform, multi-variant post generation response"""
+    variant_schema = {
+        'type': 'object',
+        'properties': {
+            'text': {'type': 'string'},
+            'hashtags': {'type': 'array', 'items': {'type': 'string'}}
+        },
+        'required': ['text', 'hashtags'],
+        'additionalProperties': False
+    }
+    return StructuredSchema('post_variants', {
+        'type': 'object',
+        'properties': {
+            platform: {'type': 'array', 'items': variant_schema}
+            for platform in platforms
+        },
+        'required': list(platforms),
+        'additionalProperties': False
+    })
+
+
+def build_template_slots(start_date: str,
+                         end_date: str,
+                         targets: List[Dict[str, Any]],
+                         posting_times: Optional[List[str]] = None,
+                         max_posts: int = TEMPLATE_MAX_BULK_POSTS) -> List[Dict[str, Any]]:
+    """
+    Spread a series of posts over a date range
+
+    Args:
+        start_date: First day of the series (YYYY-MM-DD)
+        end_date: Last day of the series, included (YYYY-MM-DD)
+        targets: Where each post is published, as dictionaries with a 'platform'
+            and optionally a 'social_account_id'
+        posting_times: Times of day of the posts (HH:MM)
+        max_posts: Maximum number of posts in the series
+
+    Returns:
+        One slot per day, posting time and target, with its ISO 'scheduled_time'
+
+    Raises:
+        ValueError: If the dates are invalid or the series is too long
+    """
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+    if end < start:
+        raise ValueError("end_date must not be before start_date")
+    times = [datetime.strptime(value, '%H:%M').time() for value in posting_times or TEMPLATE_DEFAULT_POSTING_TIMES]
+
+    post_count = ((end - start).days + 1) * len(times) * len(targets)
+    if post_count > max_posts:
+        raise ValueError(f"Too many posts requested ({post_count}), the maximum is {max_posts}")
+
+    return [
+        dict(target, scheduled_time=datetime.combine(start + timedelta(days=day), posting_time).isoformat())
+        for day in range((end - start).days + 1)
+        for posting_time in times
+        for target in targets
+    ]
+
+
+TEMPLATE_POSTS_SCHEMA = StructuredSchema('template_posts', {
+    'type': 'object',
+    'properties': {
+        'posts': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'slot': {'type': 'integer'},
+                    'text': {'type': 'string'},
+                    'hashtags': {'type': 'array', 'items': {'type': 'string'}}
+                },
+                'required': ['slot', 'text', 'hashtags'],
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': ['posts'],
+    'additionalProperties': False
+})
+
+
+def fit_post(text: str, hashtags: List[str], length: int, hashtag_count: int) -> Dict[str, Any]:
+    """
+    Enforce the length and hashtag limits of a generated post
+
+    Args:
+        text: The body of the post, without hashtags
+        hashtags: The hashtags of the post
+        length: Maximum length of the post, hashtags included
+        hashtag_count: Maximum number of hashtags
+
+    Returns:
+        Dictionary with the 'text', 'hashtags' and full 'content' of the post
+    """
+    hashtags = [
+        tag if tag.startswith('#') else f"#{tag}"
+        for tag in (tag.strip().replace(' ', '') for tag in hashtags)
+        if tag.strip('#')
+    ][:hashtag_count]
+    suffix = ' '.join(hashtags)
+
+    # Keep the hashtags and shorten the body if the post is too long
+    available = length - (len(suffix) + 2 if suffix else 0)
+    text = text.strip()
+    if len(text) > available:
+        text = text[:max(available - 1, 0)].rsplit(' ', 1)[0].rstrip(',;:') + '…'
+
+    content = f"{text}\n\n{suffix}" if suffix else text
+    return {'text': text, 'hashtags': hashtags, 'content': content}
+
+
 class TextGenerationService(BaseAIService):
     """Service for generating text content using AI"""
     
@@ -28,7 +164,9 @@ class TextGenerationService(BaseAIService):
                      model: str = DEFAULT_TEXT_MODEL,
                      temperature: float = DEFAULT_TEMPERATURE,
                      max_tokens: int = DEFAULT_MAX_TOKENS,
-                     use_cache: bool = True) -> Dict[str, Any]:
+                     use_cache: bool = True,
+                     operation: str = 'generate_text',
+                     context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Generate text based on a prompt
         
@@ -38,14 +176,13 @@ class TextGenerationService(BaseAIService):
             temperature: Controls randomness (0.0-2.0)
             max_tokens: Maximum number of tokens to generate
             use_cache: Whether to use cached responses
+            operation: Name of the operation, used to route the request to its provider
+            context: The structured inputs of the operation, for providers that don't use the prompt
             
         Returns:
             Dictionary containing the generated text or error information
         """
         try:
-            # Check rate limits
-            self._rate_limit_check()
-            
             # Log the request
             self._log_request(
                 'generate_text',
@@ -55,7 +192,28 @@ class TextGenerationService(BaseAIService):
                 max_tokens=max_tokens
             )
             
-            # Check cache if enabled
+            def generate():
+                # Check rate limits
+                self._rate_limit_check(operation)
+                
+                # Make the API request
+                response = self._create_chat_completion(
+                    operation,
+                    context=context,
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": "You are a professional community manager assistant."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=REQUEST_TIMEOUT
+                )
+                
+                # Extract the generated text
+                return response.choices[0].message.content
+            
+            # Go through the cache if enabled
             if use_cache:
                 cache_key = self._generate_cache_key(
                     prompt=prompt,
@@ -63,33 +221,14 @@ class TextGenerationService(BaseAIService):
                     temperature=temperature,
                     max_tokens=max_tokens
                 )
-                cached_response = self._get_from_cache(cache_key)
-                if cached_response:
-                    return self._format_success_response(cached_response)
-            
-            # Make the API request
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a professional community manager assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            # Extract the generated text
-            generated_text = response.choices[0].message.content
+                generated_text, stale = self._get_cached(cache_key, generate)
+            else:
+                generated_text, stale = generate(), False
             
             # Log the response
             self._log_response('generate_text', generated_text)
             
-            # Cache the response if caching is enabled
-            if use_cache:
-                self._save_to_cache(cache_key, generated_text)
-            
-            return self._format_success_response(generated_text)
+            return self._format_success_response(generated_text, stale=stale)
             
         except Exception as e:
             # Try fallback model if primary fails
@@ -100,7 +239,9 @@ class TextGenerationService(BaseAIService):
                         model=FALLBACK_TEXT_MODEL,
                         temperature=temperature,
                         max_tokens=max_tokens,
-                        use_cache=use_cache
+                        use_cache=use_cache,
+                        operation=operation,
+                        context=context
                     )
                 except Exception as fallback_error:
                     return self._handle_error(fallback_error)
@@ -108,31 +249,48 @@ class TextGenerationService(BaseAIService):
                 return self._handle_error(e)
     
     def generate_post(self,
-                     platform: str,
+                     platform: Union[str, List[str]],
                      topic: str,
                      tone: str = "professionnel",
                      length: int = 280,
-                     hashtag_count: int = 3) -> Dict[str, Any]:
+                     hashtag_count: int = 3,
+                     variants: int = 1) -> Dict[str, Any]:
         """
         Generate a social media post
         
+        Several platforms or variants are generated together in a single
+        structured request, each platform within its own length and hashtag limits.
+        
         Args:
-            platform: The social media platform (e.g., "Instagram", "LinkedIn")
+            platform: The social media platform (e.g., "Instagram", "LinkedIn"), or a list of platforms
             topic: The topic of the post
             tone: The tone of the post (e.g., "professionnel", "décontracté")
             length: Maximum character length
             hashtag_count: Number of hashtags to include
+            variants: Number of variants to generate per platform
             
         Returns:
-            Dictionary containing the generated post or error information
+            Dictionary containing the generated post or error information. When
+            a list of platforms or several variants are requested, the data is a
+            dictionary of platform to its list of variants
         """
+        if isinstance(platform, list) or variants > 1:
+            platforms = [platform] if isinstance(platform, str) else platform
+            return self.generate_post_variants(
+                platforms=platforms,
+                topic=topic,
+                tone=tone,
+                length=length,
+                hashtag_count=hashtag_count,
+                variants=variants
+            )
+        
         # Format the prompt using the template
         prompt = PROMPT_TEMPLATES['post_generation'].format(
             platform=platform,
             topic=topic,
             tone=tone,
-            length=length,
-            hashtag_count=hashtag_count
+            **post_limits(platform, length, hashtag_count)
         )
         
         # Generate the post
@@ -141,6 +299,129 @@ class TextGenerationService(BaseAIService):
             max_tokens=min(1000, length // 2)  # Estimate tokens based on characters
         )
     
+    def generate_post_variants(self,
+                               platforms: List[str],
+                               topic: str,
+                               tone: str = "professionnel",
+                               length: int = 280,
+                               hashtag_count: int = 3,
+                               variants: int = 1,
+                               model: str = DEFAULT_TEXT_MODEL) -> Dict[str, Any]:
+        """
+        Generate variants of a post for several platforms in a single request
+        
+        Args:
+            platforms: The social media platforms
+            topic: The topic of the post
+            tone: The tone of the post
+            length: Maximum character length, lowered to the limit of each platform
+            hashtag_count: Number of hashtags, lowered to the limit of each platform
+            variants: Number of variants to generate per platform
+            model: The model to use for generation
+            
+        Returns:
+            Dictionary containing the variants of each platform, each with its
+            'variant' number, 'text', 'hashtags' and full 'content', or error information
+        """
+        try:
+            platforms = list(dict.fromkeys(platforms))
+            if not platforms:
+                raise ValueError("At least one platform is required")
+            variants = max(1, min(variants, MAX_POST_VARIANTS))
+            
+            # Log the request
+            self._log_request(
+                'generate_post_variants',
+                platforms=platforms,
+                topic=topic,
+                tone=tone,
+                variants=variants
+            )
+            
+            limits = {platform: post_limits(platform, length, hashtag_count) for platform in platforms}
+            
+            cache_key = self._generate_cache_key(
+                operation='generate_post_variants',
+                platforms=platforms,
+                topic=topic,
+                tone=tone,
+                limits=limits,
+                variants=variants,
+                model=model
+            )
+            
+            def generate():
+                # Check rate limits
+                self._rate_limit_check('generate_post_variants')
+                
+                # One brief per platform, from the same template as single posts
+                briefs = "\n".join(
+                    PROMPT_TEMPLATES['post_generation'].format(
+                        platform=platform,
+                        topic=topic,
+                        tone=tone,
+                        **limits[platform]
+                    )
+                    for platform in platforms
+                )
+                
+                # Create the prompt
+                prompt = f"""
+                Pour chacune des plateformes suivantes, génère {variants} variante(s) distincte(s) du post demandé.
+                Les variantes d'une même plateforme doivent différer par l'accroche, l'angle ou la structure,
+                afin de pouvoir être comparées en A/B test.
+                
+                Pour chaque variante, sépare le texte du post (sans hashtags) de la liste des hashtags.
+                La longueur maximale inclut les hashtags.
+                
+                {briefs}
+                """
+                
+                max_tokens = min(
+                    POST_GENERATION_MAX_TOKENS,
+                    sum(min(1000, limit['length'] // 2) for limit in limits.values()) * variants
+                )
+                
+                # Make the API request
+                generated = self._create_structured_completion(
+                    'generate_post_variants',
+                    build_post_variants_schema(platforms),
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": "You are a professional community manager assistant."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=DEFAULT_TEMPERATURE,
+                    max_tokens=max_tokens,
+                    timeout=REQUEST_TIMEOUT
+                )
+                
+                # Enforce the limits of each platform
+                posts = {
+                    platform: [
+                        dict(variant=index + 1, **fit_post(
+                            post['text'],
+                            post['hashtags'],
+                            limits[platform]['length'],
+                            limits[platform]['hashtag_count']
+                        ))
+                        for index, post in enumerate(generated[platform][:variants])
+                    ]
+                    for platform in platforms
+                }
+                return posts
+            
+            # Go through the cache
+            posts, stale = self._get_cached(cache_key, generate)
+            
+            # Log the response
+            self._log_response('generate_post_variants', posts)
+            
+            return self._format_success_response(posts, stale=stale)
+            
+        except Exception as e:
+            return self._handle_error(e)
+    
     def generate_comment_response(self,
                                  comment: str,
                                  context: str,
@@ -191,10 +472,13 @@ class TextGenerationService(BaseAIService):
             count=count
         )
         
-        # Generate the ideas
-        return self.generate_text(
-            prompt=prompt,
-            max_tokens=500
+        # Generate the ideas, reusing the ideas of a near-duplicate industry
+        return self._get_similar_cached(
+            'generate_content_ideas',
+            industry,
+            lambda: self.generate_text(prompt=prompt, max_tokens=500),
+            platform=platform.lower(),
+            count=count
         )
     
     def generate_hashtags(self,
@@ -219,30 +503,196 @@ class TextGenerationService(BaseAIService):
             count=count
         )
         
-        # Generate the hashtags
-        result = self.generate_text(
-            prompt=prompt,
-            max_tokens=200
-        )
-        
-        # If successful, process the hashtags
-        if result['success']:
-            # Extract hashtags from the text
-            text = result['data']
-            hashtags = []
+        def generate():
+            # Generate the hashtags
+            result = self.generate_text(
+                prompt=prompt,
+                max_tokens=200,
+                operation='generate_hashtags',
+                context={'topic': topic, 'platform': platform, 'count': count}
+            )
             
-            # Process the text to extract hashtags
-            for word in text.split():
-                word = word.strip().strip(',.;:!?"\'-()[]{}')
-                if word.startswith('#'):
-                    hashtags.append(word)
-                elif not word.startswith('#') and len(word) > 1:
-                    hashtags.append(f"#{word}")
+            # If successful, process the hashtags
+            if result['success']:
+                # Extract hashtags from the text
+                text = result['data']
+                hashtags = []
+                
+                # Process the text to extract hashtags
+                for word in text.split():
+                    word = word.strip().strip(',.;:!?"\'-()[]{}')
+                    if word.startswith('#'):
+                        hashtags.append(word)
+                    elif not word.startswith('#') and len(word) > 1:
+                        hashtags.append(f"#{word}")
+                
+                # Limit to the requested count
+                hashtags = hashtags[:count]
+                
+                return self._format_success_response(hashtags, stale=result.get('stale', False))
+            
+            return result
+        
+        # Reuse the hashtags of a near-duplicate topic
+        return self._get_similar_cached('generate_hashtags', topic, generate, platform=platform.lower(), count=count)
+    
+    def generate_template_posts(self,
+                                template: Dict[str, Any],
+                                slots: List[Dict[str, Any]],
+                                topic: Optional[str] = None,
+                                tone: str = "professionnel",
+                                length: int = 280,
+                                hashtag_count: int = 3,
+                                brand_voice_prompt: Optional[str] = None,
+                                posts_per_request: int = TEMPLATE_POSTS_PER_REQUEST,
+                                max_concurrent_requests: int = TEMPLATE_MAX_CONCURRENT_REQUESTS) -> Iterator[Dict[str, Any]]:
+        """
+        Generate a series of posts from a content template
+        
+        Slots are grouped by platform into structured requests of several posts,
+        which share the same template prefix and run concurrently within the rate limit.
+        
+        Args:
+            template: The content template, with its 'content' and 'platform_specific_settings'
+            slots: The posts to generate, each with a 'platform' and a 'scheduled_time'
+            topic: Optional theme of the series
+            tone: Default tone, overridden by the platform settings of the template
+            length: Default maximum length, overridden by the platform settings of the template
+            hashtag_count: Default number of hashtags, overridden by the platform settings of the template
+            brand_voice_prompt: Compiled brand voice profile, placed first in the prompt
+            posts_per_request: Number of posts per request
+            max_concurrent_requests: Number of requests running at the same time
             
-            # Limit to the requested count
-            hashtags = hashtags[:count]
+        Yields:
+            Progress events: 'started', then 'post' and 'error' events as requests
+            complete, each followed by a 'progress' event, and finally 'completed'
+        """
+        settings = {
+            platform.strip().lower(): value
+            for platform, value in (template.get('platform_specific_settings') or {}).items()
+            if isinstance(value, dict)
+        }
+        
+        # Group the slots by platform, since each platform has its own limits
+        by_platform = {}
+        for index, slot in enumerate(slots):
+            by_platform.setdefault(slot['platform'], []).append(index)
+        groups = [
+            (platform, indexes[i:i + posts_per_request])
+            for platform, indexes in by_platform.items()
+            for i in range(0, len(indexes), posts_per_request)
+        ]
+        
+        self._log_request(
+            'generate_template_posts',
+            template=template.get('name'),
+            topic=topic,
+            post_count=len(slots),
+            request_count=len(groups)
+        )
+        
+        completed = 0
+        failed = 0
+        yield {'type': 'started', 'total': len(slots), 'requests': len(groups)}
+        
+        with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+            futures = {}
+            for platform, group in groups:
+                platform_settings = settings.get(platform.strip().lower(), {})
+                limits = post_limits(
+                    platform,
+                    platform_settings.get('length', length),
+                    platform_settings.get('hashtag_count', hashtag_count)
+                )
+                future = executor.submit(
+                    contextvars.copy_context().run,
+                    self._generate_template_group,
+                    template, platform, platform_settings, limits, slots, group, topic, tone, brand_voice_prompt
+                )
+                futures[future] = group
             
-            return self._format_success_response(hashtags)
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    posts = future.result()
+                except Exception as e:
+                    posts = {}
+                    error = self._handle_error(e)
+                else:
+                    error = {'error': 'Invalid Response', 'message': 'No post generated for this slot'}
+                
+                for index in group:
+                    if index in posts:
+                        completed += 1
+                        yield dict(type='post', slot=index, **slots[index], **posts[index])
+                
+                missing = [index for index in group if index not in posts]
+                if missing:
+                    failed += len(missing)
+                    yield {'type': 'error', 'slots': missing, 'error': error['error'], 'message': error['message']}
+                
+                yield {'type': 'progress', 'completed': completed, 'failed': failed, 'total': len(slots)}
         
-        return result
-
+        self._log_response('generate_template_posts', f"{completed} generated, {failed} failed")
+        
+        yield {'type': 'completed', 'completed': completed, 'failed': failed, 'total': len(slots)}
+    
+    def _generate_template_group(self,
+                                 template: Dict[str, Any],
+                                 platform: str,
+                                 platform_settings: Dict[str, Any],
+                                 limits: Dict[str, int],
+                                 slots: List[Dict[str, Any]],
+                                 group: List[int],
+                                 topic: Optional[str],
+                                 tone: str,
+                                 brand_voice_prompt: Optional[str]) -> Dict[int, Dict[str, Any]]:
+        """Generate the posts of a group of slots of the same platform in a single request"""
+        # Check rate limits
+        self._rate_limit_check('generate_template_posts')
+        
+        template_content = template.get('content')
+        if not isinstance(template_content, str):
+            template_content = json.dumps(template_content, ensure_ascii=False)
+        
+        # The template part of the prompt is identical for every group so the provider can cache it
+        system_prompt = f"""
+        Tu es un community manager professionnel. Tu rédiges une série de posts à partir du modèle de contenu suivant,
+        en respectant sa structure et ses consignes, et en variant les accroches et les angles d'un post à l'autre.
+        
+        Modèle "{template.get('name', '')}": {template_content}
+        {f"Description du modèle: {template['description']}" if template.get('description') else ""}
+        """
+        
+        user_prompt = PROMPT_TEMPLATES['post_generation'].format(
+            platform=platform,
+            topic=topic or template.get('name', ''),
+            tone=platform_settings.get('tone', tone),
+            **limits
+        )
+        if platform_settings.get('instructions'):
+            user_prompt += f"\nConsignes pour {platform}: {platform_settings['instructions']}\n"
+        user_prompt += f"""
+        Rédige un post pour chacun des créneaux suivants, en tenant compte de la date de publication.
+        Sépare le texte du post (sans hashtags) de la liste des hashtags; la longueur maximale inclut les hashtags.
+        
+        Créneaux: {json.dumps([{'slot': index, 'date': slots[index]['scheduled_time']} for index in group])}
+        """
+        
+        # Make the API request
+        generated = self._create_structured_completion(
+            'generate_template_posts',
+            TEMPLATE_POSTS_SCHEMA,
+            model=DEFAULT_TEXT_MODEL,
+            messages=self._build_messages(system_prompt, user_prompt, brand_voice_prompt),
+            temperature=DEFAULT_TEMPERATURE,
+            max_tokens=min(POST_GENERATION_MAX_TOKENS, len(group) * (min(1000, limits['length'] // 2) + 20)),
+            timeout=REQUEST_TIMEOUT
+        )
+        
+        # Keep only the posts of the slots that were requested
+        return {
+            post['slot']: fit_post(post['text'], post['hashtags'], limits['length'], limits['hashtag_count'])
+            for post in generated['posts']
+            if post['slot'] in group
+        }
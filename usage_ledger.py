@@ -0,0 +1,264 @@
+"""
+Usage Ledger
+
+This module buffers the token usage and cost of AI requests in memory and
+writes them to the ledger table in bulk every few seconds. Buffered entries are
+appended to a journal file first, so that the entries of a crashed process are
+replayed when the ledger starts again. Entries that can't be written while
+others can are moved to a dead-letter file, so that they don't block the ledger.
+"""
+
+import os
+import json
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from .config import (
+    USAGE_LEDGER_JOURNAL_DIR,
+    USAGE_LEDGER_FLUSH_SECONDS,
+    USAGE_LEDGER_MAX_BUFFER,
+    USAGE_LEDGER_OUTAGE_ROWS,
+    AI_MODEL_PRICING
+)
+
+logger = logging.getLogger('ai_service')
+
+# File of the journal directory holding the entries the writer rejects
+DEAD_LETTER_FILE = 'dead_letter.jsonl'
+
+
+def usage_cost(model: Optional[str],
+               prompt_tokens: int,
+               cached_prompt_tokens: int,
+               completion_tokens: int) -> float:
+    """
+    Compute the cost in USD of a request
+
+    Dated model versions are priced as their model, and unknown models are free.
+    """
+    # Longest matching name, so that gpt-4o-mini isn't priced as gpt-4o
+    names = [name for name in AI_MODEL_PRICING if model and model.startswith(name)]
+    if not names:
+        return 0.0
+    pricing = AI_MODEL_PRICING[max(names, key=len)]
+    uncached_tokens = max(prompt_tokens - cached_prompt_tokens, 0)
+    return (
+        uncached_tokens * pricing['prompt']
+        + cached_prompt_tokens * pricing['cached_prompt']
+        + completion_tokens * pricing['completion']
+    ) / 1_000_000
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class UsageLedger:
+    """
+    Buffers usage entries and flushes them in bulk with a writer function
+
+    The ledger only records once started, so that scripts and tests using the
+    services without a database don't accumulate entries.
+    """
+
+    def __init__(self,
+                 journal_dir: str = USAGE_LEDGER_JOURNAL_DIR,
+                 flush_interval: float = USAGE_LEDGER_FLUSH_SECONDS,
+                 max_buffer: int = USAGE_LEDGER_MAX_BUFFER):
+        """
+        Initialize the ledger
+
+        Args:
+            journal_dir: Directory of the journal files of buffered entries
+            flush_interval: Seconds between two flushes
+            max_buffer: Number of buffered entries that triggers a flush before the interval
+        """
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.writer = None
+        self.buffer = []
+        self.segments = []  # closed journal files holding the buffered entries
+        self.journal = None
+        self.journal_path = os.path.join(journal_dir, f"{os.getpid()}.journal")
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+
+    def start(self, writer: Callable[[List[Dict[str, Any]]], Any]) -> None:
+        """
+        Start recording and flushing entries
+
+        Args:
+            writer: Function storing a list of entries, called from the flush thread
+        """
+        with self.lock:
+            if self.writer is not None:
+                return
+            self.writer = writer
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._recover()
+            self.journal = open(self.journal_path, 'a', encoding='utf-8')
+
+        threading.Thread(target=self._run, name='usage-ledger', daemon=True).start()
+        atexit.register(self.flush)
+
+    def record(self,
+               operation: str,
+               model: Optional[str],
+               provider: Optional[str],
+               prompt_tokens: int,
+               cached_prompt_tokens: int,
+               completion_tokens: int,
+               organization_id: Optional[int] = None,
+               user_id: Optional[int] = None) -> None:
+        """Buffer the usage of a request"""
+        if self.writer is None:
+            return
+
+        entry = {
+            'entry_id': uuid.uuid4().hex,
+            'organization_id': organization_id,
+            'user_id': user_id,
+            'operation': operation,
+            'model': model,
+            'provider': provider,
+            'prompt_tokens': prompt_tokens,
+            'cached_prompt_tokens': cached_prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': usage_cost(model, prompt_tokens, cached_prompt_tokens, completion_tokens),
+            'occurred_at': datetime.utcnow().isoformat()
+        }
+        with self.lock:
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+            self.buffer.append(entry)
+            full = len(self.buffer) >= self.max_buffer
+        if full:
+            self.wake.set()
+
+    def flush(self) -> int:
+        """
+        Write the buffered entries with the writer
+
+        When the bulk write fails, entries are written one by one. Entries that
+        fail while others are written are moved to the dead-letter file. When
+        none can be written, the ledger table is considered down: the entries
+        stay buffered, and their journal files stay on disk, until the next flush.
+
+        Returns:
+            The number of entries written
+        """
+        with self.flush_lock:
+            with self.lock:
+                if not self.buffer:
+                    return 0
+                entries, self.buffer = self.buffer, []
+                # Rotate the journal, so that new entries don't land in the file being written
+                self.journal.close()
+                segment = f"{self.journal_path}.{uuid.uuid4().hex}"
+                os.replace(self.journal_path, segment)
+                segments, self.segments = self.segments + [segment], []
+                self.journal = open(self.journal_path, 'a', encoding='utf-8')
+
+            try:
+                self.writer(entries)
+                written, rejected = entries, []
+            except Exception as e:
+                logger.error(f"Error writing {len(entries)} usage ledger entries: {str(e)}")
+                written, rejected = self._write_one_by_one(entries)
+
+            if not written:
+                with self.lock:
+                    self.buffer = entries + self.buffer
+                    self.segments = segments + self.segments
+                return 0
+
+            if rejected:
+                self._dead_letter(rejected)
+            for path in segments:
+                os.remove(path)
+            return len(written)
+
+    def _write_one_by_one(self, entries: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Write entries one by one, returning the written and the rejected entries"""
+        written, rejected = [], []
+        # Newest first, as entries kept by earlier flushes are the likeliest to fail
+        for entry in reversed(entries):
+            try:
+                self.writer([entry])
+                written.append(entry)
+            except Exception:
+                rejected.append(entry)
+                if not written and len(rejected) >= USAGE_LEDGER_OUTAGE_ROWS:
+                    break
+        return written, rejected
+
+    def _dead_letter(self, entries: List[Dict[str, Any]]) -> None:
+        """Append entries the writer rejects to the dead-letter file"""
+        path = os.path.join(self.journal_dir, DEAD_LETTER_FILE)
+        with open(path, 'a', encoding='utf-8') as dead_letter_file:
+            for entry in entries:
+                dead_letter_file.write(json.dumps(entry) + '\n')
+            dead_letter_file.flush()
+            os.fsync(dead_letter_file.fileno())
+        logger.error(f"Moved {len(entries)} usage ledger entries that can't be written to {path}")
+
+    def _run(self) -> None:
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing the usage ledger: {str(e)}")
+
+    def _recover(self) -> None:
+        """Buffer the journaled entries of processes that stopped before flushing them"""
+        for name in sorted(os.listdir(self.journal_dir)):
+            pid = name.split('.')[0]
+            if not pid.isdigit() or (int(pid) != os.getpid() and _process_alive(int(pid))):
+                continue
+            # Take ownership of the file first, so that a single process replays it
+            path = f"{self.journal_path}.{uuid.uuid4().hex}"
+            try:
+                os.replace(os.path.join(self.journal_dir, name), path)
+            except FileNotFoundError:
+                continue
+
+            entries = []
+            with open(path, 'r', encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Entry torn by the crash
+                        continue
+            if entries:
+                logger.info(f"Recovered {len(entries)} usage ledger entries from {name}")
+                self.buffer.extend(entries)
+                self.segments.append(path)
+            else:
+                os.remove(path)
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Get the usage ledger shared by every AI service of the process"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger()
+        return _ledger